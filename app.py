@@ -1,66 +1,3150 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, g, abort, has_app_context, session, make_response
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from datetime import datetime
+from sqlalchemy import create_engine, event, func, inspect, text, select, update, insert, literal, tuple_, bindparam
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, date, timedelta
 import os
+import re
+import sys
+import io
+import csv
+import gzip
 import json
+import shutil
+import tempfile
+import time
+import math
+import socket
+import functools
+import bisect
+import heapq
+import threading
+import sqlite3
+import random
+import hmac
+import hashlib
+import http.server
+import urllib.request
+from collections import namedtuple, OrderedDict
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import click
+import numpy as np
 
 # Create the application
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hostel.db'
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///hostel.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))  # per engine, per worker process
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = 10
+app.config['SQLITE_BUSY_TIMEOUT'] = 15
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+app.config['DEFAULT_HOSTEL'] = 'main'
+app.config['HOSTEL_DOMAIN'] = os.environ.get('HOSTEL_DOMAIN')
+app.config['HOSTEL_DIRECTORY_TTL'] = 10
+app.config['HOSTEL_FANOUT_WORKERS'] = 8
+app.config['FRAGMENT_CACHE_SIZE'] = 256
+app.config['FRAGMENT_CACHE_PATH'] = os.environ.get('FRAGMENT_CACHE_PATH')
+app.config['JOB_RUNNER_ENABLED'] = True
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_MAX_RUNNING'] = 2
+app.config['JOB_STALE_SECONDS'] = 60
+app.config['JOB_MAX_ATTEMPTS'] = 3
+app.config['JOB_RESULTS_DIR'] = os.path.join(app.instance_path, 'jobs')
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', os.path.join(app.instance_path, 'backups'))
+app.config['BACKUP_INTERVAL_HOURS'] = 24
+app.config['BACKUP_KEEP'] = 14
+app.config['BACKUP_PAGES'] = 256
+app.config['BACKUP_PAUSE'] = 0.005
+app.config['READ_REPLICA'] = os.environ.get('READ_REPLICA')  # None, 'copy' or 'wal'
+app.config['REPLICA_DIR'] = os.path.join(app.instance_path, 'replicas')
+app.config['REPLICA_MAX_STALENESS'] = 5
+app.config['REPLICA_REFRESH_SECONDS'] = 2
+app.config['REPLICA_SLOW_RETRY_SECONDS'] = 300
+app.config['AUDIT_SNAPSHOT_ENTRIES'] = 500
+app.config['SIMULATION_WORKERS'] = None  # one process per CPU
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+app.config['RATE_LIMIT_PATH'] = os.environ.get('RATE_LIMIT_PATH', os.path.join(app.instance_path, 'ratelimit.db'))
+# endpoint: (tokens per second, burst); 'api' covers every other /api/ route,
+# each with its own bucket, and login only counts POSTs
+app.config['RATE_LIMITS'] = {
+    'login': (0.1, 10),
+    'api_audit_logs': (0.5, 10),
+    'api': (5, 50),
+}
+# endpoint: requests that may run at once across all workers
+app.config['CONCURRENCY_LIMITS'] = {
+    'audit_logs': 2,
+    'api_audit_logs': 2,
+    'api_analytics': 1,
+    'api_history': 2,
+    'api_hostels': 2,
+}
+app.config['CONCURRENCY_LEASE_SECONDS'] = 120
+app.config['WEBHOOK_DISPATCHER_ENABLED'] = True
+app.config['WEBHOOK_BATCH_SIZE'] = 100
+app.config['WEBHOOK_TIMEOUT'] = 5
+app.config['WEBHOOK_POLL_SECONDS'] = 5
+app.config['WEBHOOK_BACKOFF_BASE'] = 2
+app.config['WEBHOOK_BACKOFF_MAX'] = 3600
+app.config['WEBHOOK_RETENTION_DAYS'] = 7
+
+# Each hostel has its own SQLite database. The main database holds the
+# user and hostel directory tables and doubles as the default hostel;
+# every other table is read from the database of the hostel the request
+# was routed to (see select_hostel).
+DIRECTORY_TABLES = {'user', 'hostel'}
+
+class HostelSession(FlaskSession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        if mapper is not None and inspect(mapper).local_table.name in DIRECTORY_TABLES:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if has_app_context() and g.get('read_replica'):
+            return read_replicas.engine()
+        return hostel_engine()
+
+# Engine settings shared by the main and hostel databases. Each request
+# thread (or greenlet under gevent) checks a connection out of the pool for
+# the length of its app context; the pool is sized from the worker's thread
+# count by gunicorn.conf.py. Pooled connections move between threads, so
+# SQLite's same-thread check is off. WAL lets readers run alongside the
+# single writer, and writers wait on the busy timeout instead of failing.
+def engine_options(url):
+    options = {'pool_size': app.config['DB_POOL_SIZE'], 'max_overflow': app.config['DB_MAX_OVERFLOW'],
+               'pool_timeout': app.config['DB_POOL_TIMEOUT']}
+    if not url.startswith('sqlite'):
+        return options
+    if ':memory:' in url or url.rstrip('/') == 'sqlite:':
+        return {}
+    return dict(options, connect_args={'check_same_thread': False, 'timeout': app.config['SQLITE_BUSY_TIMEOUT']})
+
+def configure_sqlite(engine):
+    mode = app.config['SQLITE_JOURNAL_MODE']
+    if engine.dialect.name != 'sqlite' or not mode or engine.url.database in (None, '', ':memory:'):
+        return engine
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={mode}')
+        if mode.lower() == 'wal':
+            # Durable at checkpoints rather than every commit; a crash can
+            # lose the last transactions but never corrupts the file
+            cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+    return engine
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+db = SQLAlchemy(app, session_options={'class_': HostelSession})
+with app.app_context():
+    configure_sqlite(db.engine)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# Floor is the room number without its last two digits ('203' -> 2)
+def room_floor(room_number):
+    match = re.match(r'\D*(\d+)', room_number or '')
+    if not match:
+        return None
+    digits = match.group(1)
+    return int(digits[:-2]) if len(digits) > 2 else 0
+
+def _default_floor(context):
+    return room_floor(context.get_current_parameters().get('room_number'))
+
 # Define models
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(120), nullable=False)
     role = db.Column(db.String(20), nullable=False)
+    hostel = db.Column(db.String(50))  # slug of the only hostel this user may manage
+
+class Hostel(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(50), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    database = db.Column(db.String(300), nullable=False)  # path relative to the instance folder
+
+# Directory of hostels, reloaded from the main database every
+# HOSTEL_DIRECTORY_TTL seconds. Shard engines are created on first use.
+class HostelDirectory:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hostels = {}
+        self.loaded_at = None
+        self.engines = {}
+
+    def all(self):
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at > app.config['HOSTEL_DIRECTORY_TTL']:
+            with db.engine.connect() as conn:
+                rows = conn.execute(select(Hostel.slug, Hostel.name, Hostel.database).order_by(Hostel.slug)).all()
+            self.hostels = {row.slug: row for row in rows}
+            self.loaded_at = now
+        return self.hostels
+
+    def refresh(self):
+        self.loaded_at = None
+
+    def engine(self, slug):
+        engine = self.engines.get(slug)
+        if engine is None:
+            hostel = self.all().get(slug)
+            if hostel is None:
+                raise LookupError(f'Unknown hostel {slug}')
+            with self.lock:
+                engine = self.engines.get(slug)
+                if engine is None:
+                    path = os.path.join(app.instance_path, hostel.database)
+                    url = f'sqlite:///{path}'
+                    engine = self.engines[slug] = configure_sqlite(create_engine(url, **engine_options(url)))
+        return engine
+
+hostel_directory = HostelDirectory()
+
+def current_hostel():
+    if has_app_context():
+        return g.get('hostel', app.config['DEFAULT_HOSTEL'])
+    return app.config['DEFAULT_HOSTEL']
+
+def hostel_engine(slug=None):
+    slug = slug or current_hostel()
+    if slug == app.config['DEFAULT_HOSTEL']:
+        return db.engine
+    return hostel_directory.engine(slug)
+
+def hostel_slugs():
+    return [app.config['DEFAULT_HOSTEL']] + list(hostel_directory.all())
+
+def hostel_name(slug):
+    hostel = hostel_directory.all().get(slug)
+    return hostel.name if hostel else 'KnK Hostel'
+
+# In-process state (indexes, caches) kept separately for every hostel
+class PerHostel:
+    def __init__(self, factory):
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.instances = {}
+
+    def current(self):
+        slug = current_hostel()
+        instance = self.instances.get(slug)
+        if instance is None:
+            with self.lock:
+                instance = self.instances.get(slug)
+                if instance is None:
+                    instance = self.instances[slug] = self.factory(slug)
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+# Requests under /h/<slug>/ or on <slug>.HOSTEL_DOMAIN are routed to that
+# hostel. The prefix moves into SCRIPT_NAME so url_for keeps it.
+class HostelRouting:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        environ['hostel.root'] = environ.get('SCRIPT_NAME', '')
+        match = re.match(r'/h/([a-z0-9-]+)(/.*)?$', environ.get('PATH_INFO', ''))
+        if match:
+            environ['hostel.slug'] = match.group(1)
+            environ['SCRIPT_NAME'] = environ['hostel.root'] + '/h/' + match.group(1)
+            environ['PATH_INFO'] = match.group(2) or '/'
+        elif app.config['HOSTEL_DOMAIN']:
+            host = environ.get('HTTP_HOST', '').split(':')[0]
+            suffix = '.' + app.config['HOSTEL_DOMAIN']
+            if host.endswith(suffix):
+                environ['hostel.slug'] = host[:-len(suffix)]
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = HostelRouting(app.wsgi_app)
+
+# Command line option selecting the hostel a maintenance command runs on
+def hostel_option(command):
+    @click.option('--hostel', 'hostel_slug', default=None, help='Hostel slug (defaults to the main database).')
+    @functools.wraps(command)
+    def wrapper(*args, hostel_slug=None, **kwargs):
+        if hostel_slug and hostel_slug not in hostel_slugs():
+            raise click.BadParameter(f'unknown hostel {hostel_slug}', param_hint='--hostel')
+        g.hostel = hostel_slug or app.config['DEFAULT_HOSTEL']
+        return command(*args, **kwargs)
+    return wrapper
 
 class Room(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     room_number = db.Column(db.String(10), unique=True, nullable=False)
     capacity = db.Column(db.Integer, nullable=False)
-    occupied = db.Column(db.Integer, default=0)
-    
+    occupied = db.Column(db.Integer, default=0, index=True)
+    floor = db.Column(db.Integer, index=True, default=_default_floor)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+    # Bit n - 1 is set while bed n is taken
+    bed_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def free_mask(self):
+        return ~(self.bed_mask or 0) & ((1 << self.capacity) - 1)
+
+    def first_free_bed(self):
+        free = self.free_mask()
+        return (free & -free).bit_length() or None
+
+    # Free beds among beds first..last, e.g. one bunk or one side of a room
+    def free_beds_in(self, first, last):
+        block = ((1 << (last - first + 1)) - 1) << (first - 1)
+        return bin(self.free_mask() & block).count('1')
+
+    def bed_map(self):
+        mask = self.bed_mask or 0
+        return [bool(mask >> bed & 1) for bed in range(self.capacity)]
+
+    # Keep occupied and bed_mask moving together; take_bed returns None
+    # only when the counter has drifted from the bitmap
+    def take_bed(self):
+        bed = self.first_free_bed()
+        if bed is not None:
+            self.bed_mask = (self.bed_mask or 0) | 1 << (bed - 1)
+        self.occupied += 1
+        return bed
+
+    def release_bed(self, bed):
+        if bed:
+            self.bed_mask = (self.bed_mask or 0) & ~(1 << (bed - 1))
+        freed = 1 if self.occupied > 0 else 0
+        self.occupied -= freed
+        return freed
+
+# Beds are bits of a signed 64-bit SQLite integer
+MAX_BEDS = 63
+
+def beds_of(mask):
+    beds = []
+    while mask:
+        low = mask & -mask
+        beds.append(low.bit_length())
+        mask ^= low
+    return beds
+
+db.Index('ix_room_free_beds', Room.capacity - Room.occupied)
+
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     student_id = db.Column(db.String(20), unique=True, nullable=False)
-    room_id = db.Column(db.Integer, db.ForeignKey('room.id'))
-    check_in_date = db.Column(db.DateTime, nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), index=True)
+    check_in_date = db.Column(db.DateTime, nullable=False, index=True)
+    bed_number = db.Column(db.Integer)
     room = db.relationship('Room', backref=db.backref('students', lazy=True))
 
+db.Index('ix_student_bed', Student.room_id, Student.bed_number, unique=True)
+
+# After a capacity cut, move students from beds past the new capacity
+# into free beds below it
+def compact_beds(room):
+    outside = (room.bed_mask or 0) >> room.capacity << room.capacity
+    if not outside:
+        return []
+    moved = Student.query.filter(Student.room_id == room.id, Student.bed_number.in_(beds_of(outside))).all()
+    room.bed_mask &= (1 << room.capacity) - 1
+    for student in moved:
+        student.bed_number = None
+    db.session.flush()
+    for student in moved:
+        student.bed_number = room.first_free_bed()
+        room.bed_mask |= 1 << (student.bed_number - 1)
+    return moved
+
+# Give students from before bed tracking a bed, filling each room's
+# lowest free beds
+def assign_missing_beds():
+    room_ids = [room_id for (room_id,) in db.session.query(Student.room_id).distinct()
+                .filter(Student.bed_number.is_(None), Student.room_id.isnot(None))]
+    for room in Room.query.filter(Room.id.in_(room_ids)):
+        students = Student.query.filter_by(room_id=room.id).order_by(Student.check_in_date, Student.id).all()
+        mask = 0
+        for student in students:
+            if student.bed_number:
+                mask |= 1 << (student.bed_number - 1)
+        for student in students:
+            if not student.bed_number:
+                free = ~mask & ((1 << MAX_BEDS) - 1)
+                student.bed_number = (free & -free).bit_length()
+                mask |= 1 << (student.bed_number - 1)
+        room.bed_mask = mask
+    db.session.commit()
+    return len(room_ids)
+
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     action = db.Column(db.String(50), nullable=False)
     entity_type = db.Column(db.String(50), nullable=False)
     entity_id = db.Column(db.Integer, nullable=True)
     details = db.Column(db.Text, nullable=True)
+    data = db.Column(db.Text, nullable=True)  # JSON, enough to replay room and student changes
+    # Generated from data and indexed, so filtering by room or student is a
+    # lookup rather than a LIKE over details
+    room_number = db.Column(db.String(20), db.Computed("json_extract(data, '$.room_number')"), index=True)
+    student_id = db.Column(db.String(20), db.Computed("json_extract(data, '$.student_id')"), index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     timestamp = db.Column(db.DateTime, default=datetime.now)
     user = db.relationship('User', backref=db.backref('audit_logs', lazy=True))
     
+    # Routes that change rooms or students pass commit=False and log before
+    # their own commit, so the entry and the change land together
     @classmethod
-    def log(cls, action, entity_type, entity_id=None, details=None):
+    def log(cls, action, entity_type, entity_id=None, details=None, data=None, commit=True):
         log_entry = cls(
             action=action,
             entity_type=entity_type,
             entity_id=entity_id,
             details=details,
-            user_id=current_user.id if not current_user.is_anonymous else None
+            data=json.dumps(data, default=str) if data is not None else None,
+            user_id=current_user.id if not current_user.is_anonymous else None,
+            timestamp=datetime.now()
         )
         db.session.add(log_entry)
-        db.session.commit()
+        AuditRollup.increment(log_entry)
+        if commit:
+            db.session.commit()
         return log_entry
 
+# Per-day audit counts by action, entity type and user, maintained by
+# AuditLog.log so facet reads never touch audit_log itself. user_id 0
+# stands for entries without a user.
+class AuditRollup(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    action = db.Column(db.String(50), primary_key=True)
+    entity_type = db.Column(db.String(50), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def increment(cls, log_entry):
+        stmt = sqlite_insert(cls).values(
+            day=log_entry.timestamp.date(), action=log_entry.action,
+            entity_type=log_entry.entity_type, user_id=log_entry.user_id or 0, count=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'action', 'entity_type', 'user_id'],
+            set_={'count': cls.count + 1})
+        db.session.execute(stmt)
+
+# Bed bookings for future stays. end_date is the check-out day, so a
+# reservation holds a bed for the nights start_date .. end_date - 1.
+class Reservation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    student_id = db.Column(db.String(20), nullable=False, index=True)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='reserved')
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    room = db.relationship('Room', backref=db.backref('reservations', lazy=True))
+
+    __table_args__ = (
+        db.Index('ix_reservation_window', 'status', 'end_date', 'start_date'),
+    )
+
+# Students waiting for a bed. The queue index orders waiting entries by
+# priority then arrival, so taking the next entry is a single index seek.
+class WaitlistEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    student_id = db.Column(db.String(20), nullable=False, index=True)
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='waiting')
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    assigned_at = db.Column(db.DateTime, nullable=True)
+    room = db.relationship('Room')
+
+db.Index('ix_waitlist_queue', WaitlistEntry.status, WaitlistEntry.room_id,
+         WaitlistEntry.priority.desc(), WaitlistEntry.id)
+
+# Single-row counter bumped in every transaction that changes rooms or
+# students; in-process caches compare against it to detect writes made by
+# other workers
+class DataVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def bump_data_version():
+    stmt = sqlite_insert(DataVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'version': DataVersion.version + 1})
+    db.session.execute(stmt)
+    return current_data_version()
+
+def current_data_version():
+    return db.session.execute(text('SELECT version FROM data_version WHERE id = 1')).scalar() or 0
+
+# Daily occupancy history. Rows are only written on days when something
+# changed; readers carry the last known value forward.
+class RoomOccupancyDaily(db.Model):
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    occupied = db.Column(db.Integer, nullable=False, default=0)
+    capacity = db.Column(db.Integer, nullable=False, default=0)
+    peak = db.Column(db.Integer, nullable=False, default=0)
+
+class HostelOccupancyDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    occupied = db.Column(db.Integer, nullable=False, default=0)
+    capacity = db.Column(db.Integer, nullable=False, default=0)
+    peak = db.Column(db.Integer, nullable=False, default=0)
+
+# Known formats of AuditLog.details written by the routes below
+AUDIT_DETAIL_PATTERNS = {
+    ('add', 'room'): re.compile(r'^Room (?P<room_number>.+) with capacity (?P<capacity>\d+) added$'),
+    ('update', 'room'): re.compile(r'^Room (?P<room_number>.+) capacity changed from (?P<old_capacity>\d+) to (?P<new_capacity>\d+)$'),
+    ('add', 'student'): re.compile(r'^Student (?P<name>.*) \(ID: (?P<student_id>.*)\) added to room (?P<room_number>.+)$'),
+    ('remove', 'student'): re.compile(r'^Student (?P<name>.*) \(ID: (?P<student_id>.*)\) removed from room (?P<room_number>.+)$'),
+}
+
+def parse_audit_details(action, entity_type, details):
+    pattern = AUDIT_DETAIL_PATTERNS.get((action, entity_type))
+    if pattern is None or not details:
+        return None
+    match = pattern.match(details)
+    return match.groupdict() if match else None
+
+AUDIT_INTEGER_FIELDS = ('capacity', 'old_capacity', 'new_capacity')
+
+# Fill AuditLog.data for entries written before it existed, from their
+# details text. Batches walk the id index and commit separately, so writers
+# are never blocked for long; entries whose text does not parse stay empty.
+def migrate_audit_data(batch_size=1000, progress=None):
+    pending = (AuditLog.data.is_(None)) & tuple_(AuditLog.action, AuditLog.entity_type).in_(list(AUDIT_DETAIL_PATTERNS))
+    total = db.session.query(func.count(AuditLog.id)).filter(pending).scalar()
+    last_id = migrated = unparsed = 0
+    while True:
+        rows = db.session.execute(
+            select(AuditLog.id, AuditLog.action, AuditLog.entity_type, AuditLog.entity_id, AuditLog.details)
+            .where(pending, AuditLog.id > last_id).order_by(AuditLog.id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            data = parse_audit_details(row.action, row.entity_type, row.details)
+            if data is None:
+                unparsed += 1
+                continue
+            for field in AUDIT_INTEGER_FIELDS:
+                if field in data:
+                    data[field] = int(data[field])
+            data['room_id' if row.entity_type == 'room' else 'id'] = row.entity_id
+            updates.append({'id': row.id, 'data': json.dumps(data)})
+        if updates:
+            db.session.execute(update(AuditLog), updates)
+        db.session.commit()
+        migrated += len(updates)
+        if progress is not None:
+            progress(migrated + unparsed, total)
+    return {'migrated': migrated, 'unparsed': unparsed}
+
+@app.cli.command('migrate-audit-data')
+@click.option('--batch-size', default=1000, show_default=True)
+@hostel_option
+def migrate_audit_data_command(batch_size):
+    result = migrate_audit_data(batch_size)
+    click.echo(f"Added structured data to {result['migrated']} audit entries; "
+               f"{result['unparsed']} entries did not match a known format")
+
+def record_occupancy(room, occupied_delta=0, capacity_delta=0):
+    # Called inside the mutating transaction, after room has been changed
+    today = date.today()
+    db.session.flush()
+
+    stmt = sqlite_insert(RoomOccupancyDaily).values(
+        room_id=room.id, day=today,
+        occupied=room.occupied, capacity=room.capacity, peak=room.occupied)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['room_id', 'day'],
+        set_={
+            'occupied': stmt.excluded.occupied,
+            'capacity': stmt.excluded.capacity,
+            'peak': func.max(RoomOccupancyDaily.peak, stmt.excluded.occupied),
+        })
+    db.session.execute(stmt)
+
+    # Hostel-wide totals are adjusted by delta; the first change of a day
+    # starts from the previous day's totals
+    latest = HostelOccupancyDaily.query.filter(HostelOccupancyDaily.day <= today) \
+        .order_by(HostelOccupancyDaily.day.desc()).first()
+    if latest is not None:
+        occupied = latest.occupied + occupied_delta
+        capacity = latest.capacity + capacity_delta
+    else:
+        occupied, capacity = db.session.query(
+            func.coalesce(func.sum(Room.occupied), 0),
+            func.coalesce(func.sum(Room.capacity), 0)).one()
+    stmt = sqlite_insert(HostelOccupancyDaily).values(
+        day=today, occupied=occupied, capacity=capacity, peak=occupied)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day'],
+        set_={
+            'occupied': HostelOccupancyDaily.occupied + occupied_delta,
+            'capacity': HostelOccupancyDaily.capacity + capacity_delta,
+            'peak': func.max(HostelOccupancyDaily.peak, HostelOccupancyDaily.occupied + occupied_delta),
+        })
+    db.session.execute(stmt)
+    db.session.expire_all()
+
+def occupancy_series(start, end, room_id=None):
+    # Bounded range read: rows inside [start, end] plus the last row before
+    # start, forward-filled into one entry per day
+    if room_id is None:
+        model = HostelOccupancyDaily
+        base = model.query
+    else:
+        model = RoomOccupancyDaily
+        base = model.query.filter(model.room_id == room_id)
+
+    previous = base.filter(model.day < start).order_by(model.day.desc()).first()
+    rows = {row.day: row for row in
+            base.filter(model.day >= start, model.day <= end).order_by(model.day).all()}
+
+    occupied = previous.occupied if previous else 0
+    capacity = previous.capacity if previous else 0
+    series = []
+    day = start
+    while day <= end:
+        row = rows.get(day)
+        if row is not None:
+            occupied, capacity, peak = row.occupied, row.capacity, row.peak
+        else:
+            peak = occupied
+        series.append({
+            'date': day.isoformat(),
+            'occupied': occupied,
+            'capacity': capacity,
+            'peak': peak,
+        })
+        day += timedelta(days=1)
+    return series
+
+def backfill_occupancy():
+    # Replay the audit trail to rebuild daily history, then anchor today's
+    # values to the live room counters
+    rooms = {room.room_number: room for room in Room.query.all()}
+    state = {}
+    room_days = {}
+    hostel_days = {}
+    # Hostel-wide totals, kept up to date from each entry's change
+    totals = {'occupied': 0, 'capacity': 0}
+
+    def room_state(room_number):
+        if room_number not in state:
+            room = rooms.get(room_number)
+            state[room_number] = {'occupied': 0, 'capacity': room.capacity if room else 0}
+        return state[room_number]
+
+    for log in AuditLog.query.order_by(AuditLog.timestamp, AuditLog.id).yield_per(1000):
+        parsed = parse_audit_details(log.action, log.entity_type, log.details)
+        if parsed is None or parsed['room_number'] not in rooms:
+            continue
+        room_number = parsed['room_number']
+        before = state.get(room_number, {'occupied': 0, 'capacity': 0})
+        before = (before['occupied'], before['capacity'])
+        if (log.action, log.entity_type) == ('add', 'room'):
+            state[room_number] = {'occupied': 0, 'capacity': int(parsed['capacity'])}
+        elif (log.action, log.entity_type) == ('update', 'room'):
+            if room_number not in state:
+                state[room_number] = {'occupied': 0, 'capacity': int(parsed['old_capacity'])}
+            state[room_number]['capacity'] = int(parsed['new_capacity'])
+        elif log.action == 'add':
+            room_state(room_number)['occupied'] += 1
+        else:
+            current = room_state(room_number)
+            current['occupied'] = max(current['occupied'] - 1, 0)
+
+        day = log.timestamp.date()
+        current = state[room_number]
+        totals['occupied'] += current['occupied'] - before[0]
+        totals['capacity'] += current['capacity'] - before[1]
+        key = (rooms[room_number].id, day)
+        peak = max(room_days[key]['peak'], current['occupied']) if key in room_days else current['occupied']
+        room_days[key] = dict(current, peak=peak)
+
+        occupied, capacity = totals['occupied'], totals['capacity']
+        peak = max(hostel_days[day]['peak'], occupied) if day in hostel_days else occupied
+        hostel_days[day] = {'occupied': occupied, 'capacity': capacity, 'peak': peak}
+
+    today = date.today()
+    for room in rooms.values():
+        key = (room.id, today)
+        peak = max(room_days[key]['peak'], room.occupied) if key in room_days else room.occupied
+        room_days[key] = {'occupied': room.occupied, 'capacity': room.capacity, 'peak': peak}
+    occupied = sum(room.occupied for room in rooms.values())
+    capacity = sum(room.capacity for room in rooms.values())
+    peak = max(hostel_days[today]['peak'], occupied) if today in hostel_days else occupied
+    hostel_days[today] = {'occupied': occupied, 'capacity': capacity, 'peak': peak}
+
+    db.session.bulk_insert_mappings(RoomOccupancyDaily, [
+        dict(values, room_id=room_id, day=day) for (room_id, day), values in room_days.items()])
+    db.session.bulk_insert_mappings(HostelOccupancyDaily, [
+        dict(values, day=day) for day, values in hostel_days.items()])
+    db.session.commit()
+    return len(room_days), len(hostel_days)
+
+@app.cli.command('backfill-occupancy')
+@hostel_option
+@click.option('--force', is_flag=True, help='Discard existing history first.')
+def backfill_occupancy_command(force):
+    if HostelOccupancyDaily.query.first() is not None:
+        if not force:
+            click.echo('Occupancy history already exists; use --force to rebuild it.')
+            return
+        RoomOccupancyDaily.query.delete()
+        HostelOccupancyDaily.query.delete()
+    room_rows, hostel_rows = backfill_occupancy()
+    click.echo(f'Backfilled {room_rows} room-day rows and {hostel_rows} hostel-day rows')
+
+# Occupancy reconciliation. Room.occupied is compared against one GROUP BY
+# over student; incremental runs only look at rooms changed since the last
+# run that left the counters correct.
+class ReconciliationRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    incremental = db.Column(db.Boolean, nullable=False, default=False)
+    rooms_checked = db.Column(db.Integer, nullable=False, default=0)
+    mismatches = db.Column(db.Integer, nullable=False, default=0)
+    repaired = db.Column(db.Boolean, nullable=False, default=False)
+
+def reconcile_occupancy(repair=False, full=False):
+    started_at = datetime.now()
+    if repair:
+        # A check-in between the count and the repair would be overwritten
+        lock_for_write()
+    # Runs that found nothing or repaired what they found are safe to
+    # continue from
+    last = ReconciliationRun.query.filter((ReconciliationRun.mismatches == 0) | ReconciliationRun.repaired) \
+        .order_by(ReconciliationRun.started_at.desc()).first()
+    since = None if full or last is None else last.started_at
+
+    bed_bits = func.sum(literal(1).op('<<')(Student.bed_number - 1))
+    counts = select(Student.room_id, func.count(Student.id).label('actual'),
+                    bed_bits.label('actual_mask')).group_by(Student.room_id)
+    rooms = select(func.count(Room.id))
+    if since is not None:
+        touched = select(Room.id).where(Room.updated_at >= since)
+        counts = counts.where(Student.room_id.in_(touched))
+        rooms = rooms.where(Room.updated_at >= since)
+    counts = counts.subquery()
+    actual = func.coalesce(counts.c.actual, 0)
+    actual_mask = func.coalesce(counts.c.actual_mask, 0)
+    query = select(Room.id, Room.room_number, Room.occupied, actual.label('actual'),
+                   Room.bed_mask, actual_mask.label('actual_mask')) \
+        .outerjoin(counts, counts.c.room_id == Room.id) \
+        .where(Room.occupied.is_distinct_from(actual) | Room.bed_mask.is_distinct_from(actual_mask)) \
+        .order_by(Room.id)
+    if since is not None:
+        query = query.where(Room.updated_at >= since)
+    mismatches = db.session.execute(query).all()
+    rooms_checked = db.session.execute(rooms).scalar()
+    orphaned = db.session.query(func.count(Student.id)) \
+        .filter(~Student.room_id.in_(select(Room.id)) | Student.room_id.is_(None)).scalar()
+
+    if repair and mismatches:
+        ids = [row.id for row in mismatches]
+        recount = select(func.count(Student.id)).where(Student.room_id == Room.id).scalar_subquery()
+        remask = select(func.coalesce(bed_bits, 0)).where(Student.room_id == Room.id).scalar_subquery()
+        for start in range(0, len(ids), 5000):
+            db.session.execute(update(Room).where(Room.id.in_(ids[start:start + 5000]))
+                               .values(occupied=recount, bed_mask=remask),
+                               execution_options={'synchronize_session': False})
+        # Bring today's history in line: per-room rows in one executemany,
+        # the hostel total through record_occupancy with the net change
+        stmt = sqlite_insert(RoomOccupancyDaily)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['room_id', 'day'],
+            set_={'occupied': stmt.excluded.occupied,
+                  'peak': func.max(RoomOccupancyDaily.peak, stmt.excluded.occupied)})
+        capacities = dict(db.session.query(Room.id, Room.capacity).all())
+        db.session.execute(stmt, [{'room_id': row.id, 'day': started_at.date(), 'occupied': row.actual,
+                                   'capacity': capacities[row.id], 'peak': row.actual} for row in mismatches])
+        record_occupancy(db.session.get(Room, ids[0]),
+                         occupied_delta=sum(row.actual - (row.occupied or 0) for row in mismatches))
+        bump_data_version()
+
+    db.session.add(ReconciliationRun(started_at=started_at, finished_at=datetime.now(),
+                                     incremental=since is not None, rooms_checked=rooms_checked,
+                                     mismatches=len(mismatches), repaired=repair and bool(mismatches)))
+    db.session.commit()
+    return {
+        'incremental': since is not None,
+        'since': since.strftime('%Y-%m-%d %H:%M:%S') if since else None,
+        'rooms_checked': rooms_checked,
+        'orphaned_students': orphaned,
+        'repaired': repair and bool(mismatches),
+        'mismatches': [{'room_id': row.id, 'room_number': row.room_number,
+                        'recorded': row.occupied, 'actual': row.actual,
+                        'recorded_beds': beds_of(row.bed_mask or 0), 'actual_beds': beds_of(row.actual_mask)}
+                       for row in mismatches],
+        'seconds': round((datetime.now() - started_at).total_seconds(), 3),
+    }
+
+@app.cli.command('reconcile-occupancy')
+@hostel_option
+@click.option('--repair', is_flag=True, help='Fix the counters that are wrong.')
+@click.option('--full', is_flag=True, help='Check every room, not only rooms changed since the last run.')
+def reconcile_occupancy_command(repair, full):
+    result = reconcile_occupancy(repair=repair, full=full)
+    for mismatch in result['mismatches']:
+        if mismatch['recorded'] != mismatch['actual']:
+            click.echo(f"Room {mismatch['room_number']}: counter says {mismatch['recorded']}, "
+                       f"{mismatch['actual']} students assigned")
+        if mismatch['recorded_beds'] != mismatch['actual_beds']:
+            click.echo(f"Room {mismatch['room_number']}: bed map says {mismatch['recorded_beds']}, "
+                       f"students are in beds {mismatch['actual_beds']}")
+    if result['orphaned_students']:
+        click.echo(f"{result['orphaned_students']} students are not assigned to an existing room")
+    scope = f"{result['rooms_checked']} rooms changed since {result['since']}" if result['incremental'] \
+        else f"all {result['rooms_checked']} rooms"
+    click.echo(f"Checked {scope} in {result['seconds']}s: "
+               f"{len(result['mismatches'])} mismatched" + (', repaired' if result['repaired'] else ''))
+
+# Point-in-time state from the audit log. Entries for room and student
+# changes carry a JSON data payload; older entries fall back to
+# parse_audit_details. Replaying from an empty hostel would read the whole
+# history (and miss rooms created without an audit entry), so snapshots of
+# the live rooms and students are taken every AUDIT_SNAPSHOT_ENTRIES
+# entries, and a replay starts from the last snapshot before the
+# requested time and stops at the next one.
+class AuditSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_log_id = db.Column(db.Integer, nullable=False, index=True)
+    rooms = db.Column(db.Integer, nullable=False)
+    students = db.Column(db.Integer, nullable=False)
+    state = db.Column(db.LargeBinary, nullable=False)  # gzipped JSON
+
+def take_audit_snapshot():
+    # One read transaction, so the state matches last_log_id exactly
+    with hostel_engine().connect() as conn, conn.begin():
+        last_log_id = conn.execute(select(func.coalesce(func.max(AuditLog.id), 0))).scalar()
+        taken_at = datetime.now()
+        rooms = {row.room_number: {'id': row.id, 'capacity': row.capacity}
+                 for row in conn.execute(select(Room.id, Room.room_number, Room.capacity))}
+        students = {row.student_id: {'id': row.id, 'name': row.name, 'room_number': row.room_number,
+                                     'bed_number': row.bed_number,
+                                     'check_in_date': row.check_in_date.strftime('%Y-%m-%d %H:%M:%S')}
+                    for row in conn.execute(
+                        select(Student.id, Student.student_id, Student.name, Student.bed_number,
+                               Student.check_in_date, Room.room_number)
+                        .outerjoin(Room, Room.id == Student.room_id))}
+    snapshot = AuditSnapshot(taken_at=taken_at, last_log_id=last_log_id, rooms=len(rooms), students=len(students),
+                             state=gzip.compress(json.dumps({'rooms': rooms, 'students': students}).encode()))
+    db.session.add(snapshot)
+    db.session.commit()
+    return snapshot
+
+def snapshot_audit_if_due(every):
+    last = db.session.query(func.max(AuditSnapshot.last_log_id)).scalar()
+    latest = db.session.query(func.max(AuditLog.id)).scalar() or 0
+    if last is None or latest - last >= every:
+        return take_audit_snapshot()
+    return None
+
+def apply_audit_entry(state, log_entry):
+    data = json.loads(log_entry.data) if log_entry.data else \
+        parse_audit_details(log_entry.action, log_entry.entity_type, log_entry.details)
+    if data is None:
+        return False
+    rooms, students = state['rooms'], state['students']
+    kind = (log_entry.action, log_entry.entity_type)
+    if kind == ('add', 'room'):
+        rooms[data['room_number']] = {'id': data.get('room_id'), 'capacity': int(data['capacity'])}
+    elif kind == ('update', 'room'):
+        room = rooms.setdefault(data['room_number'], {'id': data.get('room_id')})
+        room['capacity'] = int(data['new_capacity'])
+        for student_id, bed_number in data.get('beds', {}).items():
+            if student_id in students:
+                students[student_id]['bed_number'] = bed_number
+    elif kind == ('add', 'student'):
+        students[data['student_id']] = {
+            'id': data.get('id', log_entry.entity_id), 'name': data['name'], 'room_number': data['room_number'],
+            'bed_number': data.get('bed_number'),
+            'check_in_date': data.get('check_in_date', log_entry.timestamp.strftime('%Y-%m-%d %H:%M:%S'))}
+    elif kind == ('remove', 'student'):
+        students.pop(data['student_id'], None)
+    else:
+        return False
+    return True
+
+def replay_state(at, room_number=None):
+    base = AuditSnapshot.query.filter(AuditSnapshot.taken_at <= at) \
+        .order_by(AuditSnapshot.taken_at.desc(), AuditSnapshot.id.desc()).first()
+    following = AuditSnapshot.query.filter(AuditSnapshot.taken_at > at) \
+        .order_by(AuditSnapshot.taken_at, AuditSnapshot.id).first()
+    if base is not None:
+        state = json.loads(gzip.decompress(base.state))
+    else:
+        state = {'rooms': {}, 'students': {}}
+    entries = AuditLog.query.filter(AuditLog.timestamp <= at,
+                                    AuditLog.entity_type.in_(('room', 'student')),
+                                    AuditLog.action.in_(('add', 'update', 'remove')))
+    if base is not None:
+        entries = entries.filter(AuditLog.id > base.last_log_id)
+    if following is not None:
+        entries = entries.filter(AuditLog.id <= following.last_log_id)
+    replayed = skipped = 0
+    for log_entry in entries.order_by(AuditLog.id).yield_per(1000):
+        if apply_audit_entry(state, log_entry):
+            replayed += 1
+        else:
+            skipped += 1
+
+    by_room = {}
+    for student_id, student in state['students'].items():
+        by_room.setdefault(student['room_number'], []).append(dict(student, student_id=student_id))
+    numbers = [room_number] if room_number is not None else sorted(state['rooms'], key=room_sort_key)
+    rooms = []
+    for number in numbers:
+        room = state['rooms'].get(number)
+        if room is None:
+            continue
+        occupants = sorted(by_room.get(number, []), key=lambda student: (student['bed_number'] or 0, student['name']))
+        rooms.append({'room_number': number, 'capacity': room['capacity'], 'occupied': len(occupants),
+                      'students': occupants})
+    return {
+        'at': at.strftime('%Y-%m-%d %H:%M:%S'),
+        'snapshot': {'id': base.id, 'taken_at': base.taken_at.strftime('%Y-%m-%d %H:%M:%S'),
+                     'last_log_id': base.last_log_id} if base is not None else None,
+        'entries_replayed': replayed,
+        'entries_skipped': skipped,
+        'rooms': rooms,
+    }
+
+# A bare date means the end of that day
+def parse_point_in_time(value):
+    at = datetime.fromisoformat(value)
+    if len(value) == 10:
+        at += timedelta(days=1, microseconds=-1)
+    return at
+
+@app.cli.command('snapshot-audit')
+@hostel_option
+def snapshot_audit_command():
+    snapshot = take_audit_snapshot()
+    click.echo(f'Snapshot {snapshot.id}: {snapshot.rooms} rooms and {snapshot.students} students '
+               f'as of audit entry {snapshot.last_log_id} ({len(snapshot.state)} bytes)')
+
+@app.cli.command('replay-audit')
+@click.option('--at', 'at', required=True, help='Date or date and time, e.g. 2025-03-03 or 2025-03-03T14:00.')
+@click.option('--room', help='Only show this room.')
+@hostel_option
+def replay_audit_command(at, room):
+    try:
+        point = parse_point_in_time(at)
+    except ValueError:
+        raise click.BadParameter('use YYYY-MM-DD or YYYY-MM-DDTHH:MM', param_hint='--at')
+    result = replay_state(point, room_number=room)
+    for replayed_room in result['rooms']:
+        click.echo(f"Room {replayed_room['room_number']}: {replayed_room['occupied']}/{replayed_room['capacity']}")
+        for student in replayed_room['students']:
+            bed = f"bed {student['bed_number']}" if student['bed_number'] else 'no bed'
+            click.echo(f"  {student['name']} ({student['student_id']}), {bed}, since {student['check_in_date']}")
+    base = f"snapshot {result['snapshot']['id']}" if result['snapshot'] else 'an empty hostel'
+    click.echo(f"State at {result['at']} from {base} plus {result['entries_replayed']} audit entries")
+
+# Past residents. remove_student moves the student here in the same
+# transaction that deletes them, so the live student table only holds
+# current residents. (room_id, check_out_date) serves "who lived in this
+# room"; (check_out_date, check_in_date) serves stays overlapping a date
+# range, which must have checked out on or after its start.
+class ResidentHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    student_pk = db.Column(db.Integer)  # Student.id while resident
+    name = db.Column(db.String(100), nullable=False)
+    student_id = db.Column(db.String(20), nullable=False, index=True)
+    room_id = db.Column(db.Integer)
+    room_number = db.Column(db.String(20))
+    bed_number = db.Column(db.Integer)
+    check_in_date = db.Column(db.DateTime)  # unknown for stays recovered from old audit entries
+    check_out_date = db.Column(db.DateTime, nullable=False)
+
+db.Index('ix_resident_history_room', ResidentHistory.room_id, ResidentHistory.check_out_date)
+db.Index('ix_resident_history_stay', ResidentHistory.check_out_date, ResidentHistory.check_in_date)
+
+def archive_student(student, room, check_out_date):
+    db.session.add(ResidentHistory(
+        student_pk=student.id, name=student.name, student_id=student.student_id,
+        room_id=room.id if room else student.room_id, room_number=room.room_number if room else None,
+        bed_number=student.bed_number, check_in_date=student.check_in_date, check_out_date=check_out_date))
+
+def past_residents(room_id=None, start=None, end=None, limit=None):
+    query = ResidentHistory.query
+    if room_id is not None:
+        query = query.filter(ResidentHistory.room_id == room_id)
+    if start is not None:
+        query = query.filter(ResidentHistory.check_out_date >= start)
+    if end is not None:
+        query = query.filter(ResidentHistory.check_in_date <= end)
+    query = query.order_by(ResidentHistory.check_out_date.desc(), ResidentHistory.id.desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+# Students removed before the history table existed, recovered by pairing
+# their add and remove audit entries
+def backfill_resident_history():
+    rooms = dict(db.session.query(Room.room_number, Room.id).all())
+    open_stays = {}
+    rows = []
+    entries = AuditLog.query.filter(AuditLog.entity_type == 'student', AuditLog.action.in_(('add', 'remove'))) \
+        .order_by(AuditLog.id)
+    for log_entry in entries.yield_per(1000):
+        data = json.loads(log_entry.data) if log_entry.data else \
+            parse_audit_details(log_entry.action, log_entry.entity_type, log_entry.details)
+        if data is None:
+            continue
+        if log_entry.action == 'add':
+            open_stays[data['student_id']] = (data, log_entry.timestamp)
+            continue
+        added, added_at = open_stays.pop(data['student_id'], ({}, None))
+        check_in = added.get('check_in_date')
+        rows.append({
+            'student_pk': data.get('id', log_entry.entity_id), 'name': data['name'], 'student_id': data['student_id'],
+            'room_id': data.get('room_id') or rooms.get(data['room_number']), 'room_number': data['room_number'],
+            'bed_number': added.get('bed_number'),
+            'check_in_date': datetime.fromisoformat(check_in) if check_in else added_at,
+            'check_out_date': log_entry.timestamp,
+        })
+    db.session.bulk_insert_mappings(ResidentHistory, rows)
+    db.session.commit()
+    return len(rows)
+
+# Occupancy analytics. Columns are pulled in bulk as plain integers and
+# aggregated with NumPy instead of iterating ORM objects.
+SECONDS_PER_DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+
+# SQLite's strftime('%s') treats stored naive datetimes as UTC, so convert
+# the same way on the Python side
+def _to_epoch(value):
+    return int((value - EPOCH).total_seconds())
+
+def _from_epoch(seconds):
+    return (EPOCH + timedelta(seconds=int(seconds))).strftime('%Y-%m-%d %H:%M:%S')
+
+def _int_columns(conn, columns, from_clause, **params):
+    # One aggregate row of comma-joined values per column; parsing those in
+    # NumPy avoids building a Python tuple for every source row
+    select = ', '.join(f'group_concat({column})' for column in columns)
+    row = conn.execute(text(f'SELECT {select} {from_clause}'), params).one()
+    return [np.fromstring(value, dtype=np.int64, sep=',') if value else np.empty(0, dtype=np.int64)
+            for value in row]
+
+def compute_occupancy_analytics(conn, months=12, now=None):
+    now = _to_epoch(now or datetime.now())
+
+    room_numbers = dict(conn.execute(text('SELECT id, room_number FROM room')).fetchall())
+    room_ids, capacity, occupied = _int_columns(
+        conn, ['id', 'capacity', 'COALESCE(occupied, 0)'],
+        'FROM (SELECT * FROM room ORDER BY id)')
+    student_rooms, check_ins = _int_columns(
+        conn, ['COALESCE(room_id, 0)', "CAST(strftime('%s', check_in_date) AS INTEGER)"],
+        'FROM student')
+    events = np.column_stack(_int_columns(
+        conn, ['entity_id', "CASE action WHEN 'add' THEN 1 ELSE -1 END",
+               "CAST(strftime('%s', timestamp) AS INTEGER)"],
+        """FROM audit_log
+        WHERE entity_type = 'student' AND action IN ('add', 'remove')
+          AND entity_id IS NOT NULL AND timestamp IS NOT NULL"""))
+
+    total_capacity = int(capacity.sum())
+    total_occupied = int(occupied.sum())
+
+    # Per room: utilization and current residents' tenure
+    with np.errstate(divide='ignore', invalid='ignore'):
+        utilization = np.where(capacity > 0, occupied / capacity, 0.0)
+    tenure_days = (now - check_ins) / SECONDS_PER_DAY
+    slot = np.searchsorted(room_ids, student_rooms)
+    assigned = slot < len(room_ids)
+    assigned[assigned] = room_ids[slot[assigned]] == student_rooms[assigned]
+    residents = np.bincount(slot[assigned], minlength=len(room_ids))
+    tenure_sum = np.bincount(slot[assigned], weights=tenure_days[assigned], minlength=len(room_ids))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_tenure = np.where(residents > 0, tenure_sum / np.maximum(residents, 1), 0.0)
+
+    # Order events by time (check-ins first on ties), then stably by student
+    # row so each student's events stay chronological
+    ids, kinds, stamps = events.T
+    by_time = np.argsort(stamps * 2 + (kinds < 0), kind='stable')
+    by_student = by_time[np.argsort(ids[by_time], kind='stable')]
+
+    # Completed stays: an 'add' immediately followed by a 'remove' of the same student row
+    ids_s, kinds_s, stamps_s = ids[by_student], kinds[by_student], stamps[by_student]
+    paired = (ids_s[:-1] == ids_s[1:]) & (kinds_s[:-1] == 1) & (kinds_s[1:] == -1)
+    stays = (stamps_s[1:] - stamps_s[:-1])[paired] / SECONDS_PER_DAY
+
+    # Hostel-wide occupancy after every event, anchored to the live total
+    kinds, stamps = kinds[by_time], stamps[by_time]
+    load = total_occupied - kinds.sum() + np.cumsum(kinds)
+    event_months = stamps.astype('datetime64[s]').astype('datetime64[M]')
+    first_month = np.datetime64(now, 's').astype('datetime64[M]') - (months - 1)
+    recent = event_months >= first_month
+
+    turnover = []
+    peaks = []
+    if recent.any():
+        month_keys, month_index = np.unique(event_months[recent], return_inverse=True)
+        check_ins = np.bincount(month_index, weights=kinds[recent] == 1, minlength=len(month_keys))
+        check_outs = np.bincount(month_index, weights=kinds[recent] == -1, minlength=len(month_keys))
+        starts = np.flatnonzero(np.r_[True, month_index[1:] != month_index[:-1]])
+        monthly_peak = np.maximum.reduceat(load[recent], starts)
+        for key, ins, outs, peak in zip(month_keys, check_ins, check_outs, monthly_peak):
+            turnover.append({
+                'period': str(key),
+                'check_ins': int(ins),
+                'check_outs': int(outs),
+                'turnover_rate': round(float(outs) / total_capacity, 4) if total_capacity else 0.0,
+            })
+            peaks.append({'period': str(key), 'occupied': int(peak)})
+
+    peak_at = int(np.argmax(load)) if len(load) else None
+    return {
+        'generated_at': _from_epoch(now),
+        'hostel': {
+            'rooms': int(len(room_ids)),
+            'capacity': total_capacity,
+            'occupied': total_occupied,
+            'utilization': round(total_occupied / total_capacity, 4) if total_capacity else 0.0,
+        },
+        'rooms': [{
+            'room_id': int(room_id),
+            'room_number': room_numbers.get(int(room_id)),
+            'capacity': int(cap),
+            'occupied': int(occ),
+            'utilization': round(float(util), 4),
+            'residents': int(count),
+            'avg_tenure_days': round(float(tenure), 1),
+        } for room_id, cap, occ, util, count, tenure
+            in zip(room_ids, capacity, occupied, utilization, residents, avg_tenure)],
+        'length_of_stay': {
+            'completed_stays': int(len(stays)),
+            'avg_days': round(float(stays.mean()), 1) if len(stays) else None,
+            'median_days': round(float(np.median(stays)), 1) if len(stays) else None,
+            'current_avg_days': round(float(tenure_days.mean()), 1) if len(tenure_days) else None,
+        },
+        'turnover': turnover,
+        'peak_load': {
+            'occupied': int(load[peak_at]) if peak_at is not None else total_occupied,
+            'at': _from_epoch(stamps[peak_at]) if peak_at is not None else None,
+            'monthly': peaks,
+        },
+    }
+
+# Capacity planning. Weekly arrival rates (by week of the year) and the
+# distribution of stay lengths are measured from current students and the
+# resident history, which upgrade_schema rebuilds from the audit log. Monte
+# Carlo trials then project occupancy week by week under intake scenarios.
+# Trials are split over a process pool, and each chunk is vectorized over
+# its trials.
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+def _week_of_year(days):
+    return np.minimum((days - days.astype('datetime64[Y]')).astype(np.int64) // 7, 51)
+
+def capacity_model(conn, weeks=26, start=None):
+    start = np.datetime64(start or date.today(), 'D')
+    start_epoch = int(start.astype('datetime64[s]').astype(np.int64))
+    current_ins, = _int_columns(conn, ["CAST(strftime('%s', check_in_date) AS INTEGER)"], 'FROM student')
+    past_ins, past_outs = _int_columns(
+        conn, ["CAST(strftime('%s', check_in_date) AS INTEGER)", "CAST(strftime('%s', check_out_date) AS INTEGER)"],
+        'FROM resident_history WHERE check_in_date IS NOT NULL')
+    beds = conn.execute(text('SELECT COALESCE(SUM(capacity), 0) FROM room')).scalar()
+
+    # Stay lengths in whole weeks, 1..weeks; bin weeks + 1 holds stays that
+    # outlast the horizon. With no completed stays, nobody leaves.
+    stays = np.clip(np.ceil((past_outs - past_ins) / SECONDS_PER_WEEK).astype(np.int64), 1, weeks + 1)
+    if len(stays):
+        stay_p = np.bincount(stays, minlength=weeks + 2)[1:] / len(stays)
+    else:
+        stay_p = np.zeros(weeks + 1)
+        stay_p[-1] = 1.0
+
+    # Arrivals per week of the year over the weeks of the year the history
+    # actually covers; weeks never observed get the overall weekly mean
+    arrivals = np.concatenate([current_ins, past_ins])
+    arrivals = arrivals[arrivals < start_epoch].astype('datetime64[s]').astype('datetime64[D]')
+    rates = np.zeros(52)
+    if len(arrivals):
+        covered = np.arange(arrivals.min(), start)
+        exposure = np.bincount(_week_of_year(covered), minlength=52) / 7
+        counts = np.bincount(_week_of_year(arrivals), minlength=52)
+        mean_rate = len(arrivals) / max(len(covered) / 7, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.where(exposure > 0, counts / np.maximum(exposure, 1e-9), mean_rate)
+    week_starts = start + np.arange(weeks) * 7
+
+    # Current residents leave according to the stays that outlast the weeks
+    # they have already been here, grouped by elapsed weeks
+    elapsed = np.clip((start_epoch - current_ins) // SECONDS_PER_WEEK, 0, weeks + 1)
+    residents = []
+    for done, count in zip(*np.unique(elapsed, return_counts=True)):
+        leave_p = np.zeros(weeks + 1)
+        remaining = stay_p[done:] if done < weeks + 1 else np.zeros(0)
+        if remaining[:-1].sum() > 0:
+            # Stay of length done + r leaves r weeks from now
+            leave_p[:len(remaining) - 1] = remaining[:-1]
+            leave_p[-1] = remaining[-1]
+            leave_p /= leave_p.sum()
+        else:
+            leave_p[-1] = 1.0
+        residents.append((int(count), leave_p))
+
+    return {
+        'start': str(start),
+        'weeks': weeks,
+        'beds': int(beds),
+        'occupied': int(len(current_ins)),
+        'week_starts': [str(day) for day in week_starts],
+        'rates': rates[_week_of_year(week_starts)],
+        'stay_p': stay_p,
+        'residents': residents,
+        'arrivals_seen': int(len(arrivals)),
+        'stays_seen': int(len(stays)),
+        'median_stay_weeks': float(np.median(stays)) if len(stays) else None,
+    }
+
+# Pure NumPy so it can run in a worker process. Returns occupancy per trial
+# and week. departures[:, j] counts people gone from week j on; the last
+# column is "after the horizon".
+def simulate_capacity_chunk(model, intake, trials, seed):
+    rng = np.random.default_rng(seed)
+    weeks = model['weeks']
+    departures = np.zeros((trials, 2 * weeks + 2), dtype=np.int64)
+    for count, leave_p in model['residents']:
+        departures[:, 1:weeks + 2] += rng.multinomial(count, leave_p, size=trials)
+    arrivals = rng.poisson(model['rates'] * intake, size=(trials, weeks))
+    # Split each week's arrivals over stay lengths 1..weeks+1
+    by_stay = rng.multinomial(arrivals, model['stay_p'])
+    for stay in range(1, weeks + 2):
+        departures[:, stay:stay + weeks] += by_stay[:, :, stay - 1]
+    present = model['occupied'] + np.cumsum(arrivals, axis=1) - np.cumsum(departures[:, :weeks], axis=1)
+    return present.astype(np.int32)
+
+# Scenarios are dicts with a name, an intake multiplier applied to the
+# historical arrival rates and extra_beds added to today's capacity
+def simulate_capacity(trials=5000, weeks=26, scenarios=None, workers=None, seed=None, start=None, progress=None):
+    model = capacity_model(db.session.connection(), weeks=weeks, start=start)
+    scenarios = scenarios or [{'name': 'baseline', 'intake': 1.0, 'extra_beds': 0}]
+    workers = workers or app.config['SIMULATION_WORKERS'] or os.cpu_count() or 1
+    chunks = [len(part) for part in np.array_split(np.arange(trials), max(min(workers * 4, trials), 1)) if len(part)]
+    seeds = iter(np.random.SeedSequence(seed).spawn(len(chunks) * len(scenarios)))
+    began = time.perf_counter()
+
+    # Workers are spawned rather than forked: this also runs inside the
+    # threaded job runner, where forking could copy a held lock
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) if workers > 1 else None
+    try:
+        pending = []
+        for scenario in scenarios:
+            calls = [(model, scenario['intake'], size, next(seeds)) for size in chunks]
+            pending.append([pool.submit(simulate_capacity_chunk, *call) for call in calls] if pool
+                           else calls)
+        results = []
+        for number, (scenario, parts) in enumerate(zip(scenarios, pending)):
+            present = np.concatenate([part.result() if pool else simulate_capacity_chunk(*part) for part in parts])
+            beds = model['beds'] + scenario.get('extra_beds', 0)
+            short = present > beds
+            results.append({
+                'name': scenario['name'],
+                'intake': scenario['intake'],
+                'beds': beds,
+                'p_short_any_week': round(float(short.any(axis=1).mean()), 4),
+                'weeks': [{
+                    'week': week,
+                    'expected_arrivals': round(float(rate * scenario['intake']), 2),
+                    'mean_occupied': round(float(column.mean()), 1),
+                    'p90_occupied': int(np.percentile(column, 90)),
+                    'p_short': round(float(short_column.mean()), 4),
+                } for week, rate, column, short_column in zip(model['week_starts'], model['rates'], present.T, short.T)],
+            })
+            if progress is not None:
+                progress(number + 1, len(scenarios))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return {
+        'start': model['start'],
+        'weeks': weeks,
+        'trials': trials,
+        'workers': workers,
+        'seconds': round(time.perf_counter() - began, 2),
+        'beds': model['beds'],
+        'occupied': model['occupied'],
+        'history': {'arrivals': model['arrivals_seen'], 'completed_stays': model['stays_seen'],
+                    'median_stay_weeks': model['median_stay_weeks']},
+        'scenarios': results,
+    }
+
+def parse_scenario(value):
+    match = re.match(r'^(?:(?P<name>[\w-]+)=)?(?P<intake>\d+(?:\.\d+)?)(?::(?P<beds>[+-]?\d+))?$', value)
+    if match is None:
+        raise ValueError(value)
+    return {'name': match.group('name') or value, 'intake': float(match.group('intake')),
+            'extra_beds': int(match.group('beds') or 0)}
+
+@app.cli.command('simulate-capacity')
+@click.option('--trials', default=5000, show_default=True)
+@click.option('--weeks', default=26, show_default=True)
+@click.option('--scenario', 'scenarios', multiple=True,
+              help='[NAME=]INTAKE[:EXTRA_BEDS], e.g. busy=1.2:40 for 20% more arrivals and 40 more beds. Repeatable.')
+@click.option('--workers', type=int, help='Processes to use (default: one per CPU).')
+@click.option('--seed', type=int)
+@hostel_option
+def simulate_capacity_command(trials, weeks, scenarios, workers, seed):
+    try:
+        scenarios = [parse_scenario(value) for value in scenarios] or None
+    except ValueError as error:
+        raise click.BadParameter(f'{error} is not [NAME=]INTAKE[:EXTRA_BEDS]', param_hint='--scenario')
+    result = simulate_capacity(trials=trials, weeks=weeks, scenarios=scenarios, workers=workers, seed=seed)
+    history = result['history']
+    click.echo(f"{result['occupied']}/{result['beds']} beds in use; history has {history['arrivals']} arrivals "
+               f"and {history['completed_stays']} completed stays (median {history['median_stay_weeks']} weeks)")
+    click.echo('Week        ' + ''.join(f"{scenario['name'][:14]:>16}" for scenario in result['scenarios']))
+    for index, week in enumerate(result['scenarios'][0]['weeks']):
+        click.echo(f"{week['week']}  " + ''.join(
+            f"{scenario['weeks'][index]['p_short']:>9.1%} ({scenario['weeks'][index]['p90_occupied']:>4})"
+            for scenario in result['scenarios']))
+    click.echo('Any week    ' + ''.join(f"{scenario['p_short_any_week']:>16.1%}" for scenario in result['scenarios']))
+    click.echo(f"Chance of running out of beds (90th percentile occupancy); {result['trials']} trials per "
+               f"scenario, {result['workers']} worker processes, {result['seconds']}s")
+
+# Free-bed index: rooms bucketed by free-bed count and floor, each bucket
+# sorted by room number so "at least k free beds, nearest to X" touches only
+# a handful of buckets instead of scanning every room
+AvailableRoom = namedtuple('AvailableRoom', ['id', 'room_number', 'floor', 'free_beds', 'capacity'])
+
+def room_sort_key(room_number):
+    return (0, int(room_number), room_number) if room_number.isdigit() else (1, 0, room_number)
+
+class FreeBedIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.rooms = {}
+        self.buckets = {}
+
+    def _insert(self, room):
+        self.rooms[room.id] = room
+        if room.free_beds > 0:
+            bucket = self.buckets.setdefault(room.free_beds, {}).setdefault(room.floor, [])
+            bisect.insort(bucket, (room_sort_key(room.room_number), room.id))
+
+    def _discard(self, room_id):
+        room = self.rooms.pop(room_id, None)
+        if room is None or room.free_beds <= 0:
+            return
+        bucket = self.buckets[room.free_beds][room.floor]
+        del bucket[bisect.bisect_left(bucket, (room_sort_key(room.room_number), room.id))]
+
+    def _rebuild(self, version):
+        self.rooms = {}
+        self.buckets = {}
+        rows = db.session.query(Room.id, Room.room_number, Room.floor, Room.capacity,
+                                func.coalesce(Room.occupied, 0)).all()
+        for room_id, room_number, floor, capacity, occupied in rows:
+            self._insert(AvailableRoom(room_id, room_number, floor, capacity - occupied, capacity))
+        self.version = version
+
+    def update(self, room, version):
+        # Apply our own write in place; if another worker wrote in between,
+        # drop the index so the next search rebuilds it
+        with self.lock:
+            if self.version is None or version != self.version + 1:
+                self.version = None
+                return
+            self._discard(room.id)
+            self._insert(AvailableRoom(room.id, room.room_number, room.floor,
+                                       room.capacity - (room.occupied or 0), room.capacity))
+            self.version = version
+
+    def search(self, min_free=1, floor=None, near=None, limit=None):
+        version = current_data_version()
+        with self.lock:
+            if version != self.version:
+                self._rebuild(version)
+            runs = []
+            for free, floors in self.buckets.items():
+                if free < min_free:
+                    continue
+                if floor is None:
+                    runs.extend(floors.values())
+                elif floor in floors:
+                    runs.append(floors[floor])
+            if near is None:
+                keys = heapq.merge(*runs)
+                if limit is not None:
+                    keys = [entry for _, entry in zip(range(limit), keys)]
+            else:
+                keys = self._nearest(runs, near, limit)
+            return [self.rooms[room_id] for _, room_id in keys]
+
+    @staticmethod
+    def _nearest(runs, near, limit):
+        target = ((0, near, ''), -1)
+        candidates = []
+        for run in runs:
+            middle = bisect.bisect_left(run, target)
+            window = run[max(middle - limit, 0):middle + limit] if limit is not None else run
+            candidates.extend(window)
+
+        def distance(entry):
+            key = entry[0]
+            return (key[0], abs(key[1] - near), key)
+        if limit is None:
+            return sorted(candidates, key=distance)
+        return heapq.nsmallest(limit, candidates, key=distance)
+
+free_bed_index = PerHostel(lambda slug: FreeBedIndex())
+
+# Reservation availability. Only active reservations that overlap the
+# requested nights are read (via ix_reservation_window); a sweep over their
+# start/end points gives each room's peak number of held beds in the window.
+def reserved_beds(start, end, exclude_student_id=None):
+    query = db.session.query(Reservation.room_id, Reservation.start_date, Reservation.end_date) \
+        .filter(Reservation.status == 'reserved',
+                Reservation.end_date > start,
+                Reservation.start_date < end)
+    if exclude_student_id is not None:
+        query = query.filter(Reservation.student_id != exclude_student_id)
+
+    points = {}
+    for room_id, res_start, res_end in query:
+        points.setdefault(room_id, []).extend(((max(res_start, start), 1), (min(res_end, end), -1)))
+
+    held = {}
+    for room_id, room_points in points.items():
+        # Check-outs sort before check-ins on the same day
+        room_points.sort(key=lambda point: (point[0], point[1]))
+        current = peak = 0
+        for _, change in room_points:
+            current += change
+            peak = max(peak, current)
+        held[room_id] = peak
+    return held
+
+def available_rooms(start, end, beds=1, exclude_student_id=None):
+    # Current residents have no check-out date, so they hold their bed for
+    # every night of the window
+    held = reserved_beds(start, end, exclude_student_id)
+    rooms = db.session.query(Room.id, Room.room_number, Room.floor, Room.capacity,
+                             func.coalesce(Room.occupied, 0)).order_by(Room.room_number).all()
+    result = []
+    for room_id, room_number, floor, capacity, occupied in rooms:
+        free = capacity - occupied - held.get(room_id, 0)
+        if free >= beds:
+            result.append(AvailableRoom(room_id, room_number, floor, free, capacity))
+    return result
+
+def active_reservation(student_id, day=None):
+    day = day or date.today()
+    return Reservation.query.filter(
+        Reservation.student_id == student_id,
+        Reservation.status == 'reserved',
+        Reservation.start_date <= day,
+        Reservation.end_date > day).first()
+
+# Waitlist assignment. Runs inside the transaction that freed the beds, so a
+# bed is never visible as free between the release and the assignment.
+def next_waitlist_entry(room_id):
+    # Best entry without a room preference vs. best entry asking for this
+    # room; each is one seek on ix_waitlist_queue
+    candidates = [
+        WaitlistEntry.query.filter(WaitlistEntry.status == 'waiting', WaitlistEntry.room_id == room_filter)
+        .order_by(WaitlistEntry.priority.desc(), WaitlistEntry.id).first()
+        for room_filter in (None, room_id)
+    ]
+    candidates = [entry for entry in candidates if entry is not None]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda entry: (-entry.priority, entry.id))
+
+def assign_waitlist(room):
+    held = reserved_beds(date.today(), date.max).get(room.id, 0)
+    assigned = []
+    while room.occupied + held < room.capacity:
+        entry = next_waitlist_entry(room.id)
+        if entry is None:
+            break
+        # Claim the entry so a concurrent worker cannot assign it twice
+        claimed = db.session.execute(
+            WaitlistEntry.__table__.update()
+            .where(WaitlistEntry.id == entry.id, WaitlistEntry.status == 'waiting')
+            .values(status='assigned', assigned_at=datetime.now())).rowcount
+        db.session.expire(entry)
+        if not claimed:
+            continue
+        if Student.query.filter_by(student_id=entry.student_id).first():
+            entry.status = 'cancelled'
+            continue
+        student = Student(name=entry.name, student_id=entry.student_id, room_id=room.id,
+                          check_in_date=datetime.now(), bed_number=room.take_bed())
+        db.session.add(student)
+        assigned.append(student)
+    if assigned:
+        db.session.flush()
+        for student in assigned:
+            emit_student_event('student.checked_in', student, room)
+    return assigned
+
+def emit_student_event(event_type, student, room, **extra):
+    emit_event(event_type, id=student.id, student_id=student.student_id, name=student.name,
+               room_number=room.room_number if room else None, bed_number=student.bed_number, **extra)
+
+def student_audit_data(student, room):
+    return {'id': student.id, 'student_id': student.student_id, 'name': student.name, 'room_id': room.id,
+            'room_number': room.room_number, 'bed_number': student.bed_number,
+            'check_in_date': student.check_in_date.strftime('%Y-%m-%d %H:%M:%S')}
+
+def log_waitlist_assignments(students, room):
+    for student in students:
+        AuditLog.log('add', 'student', student.id,
+                     f'Student {student.name} (ID: {student.student_id}) added to room {room.room_number}',
+                     data=student_audit_data(student, room), commit=False)
+
+# Student typeahead search. student_search is an FTS5 index over
+# student.name and student.student_id kept in sync by triggers; prefix
+# indexes make "first few letters" queries a direct index lookup.
+STUDENT_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS student_search USING fts5(
+        name, student_id, content='student', content_rowid='id',
+        tokenize="unicode61 tokenchars '-_'", prefix='1 2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS student_search_ai AFTER INSERT ON student BEGIN
+        INSERT INTO student_search(rowid, name, student_id) VALUES (new.id, new.name, new.student_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS student_search_ad AFTER DELETE ON student BEGIN
+        INSERT INTO student_search(student_search, rowid, name, student_id)
+        VALUES ('delete', old.id, old.name, old.student_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS student_search_au AFTER UPDATE OF name, student_id ON student BEGIN
+        INSERT INTO student_search(student_search, rowid, name, student_id)
+        VALUES ('delete', old.id, old.name, old.student_id);
+        INSERT INTO student_search(rowid, name, student_id) VALUES (new.id, new.name, new.student_id);
+    END""",
+]
+
+def create_student_search(conn):
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'student_search'")).first()
+    for statement in STUDENT_SEARCH_DDL:
+        conn.execute(text(statement))
+    if not exists:
+        conn.execute(text("INSERT INTO student_search(student_search) VALUES ('rebuild')"))
+
+def search_students(query, limit=10, conn=None):
+    terms = re.findall(r'[\w-]+', query)
+    if not terms:
+        return []
+    # Every term must match the start of a word in the name or student ID.
+    # Results are not ranked: scoring every match of a one-letter prefix
+    # would cost far more than the LIMIT saves.
+    match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+    rows = (conn or db.session).execute(text("""
+        SELECT student.id, student.name, student.student_id, room.room_number
+        FROM student_search
+        JOIN student ON student.id = student_search.rowid
+        LEFT JOIN room ON room.id = student.room_id
+        WHERE student_search MATCH :match
+        LIMIT :limit"""), {'match': match, 'limit': limit})
+    return [{'id': row.id, 'name': row.name, 'student_id': row.student_id,
+             'room_number': row.room_number} for row in rows]
+
+# Server-side paging for the room and student tables. Filters and sort keys
+# map onto indexed columns so each page is an index range read.
+MAX_PER_PAGE = 100
+ROOM_SORTS = {
+    'room_number': Room.room_number,
+    'free_beds': Room.capacity - Room.occupied,
+}
+STUDENT_SORTS = {
+    'check_in_date': Student.check_in_date,
+    'room_number': Room.room_number,
+    'name': Student.name,
+}
+ROOM_STATUS_FILTERS = {
+    'full': (Room.capacity - Room.occupied) <= 0,
+    'empty': Room.occupied == 0,
+    'partial': db.and_(Room.occupied > 0, (Room.capacity - Room.occupied) > 0),
+}
+
+def hostel_stats():
+    rooms, total_beds, occupied_beds = db.session.query(
+        func.count(Room.id),
+        func.coalesce(func.sum(Room.capacity), 0),
+        func.coalesce(func.sum(Room.occupied), 0)).one()
+    return {
+        'total_rooms': rooms,
+        'total_students': db.session.query(func.count(Student.id)).scalar(),
+        'total_beds': total_beds,
+        'occupied_beds': occupied_beds,
+        'available_beds': total_beds - occupied_beds,
+    }
+
+# Read-only rows for list views. Selecting just the columns a template
+# prints skips the identity map, change tracking and lazy relationships of
+# full ORM instances; __slots__ keeps each row to a few pointers.
+class ProjectedRow:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def query(cls):
+        return db.session.query(*cls.columns)
+
+    @classmethod
+    def paginate(cls, query, prefix=''):
+        page = _page(query, prefix)
+        page.items = [cls(*row) for row in page.items]
+        return page
+
+class RoomRow(ProjectedRow):
+    __slots__ = ('id', 'room_number', 'capacity', 'occupied', 'bed_mask')
+    columns = (Room.id, Room.room_number, Room.capacity, Room.occupied, Room.bed_mask)
+    bed_map = Room.bed_map
+
+class StudentRow(ProjectedRow):
+    __slots__ = ('id', 'name', 'student_id', 'bed_number', 'check_in_date', 'room_number')
+    columns = (Student.id, Student.name, Student.student_id, Student.bed_number, Student.check_in_date,
+               Room.room_number)
+
+class AuditRow(ProjectedRow):
+    __slots__ = ('id', 'action', 'entity_type', 'entity_id', 'details', 'data', 'user_id', 'timestamp', 'username')
+    columns = (AuditLog.id, AuditLog.action, AuditLog.entity_type, AuditLog.entity_id, AuditLog.details,
+               AuditLog.data, AuditLog.user_id, AuditLog.timestamp)
+
+    # Users live in the main database, so usernames are looked up once
+    # instead of joined
+    @classmethod
+    def fetch(cls, query):
+        rows = [cls(*row) for row in query]
+        usernames = dict(db.session.query(User.id, User.username)
+                         .filter(User.id.in_({row.user_id for row in rows if row.user_id})).all())
+        for row in rows:
+            row.username = usernames.get(row.user_id, 'System')
+        return rows
+
+def _ordering(sorts, sort, order, default):
+    column = sorts.get(sort, sorts[default])
+    return column.desc() if order == 'desc' else column.asc()
+
+def _page(query, prefix=''):
+    return query.paginate(page=request.args.get(prefix + 'page', 1, type=int),
+                          per_page=request.args.get(prefix + 'per_page', 25, type=int),
+                          max_per_page=MAX_PER_PAGE, error_out=False)
+
+def paginate_rooms(prefix=''):
+    query = RoomRow.query()
+    status = request.args.get('status')
+    if status in ROOM_STATUS_FILTERS:
+        query = query.filter(ROOM_STATUS_FILTERS[status])
+    floor = request.args.get('floor', type=int)
+    if floor is not None:
+        query = query.filter(Room.floor == floor)
+    query = query.order_by(
+        _ordering(ROOM_SORTS, request.args.get(prefix + 'sort'), request.args.get(prefix + 'order'), 'room_number'),
+        Room.id)
+    return RoomRow.paginate(query, prefix)
+
+def paginate_students(prefix=''):
+    query = StudentRow.query().select_from(Student).join(Room, Student.room_id == Room.id, isouter=True)
+    floor = request.args.get('floor', type=int)
+    if floor is not None:
+        query = query.filter(Room.floor == floor)
+    query = query.order_by(
+        _ordering(STUDENT_SORTS, request.args.get(prefix + 'sort'), request.args.get(prefix + 'order'), 'check_in_date'),
+        Student.id)
+    return StudentRow.paginate(query, prefix)
+
+# Rendered page fragments keyed on the data version, so every write that
+# bumps it (add_student, remove_student, add_room, edit_room) invalidates
+# them. With FRAGMENT_CACHE_PATH set, fragments are also kept in a SQLite
+# file shared by all worker processes.
+class FragmentCache:
+    def __init__(self, max_entries=256, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.version = None
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _shared(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('CREATE TABLE IF NOT EXISTS fragment '
+                         '(key TEXT PRIMARY KEY, version INTEGER NOT NULL, html TEXT NOT NULL)')
+            self.local.conn = conn
+        return conn
+
+    def _remember(self, key, version, html):
+        with self.lock:
+            if self.version != version:
+                if self.version is not None and version < self.version:
+                    return
+                self.entries.clear()
+                self.version = version
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get(self, key, version):
+        with self.lock:
+            if self.version == version and key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.entries[key]
+        if self.path:
+            row = self._shared().execute('SELECT html FROM fragment WHERE key = ? AND version = ?',
+                                         (key, version)).fetchone()
+            if row is not None:
+                self._remember(key, version, row[0])
+                with self.lock:
+                    self.stats['shared_hits'] += 1
+                return row[0]
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, version, html):
+        self._remember(key, version, html)
+        if self.path:
+            conn = self._shared()
+            conn.execute('INSERT OR REPLACE INTO fragment (key, version, html) VALUES (?, ?, ?)',
+                         (key, version, html))
+            conn.execute('DELETE FROM fragment WHERE version < ?', (version,))
+            # REPLACE gives the row a new rowid, so the oldest rows go first
+            conn.execute('DELETE FROM fragment WHERE rowid NOT IN '
+                         '(SELECT rowid FROM fragment ORDER BY rowid DESC LIMIT ?)', (self.max_entries,))
+            conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+        if self.path:
+            conn = self._shared()
+            conn.execute('DELETE FROM fragment')
+            conn.commit()
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.stats, entries=len(self.entries), max_entries=self.max_entries,
+                           version=self.version, shared=bool(self.path))
+        lookups = metrics['hits'] + metrics['shared_hits'] + metrics['misses']
+        metrics['hit_rate'] = round((metrics['hits'] + metrics['shared_hits']) / lookups, 4) if lookups else None
+        return metrics
+
+def _hostel_fragment_cache(slug):
+    path = app.config['FRAGMENT_CACHE_PATH']
+    if path and slug != app.config['DEFAULT_HOSTEL']:
+        root, ext = os.path.splitext(path)
+        path = f'{root}-{slug}{ext}'
+    return FragmentCache(app.config['FRAGMENT_CACHE_SIZE'], path)
+
+fragment_cache = PerHostel(_hostel_fragment_cache)
+
+# Query arguments the cached fragments read, unprefixed and with the
+# dashboard's room_ and student_ prefixes
+FRAGMENT_ARGS = {prefix + name for prefix in ('', 'room_', 'student_')
+                 for name in ('page', 'per_page', 'sort', 'order', 'status', 'floor')}
+
+# The version is read before rendering, so a fragment is never newer than
+# its key claims. Fragments with links vary on the arguments in
+# FRAGMENT_ARGS because paging and sort links carry them along; any other
+# argument is left out of both, so it cannot fill the cache with copies.
+def cached_fragment(name, version, render, vary=True):
+    key = name + '|' + request.script_root
+    if vary:
+        args = [(name, value) for name, value in request.args.items(multi=True) if name in FRAGMENT_ARGS]
+        key += '?' + urlencode(sorted(args))
+    html = fragment_cache.get(key, version)
+    if html is None:
+        html = render()
+        fragment_cache.put(key, version, html)
+    return Markup(html)
+
+# Link to the current page with some of its FRAGMENT_ARGS replaced
+@app.template_global()
+def url_with(**updates):
+    args = {name: value for name, value in request.args.items() if name in FRAGMENT_ARGS}
+    args.update(updates)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+# Audit facets
+def audit_facets(start=None, end=None):
+    query = db.session.query(AuditRollup.day, AuditRollup.action, AuditRollup.entity_type,
+                             AuditRollup.user_id, AuditRollup.count)
+    if start is not None:
+        query = query.filter(AuditRollup.day >= start)
+    if end is not None:
+        query = query.filter(AuditRollup.day <= end)
+
+    facets = {'action': {}, 'entity_type': {}, 'user': {}, 'day': {}}
+    total = 0
+    for day, action, entity_type, user_id, count in query:
+        total += count
+        for facet, key in (('action', action), ('entity_type', entity_type),
+                           ('user', user_id), ('day', day.isoformat())):
+            facets[facet][key] = facets[facet].get(key, 0) + count
+
+    usernames = dict(db.session.query(User.id, User.username)
+                     .filter(User.id.in_(list(facets['user']))).all())
+    facets['user'] = {usernames.get(user_id, 'System'): count
+                      for user_id, count in facets['user'].items()}
+    return {
+        'total': total,
+        'facets': {facet: sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+                   if facet != 'day' else sorted(counts.items())
+                   for facet, counts in facets.items()},
+    }
+
+def compute_audit_rollups():
+    rows = db.session.execute(text("""
+        SELECT date(timestamp) AS day, action, entity_type, COALESCE(user_id, 0) AS user_id, COUNT(*) AS count
+        FROM audit_log
+        WHERE timestamp IS NOT NULL
+        GROUP BY 1, 2, 3, 4"""))
+    return {(date.fromisoformat(row.day), row.action, row.entity_type, row.user_id): row.count
+            for row in rows}
+
+def rebuild_audit_rollups():
+    expected = compute_audit_rollups()
+    AuditRollup.query.delete()
+    db.session.bulk_insert_mappings(AuditRollup, [
+        {'day': day, 'action': action, 'entity_type': entity_type, 'user_id': user_id, 'count': count}
+        for (day, action, entity_type, user_id), count in expected.items()])
+    db.session.commit()
+    return len(expected)
+
+@app.cli.command('rebuild-audit-rollups')
+@hostel_option
+@click.option('--check', is_flag=True, help='Only report differences, do not rebuild.')
+def rebuild_audit_rollups_command(check):
+    expected = compute_audit_rollups()
+    actual = {(row.day, row.action, row.entity_type, row.user_id): row.count
+              for row in AuditRollup.query.all()}
+    mismatches = sorted(key for key in set(expected) | set(actual)
+                        if expected.get(key, 0) != actual.get(key, 0))
+    for day, action, entity_type, user_id in mismatches:
+        key = (day, action, entity_type, user_id)
+        click.echo(f'{day} {action} {entity_type} user={user_id}: '
+                   f'rollup {actual.get(key, 0)}, audit log {expected.get(key, 0)}')
+    click.echo(f'{len(mismatches)} mismatched rollup rows')
+    if not check:
+        click.echo(f'Rebuilt {rebuild_audit_rollups()} rollup rows')
+
+# Background jobs. Jobs live in the job table so every worker process can
+# report on them. Each process runs up to JOB_WORKERS job threads and
+# claims queued jobs with a conditional UPDATE, which also keeps at most
+# JOB_MAX_RUNNING jobs running across all processes. Running jobs are
+# heartbeated by their process; when a process dies its jobs go stale and
+# are requeued, or failed once they have used up JOB_MAX_ATTEMPTS.
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, failed, cancelled
+    progress = db.Column(db.Float, nullable=False, default=0)
+    message = db.Column(db.String(200))
+    error = db.Column(db.Text)
+    result_path = db.Column(db.String(300))
+    result_name = db.Column(db.String(100))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker = db.Column(db.String(100))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+
+def job_data(job):
+    def stamp(value):
+        return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'progress': round(job.progress, 4),
+        'message': job.message,
+        'error': job.error,
+        'attempts': job.attempts,
+        'cancel_requested': job.cancel_requested,
+        'has_result': job.status == 'done' and job.result_path is not None,
+        'created_at': stamp(job.created_at),
+        'started_at': stamp(job.started_at),
+        'finished_at': stamp(job.finished_at),
+    }
+
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+class JobCancelled(Exception):
+    pass
+
+# Job ids restart in every hostel database, so each hostel keeps its
+# results in a directory of its own
+def job_results_dir(slug=None):
+    return os.path.join(app.config['JOB_RESULTS_DIR'], slug or current_hostel())
+
+class JobContext:
+    def __init__(self, job):
+        self.job_id = job.id
+        self.results_dir = job_results_dir()
+        self.params = json.loads(job.params)
+        self.result_name = None
+        self.last_update = 0
+
+    def result_file(self, name):
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.result_name = name
+        return os.path.join(self.results_dir, f'{self.job_id}-{name}')
+
+    # Report progress and check for cancellation; writes are throttled
+    # unless force is set
+    def progress(self, done, total=None, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_update < 0.5:
+            return
+        self.last_update = now
+        values = {'heartbeat_at': datetime.now()}
+        if total:
+            values['progress'] = min(done / total, 1.0)
+        if message is not None:
+            values['message'] = message[:200]
+        with hostel_engine().begin() as conn:
+            conn.execute(update(Job).where(Job.id == self.job_id).values(**values))
+            cancelled = conn.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+def claim_job(worker, limit):
+    now = datetime.now()
+    next_queued = select(Job.id).where(Job.status == 'queued').order_by(Job.id).limit(1).scalar_subquery()
+    running = select(func.count(Job.id)).where(Job.status == 'running').scalar_subquery()
+    with hostel_engine().begin() as conn:
+        return conn.execute(
+            update(Job).where(Job.id == next_queued, running < limit)
+            .values(status='running', worker=worker, started_at=now, heartbeat_at=now,
+                    attempts=Job.attempts + 1, message=None)
+            .returning(Job.id)).scalar()
+
+def recover_stale_jobs(stale_seconds, max_attempts):
+    now = datetime.now()
+    stale = (Job.status == 'running') & (Job.heartbeat_at < now - timedelta(seconds=stale_seconds))
+    with hostel_engine().begin() as conn:
+        conn.execute(update(Job).where(stale, Job.cancel_requested)
+                     .values(status='cancelled', finished_at=now))
+        conn.execute(update(Job).where(stale, Job.attempts >= max_attempts)
+                     .values(status='failed', error='Worker stopped while running the job', finished_at=now))
+        return conn.execute(update(Job).where(stale)
+                            .values(status='queued', worker=None, message='Requeued after its worker stopped')).rowcount
+
+def finish_job(job_id, worker, **values):
+    values['finished_at'] = datetime.now()
+    with hostel_engine().begin() as conn:
+        conn.execute(update(Job).where(Job.id == job_id, Job.status == 'running', Job.worker == worker)
+                     .values(**values))
+
+def run_job(job_id, worker):
+    job = db.session.get(Job, job_id)
+    context = JobContext(job)
+    handler = JOB_HANDLERS.get(job.kind)
+    db.session.commit()
+    try:
+        if handler is None:
+            raise ValueError(f'Unknown job kind {job.kind}')
+        result_path = handler(context)
+    except JobCancelled:
+        db.session.rollback()
+        if context.result_name:
+            path = context.result_file(context.result_name)
+            if os.path.exists(path):
+                os.remove(path)
+        finish_job(job_id, worker, status='cancelled')
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception('Job %s (%s) failed', job_id, job.kind)
+        finish_job(job_id, worker, status='failed', error=str(e) or e.__class__.__name__)
+    else:
+        finish_job(job_id, worker, status='done', progress=1.0,
+                   result_path=result_path, result_name=context.result_name if result_path else None)
+
+class JobRunner:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.running = set()
+        self.maintenance_checked = {}
+
+    # Called on every request; the pid check restarts the dispatcher in
+    # workers forked from a preloaded parent
+    def start(self, flask_app):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.worker = f'{socket.gethostname()}:{self.pid}'
+            self.running = set()
+        threading.Thread(target=self._dispatch, args=(flask_app,), name='job-dispatcher', daemon=True).start()
+
+    def _dispatch(self, flask_app):
+        while True:
+            try:
+                with flask_app.app_context():
+                    slugs = hostel_slugs()
+                for slug in slugs:
+                    with flask_app.app_context():
+                        g.hostel = slug
+                        self._poll(flask_app, slug)
+            except Exception:
+                flask_app.logger.exception('Job dispatcher failed')
+            self.wakeup.wait(1)
+            self.wakeup.clear()
+
+    # JOB_WORKERS bounds this process across all hostels; JOB_MAX_RUNNING
+    # is enforced per hostel database
+    def _poll(self, flask_app, slug):
+        config = flask_app.config
+        with self.lock:
+            running = [job_id for job_slug, job_id in self.running if job_slug == slug]
+        if running:
+            with hostel_engine().begin() as conn:
+                conn.execute(update(Job).where(Job.id.in_(running), Job.status == 'running')
+                             .values(heartbeat_at=datetime.now()))
+        recover_stale_jobs(config['JOB_STALE_SECONDS'], config['JOB_MAX_ATTEMPTS'])
+        if config['READ_REPLICA'] == 'copy':
+            read_replicas.refresh_if_due()
+        if time.monotonic() - self.maintenance_checked.get(slug, -60) >= 60:
+            self.maintenance_checked[slug] = time.monotonic()
+            if config['BACKUP_INTERVAL_HOURS']:
+                schedule_backup(config['BACKUP_INTERVAL_HOURS'])
+            if config['AUDIT_SNAPSHOT_ENTRIES']:
+                snapshot_audit_if_due(config['AUDIT_SNAPSHOT_ENTRIES'])
+        while len(self.running) < config['JOB_WORKERS']:
+            job_id = claim_job(self.worker, config['JOB_MAX_RUNNING'])
+            if job_id is None:
+                break
+            with self.lock:
+                self.running.add((slug, job_id))
+            threading.Thread(target=self._run, args=(flask_app, slug, job_id),
+                             name=f'job-{slug}-{job_id}', daemon=True).start()
+
+    def _run(self, flask_app, slug, job_id):
+        try:
+            with flask_app.app_context():
+                g.hostel = slug
+                run_job(job_id, self.worker)
+        finally:
+            with self.lock:
+                self.running.discard((slug, job_id))
+            self.wakeup.set()
+
+job_runner = JobRunner()
+
+@app.before_request
+def select_hostel():
+    slug = request.environ.get('hostel.slug')
+    assigned = current_user.hostel if current_user.is_authenticated else None
+    if slug is None:
+        slug = assigned or app.config['DEFAULT_HOSTEL']
+    elif assigned and slug != assigned:
+        abort(403)
+    if slug not in hostel_slugs():
+        abort(404)
+    g.hostel = slug
+
+@app.context_processor
+def inject_hostel():
+    return {'hostel_slug': current_hostel(), 'hostel_name': hostel_name(current_hostel())}
+
+# Link to a page of another hostel
+@app.template_global()
+def hostel_url(slug, endpoint, **values):
+    path = url_for(endpoint, **values)[len(request.script_root):]
+    return f"{request.environ.get('hostel.root', '')}/h/{slug}{path}"
+
+# Cross-hostel summary, one thread per hostel database
+def _hostel_summary(slug):
+    with app.app_context():
+        g.hostel = slug
+        summary = {'slug': slug, 'name': hostel_name(slug)}
+        try:
+            summary.update(hostel_stats())
+        except Exception as e:
+            app.logger.exception('Summary of hostel %s failed', slug)
+            summary['error'] = str(e)
+        return summary
+
+def hostel_summaries():
+    slugs = hostel_slugs()
+    with ThreadPoolExecutor(max_workers=min(len(slugs), app.config['HOSTEL_FANOUT_WORKERS'])) as pool:
+        hostels = list(pool.map(_hostel_summary, slugs))
+    totals = {key: sum(hostel.get(key, 0) for hostel in hostels)
+              for key in ('total_rooms', 'total_students', 'total_beds', 'occupied_beds', 'available_beds')}
+    return hostels, totals
+
+@app.before_request
+def start_job_runner():
+    if app.config['JOB_RUNNER_ENABLED']:
+        job_runner.start(app)
+
+@job_handler('audit_export')
+def export_audit_log(job):
+    total = AuditLog.query.count()
+    path = job.result_file('audit_log.csv')
+    # Users live in the main database, so they cannot be joined here
+    usernames = dict(db.session.query(User.id, User.username).all())
+    query = (db.session.query(AuditLog.id, AuditLog.timestamp, AuditLog.user_id, AuditLog.action,
+                              AuditLog.entity_type, AuditLog.entity_id, AuditLog.details)
+             .order_by(AuditLog.id))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'timestamp', 'user', 'action', 'entity_type', 'entity_id', 'details'])
+        for done, row in enumerate(query.yield_per(5000), 1):
+            writer.writerow([row.id, row.timestamp.strftime('%Y-%m-%d %H:%M:%S') if row.timestamp else '',
+                             usernames.get(row.user_id, 'System'), row.action, row.entity_type, row.entity_id, row.details])
+            if done % 5000 == 0:
+                job.progress(done, total, f'{done} of {total} entries exported')
+    return path
+
+@job_handler('analytics')
+def analytics_report(job):
+    months = min(max(int(job.params.get('months', 12)), 1), 120)
+    report = compute_occupancy_analytics(db.session.connection(), months=months)
+    path = job.result_file('analytics.json')
+    with open(path, 'w') as f:
+        json.dump(report, f)
+    return path
+
+@job_handler('migrate_audit_data')
+def migrate_audit_data_job(job):
+    result = migrate_audit_data(progress=lambda done, total: job.progress(done, total))
+    job.progress(1, 1, f"Migrated {result['migrated']} entries, {result['unparsed']} unparsed", force=True)
+
+@job_handler('capacity_simulation')
+def capacity_simulation_job(job):
+    scenarios = [parse_scenario(str(value)) for value in job.params.get('scenarios', [])] or None
+    result = simulate_capacity(trials=min(int(job.params.get('trials', 5000)), 100000),
+                               weeks=min(max(int(job.params.get('weeks', 26)), 1), 104),
+                               scenarios=scenarios, seed=job.params.get('seed'),
+                               progress=lambda done, total: job.progress(done, total))
+    path = job.result_file('capacity.json')
+    with open(path, 'w') as f:
+        json.dump(result, f)
+    return path
+
+@job_handler('backfill_occupancy')
+def backfill_occupancy_job(job):
+    RoomOccupancyDaily.query.delete()
+    HostelOccupancyDaily.query.delete()
+    room_rows, hostel_rows = backfill_occupancy()
+    job.progress(1, 1, f'Backfilled {room_rows} room-day rows and {hostel_rows} hostel-day rows', force=True)
+
+@job_handler('rebuild_audit_rollups')
+def rebuild_audit_rollups_job(job):
+    rows = rebuild_audit_rollups()
+    job.progress(1, 1, f'Rebuilt {rows} rollup rows', force=True)
+
+@job_handler('reconcile_occupancy')
+def reconcile_occupancy_job(job):
+    result = reconcile_occupancy(repair=bool(job.params.get('repair')), full=bool(job.params.get('full')))
+    path = job.result_file('reconciliation.json')
+    with open(path, 'w') as f:
+        json.dump(result, f)
+    job.progress(1, 1, f"{len(result['mismatches'])} of {result['rooms_checked']} rooms mismatched", force=True)
+    return path
+
+# Online backups through SQLite's backup API. Pages are copied in batches
+# of BACKUP_PAGES and the source is left alone for BACKUP_PAUSE seconds
+# between batches, so writers only ever wait for one batch. A write from
+# another connection makes SQLite restart the copy, so on a busy database
+# the copy is retried with larger batches and finally in one step. Copies
+# are integrity-checked, gzipped and rotated to the newest BACKUP_KEEP.
+class BackupRestarted(Exception):
+    pass
+
+BACKUP_NAME = re.compile(r'(?P<slug>[a-z0-9-]+)-(?P<stamp>\d{8}-\d{6})\.db\.gz$')
+
+def backup_dir(slug=None):
+    return os.path.join(app.config['BACKUP_DIR'], slug or current_hostel())
+
+def list_backups(slug=None):
+    directory = backup_dir(slug)
+    if not os.path.isdir(directory):
+        return []
+    backups = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        match = BACKUP_NAME.match(name)
+        if match:
+            backups.append({'name': name, 'path': os.path.join(directory, name),
+                            'size': os.path.getsize(os.path.join(directory, name)),
+                            'created_at': datetime.strptime(match.group('stamp'), '%Y%m%d-%H%M%S')})
+    return backups
+
+# Copy a live database with the backup API. The time between progress
+# callbacks, less our own pause, is how long each batch locked the source.
+def copy_database(source_path, target_path, progress=None):
+    pause = app.config['BACKUP_PAUSE']
+    steps = []
+    remaining_before = [None]
+    clock = [time.perf_counter()]
+
+    def step(status, remaining, total):
+        steps.append(time.perf_counter() - clock[0])
+        if remaining_before[0] is not None and remaining > remaining_before[0]:
+            raise BackupRestarted()
+        remaining_before[0] = remaining
+        if progress:
+            progress(total - remaining, total)
+        time.sleep(pause)
+        clock[0] = time.perf_counter()
+
+    began = time.perf_counter()
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        for attempt, pages in enumerate((app.config['BACKUP_PAGES'], app.config['BACKUP_PAGES'] * 16, -1), 1):
+            copy = sqlite3.connect(target_path)
+            remaining_before[0] = None
+            snapshot_at = time.time()
+            clock[0] = time.perf_counter()
+            try:
+                source.backup(copy, pages=pages, progress=step)
+                break
+            except BackupRestarted:
+                copy.close()
+        seconds = time.perf_counter() - began
+        size = copy.execute('PRAGMA page_count').fetchone()[0] * copy.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        source.close()
+        copy.close()
+    return {
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'mb_per_second': round(size / 1048576 / seconds, 1) if seconds else None,
+        'batches': len(steps),
+        'attempts': attempt,
+        'max_pause_ms': round(max(steps) * 1000, 2) if steps else 0,
+        'mean_pause_ms': round(sum(steps) / len(steps) * 1000, 2) if steps else 0,
+        'snapshot_at': snapshot_at,
+    }
+
+def backup_database(progress=None):
+    slug = current_hostel()
+    directory = backup_dir(slug)
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, f"{slug}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz")
+    partial = target + '.partial'
+
+    result = copy_database(hostel_engine(slug).url.database, partial, progress)
+    check = sqlite3.connect(partial)
+    try:
+        integrity = check.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        check.close()
+    if integrity != 'ok':
+        os.remove(partial)
+        raise RuntimeError(f'Backup copy failed its integrity check: {integrity}')
+
+    with open(partial, 'rb') as f, gzip.open(target + '.tmp', 'wb') as out:
+        shutil.copyfileobj(f, out, 1024 * 1024)
+    os.replace(target + '.tmp', target)
+    os.remove(partial)
+
+    for old in list_backups(slug)[app.config['BACKUP_KEEP']:]:
+        os.remove(old['path'])
+
+    del result['snapshot_at']
+    return dict(result, hostel=slug, file=target, compressed_bytes=os.path.getsize(target))
+
+# Queue a backup job unless a recent backup or a pending backup job
+# exists; the conditional insert keeps worker processes from racing
+def schedule_backup(interval_hours):
+    now = datetime.now()
+    cutoff = now - timedelta(hours=interval_hours)
+    backups = list_backups()
+    if backups and backups[0]['created_at'] > cutoff:
+        return False
+    recent = select(Job.id).where(Job.kind == 'backup',
+                                  Job.status.in_(('queued', 'running')) | (Job.created_at > cutoff)).exists()
+    row = select(literal('backup'), literal('{}'), literal('queued'), literal(0.0), literal(0),
+                 literal(False), literal(now, db.DateTime)).where(~recent)
+    with hostel_engine().begin() as conn:
+        return conn.execute(insert(Job).from_select(
+            ['kind', 'params', 'status', 'progress', 'attempts', 'cancel_requested', 'created_at'], row)).rowcount > 0
+
+def restore_database(path):
+    slug = current_hostel()
+    engine = hostel_engine(slug)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, 'restore.db')
+        with gzip.open(path, 'rb') as f, open(plain, 'wb') as out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        backup = sqlite3.connect(plain)
+        live = sqlite3.connect(engine.url.database, timeout=30)
+        try:
+            integrity = backup.execute('PRAGMA integrity_check').fetchone()[0]
+            if integrity != 'ok':
+                raise click.ClickException(f'Backup failed its integrity check: {integrity}')
+            # Cached pages are keyed on the data version, so the restored
+            # database must continue past every version served before
+            version = live.execute('SELECT MAX(version) FROM data_version').fetchone()[0] or 0
+            backup.execute('INSERT INTO data_version (id, version) VALUES (1, ?) '
+                           'ON CONFLICT (id) DO UPDATE SET version = MAX(version, excluded.version) + 1',
+                           (version + 1,))
+            backup.commit()
+            backup.backup(live)
+        finally:
+            backup.close()
+            live.close()
+    engine.dispose()
+    upgrade_schema()
+
+@job_handler('backup')
+def backup_job(job):
+    result = backup_database(progress=lambda done, total: job.progress(done, total))
+    job.progress(1, 1, f"Backed up {result['bytes']} bytes at {result['mb_per_second']} MB/s, "
+                       f"longest pause {result['max_pause_ms']}ms", force=True)
+
+@app.cli.command('backup')
+@hostel_option
+def backup_command():
+    result = backup_database()
+    click.echo(f"Wrote {result['file']} ({result['compressed_bytes']} bytes compressed from {result['bytes']})")
+    click.echo(f"{result['seconds']}s at {result['mb_per_second']} MB/s in {result['batches']} batches "
+               f"over {result['attempts']} attempts, longest pause {result['max_pause_ms']}ms")
+
+@app.cli.command('restore-backup')
+@hostel_option
+@click.argument('backup')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def restore_backup_command(backup, yes):
+    path = backup if os.path.exists(backup) else os.path.join(backup_dir(), backup)
+    if not os.path.exists(path):
+        raise click.BadParameter(f'no backup at {backup}', param_hint='BACKUP')
+    if not yes:
+        click.confirm(f'Replace the {current_hostel()} database with {os.path.basename(path)}?', abort=True)
+    restore_database(path)
+    click.echo(f'Restored {os.path.basename(path)}')
+
+# Portable hostel archives: gzipped JSON lines. A header line carries the
+# format version, each table starts with a line naming its columns and is
+# followed by one JSON array per row, and a footer with the row counts marks
+# the archive complete. The export streams every table from one read
+# transaction, so memory stays flat and the tables agree with each other.
+# Derived tables (audit rollups and snapshots, the search index) are
+# rebuilt on import, and per-deployment state (jobs, webhooks, the outbox)
+# is left behind. Users are merged by username into the target's main
+# database and audit entries are pointed at the merged IDs.
+EXPORT_FORMAT = 'knk-hostel-export'
+EXPORT_VERSION = 1
+EXPORT_TABLES = ['user', 'room', 'student', 'reservation', 'waitlist_entry', 'resident_history',
+                 'room_occupancy_daily', 'hostel_occupancy_daily', 'audit_log']
+EXPORT_DERIVED_TABLES = ['audit_rollup', 'audit_snapshot', 'reconciliation_run']
+EXPORT_BATCH_SIZE = 10000
+
+def _archive_columns(conn, table):
+    present = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    return [column.name for column in db.metadata.tables[table].columns
+            if column.computed is None and column.name in present]
+
+# Scalar defaults of the given columns, for rows from archives that lack a
+# column or hold NULL where this schema requires a value
+def _archive_defaults(table, columns):
+    defaults = {}
+    for column in db.metadata.tables[table].columns:
+        if column.name not in columns:
+            continue
+        if column.default is not None and column.default.is_scalar:
+            defaults[column.name] = column.default.arg
+        elif column.server_default is not None and isinstance(column.server_default.arg, str):
+            defaults[column.name] = column.server_default.arg
+    return defaults
+
+def export_hostel(out, progress=None):
+    slug = current_hostel()
+    conn = sqlite3.connect(hostel_engine(slug).url.database, timeout=30, isolation_level=None)
+    main = conn if slug == app.config['DEFAULT_HOSTEL'] else sqlite3.connect(db.engine.url.database, timeout=30)
+    encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+    counts = {}
+    try:
+        # One read transaction: a consistent snapshot, however long it takes
+        conn.execute('BEGIN')
+        with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) as archive:
+            archive.write(encode({'format': EXPORT_FORMAT, 'version': EXPORT_VERSION, 'hostel': slug,
+                                  'exported_at': datetime.now().isoformat(timespec='seconds'),
+                                  'tables': EXPORT_TABLES}).encode() + b'\n')
+            for table in EXPORT_TABLES:
+                source = main if table == 'user' else conn
+                columns = _archive_columns(source, table)
+                query, params = f'SELECT {", ".join(columns)} FROM "{table}"', ()
+                if table == 'user' and source is not conn:
+                    # A hostel's own staff and the users who manage every hostel
+                    query, params = query + ' WHERE hostel = ? OR hostel IS NULL', (slug,)
+                archive.write(encode({'table': table, 'columns': columns}).encode() + b'\n')
+                cursor = source.execute(query, params)
+                counts[table] = 0
+                while True:
+                    rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                    if not rows:
+                        break
+                    archive.write(('\n'.join(map(encode, rows)) + '\n').encode())
+                    counts[table] += len(rows)
+                    if progress:
+                        progress(table, counts[table])
+            archive.write(encode({'end': True, 'rows': counts}).encode() + b'\n')
+    finally:
+        conn.close()
+        if main is not conn:
+            main.close()
+    return counts
+
+def _insert_rows(conn, table, columns, rows):
+    placeholders = ', '.join('?' * len(columns))
+    conn.executemany(f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({placeholders})', rows)
+
+# Staff of the exported hostel become staff of the hostel imported into
+def _merge_users(main, columns, rows, user_ids, source_slug, slug):
+    for row in rows:
+        user = dict(zip(columns, row))
+        if user.get('hostel') == source_slug:
+            user['hostel'] = slug
+        existing = main.execute('SELECT id FROM user WHERE username = ?', (user['username'],)).fetchone()
+        if existing is None:
+            names = [name for name in columns if name != 'id']
+            existing = (main.execute(f'INSERT INTO user ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+                                     [user[name] for name in names]).lastrowid,)
+        user_ids[user['id']] = existing[0]
+
+def import_hostel(stream, replace=False, progress=None):
+    slug = current_hostel()
+    lines = io.TextIOWrapper(gzip.GzipFile(fileobj=stream, mode='rb'), encoding='utf-8')
+    try:
+        header = json.loads(next(lines))
+    except (OSError, StopIteration, ValueError):
+        raise click.ClickException('Not a hostel export archive')
+    if not isinstance(header, dict) or header.get('format') != EXPORT_FORMAT:
+        raise click.ClickException('Not a hostel export archive')
+    if header.get('version', 0) > EXPORT_VERSION:
+        raise click.ClickException(f"Archive format version {header['version']} is newer than this "
+                                   f'application supports ({EXPORT_VERSION})')
+
+    upgrade_schema()
+    db.session.remove()
+    conn = sqlite3.connect(hostel_engine(slug).url.database, timeout=30, isolation_level=None)
+    main = conn if slug == app.config['DEFAULT_HOSTEL'] else \
+        sqlite3.connect(db.engine.url.database, timeout=30, isolation_level=None)
+    tables = [table for table in EXPORT_TABLES if table != 'user']
+    counts, user_ids, footer = {}, {}, None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        if main is not conn:
+            main.execute('BEGIN IMMEDIATE')
+        occupied = [table for table in tables if conn.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone()]
+        if occupied and not replace:
+            raise click.ClickException(f'The {slug} database already has data in {", ".join(occupied)}; '
+                                       'use --replace to overwrite it')
+        # Indexes are built once at the end rather than updated on every
+        # insert, and the search index is rebuilt from the students
+        indexes = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN "
+            f"({', '.join('?' * len(tables))})", tables).fetchall()
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+        for name in ('student_search_ai', 'student_search_ad', 'student_search_au'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute('DROP TABLE IF EXISTS student_search')
+        for table in tables + EXPORT_DERIVED_TABLES:
+            conn.execute(f'DELETE FROM "{table}"')
+
+        table = columns = keep = remap = None
+        fill, extra, batch = [], [], []
+
+        def flush():
+            if not batch:
+                return
+            rows = batch if keep is None else [[row[i] for i in keep] for row in batch]
+            if remap is not None:
+                for row in rows:
+                    if row[remap] is not None:
+                        row[remap] = user_ids.get(row[remap])
+            if fill or extra:
+                for row in rows:
+                    for index, value in fill:
+                        if row[index] is None:
+                            row[index] = value
+                    row.extend(extra)
+            if table == 'user':
+                _merge_users(main, columns, rows, user_ids, header.get('hostel'), slug)
+            else:
+                _insert_rows(conn, table, columns, rows)
+            counts[table] += len(batch)
+            batch.clear()
+            if progress:
+                progress(table, counts[table])
+
+        for line in lines:
+            if line.startswith('['):
+                if table is None:
+                    raise click.ClickException('Archive has rows outside a table')
+                batch.append(json.loads(line))
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    flush()
+                continue
+            flush()
+            record = json.loads(line)
+            if record.get('end'):
+                footer = record
+                break
+            # Columns this schema no longer has are dropped. New ones, and
+            # NULLs in columns that have since become NOT NULL, take their
+            # defaults
+            table, archived = record['table'], record['columns']
+            if table not in EXPORT_TABLES:
+                raise click.ClickException(f'Archive has unknown table {table}')
+            present = _archive_columns(main if table == 'user' else conn, table)
+            columns = [name for name in archived if name in present]
+            keep = None if columns == archived else [archived.index(name) for name in columns]
+            remap = columns.index('user_id') if table == 'audit_log' and 'user_id' in columns else None
+            defaults = _archive_defaults(table, present)
+            schema = db.metadata.tables[table].columns
+            fill = [(index, defaults[name]) for index, name in enumerate(columns)
+                    if name in defaults and not schema[name].nullable]
+            added = [name for name in defaults if name not in columns]
+            extra = [defaults[name] for name in added]
+            columns = columns + added
+            counts[table] = 0
+        if footer is None or footer['rows'] != counts:
+            raise click.ClickException('Archive is incomplete; nothing was imported')
+
+        for name, sql in indexes:
+            conn.execute(sql)
+        for statement in STUDENT_SEARCH_DDL:
+            conn.execute(statement)
+        conn.execute("INSERT INTO student_search(student_search) VALUES ('rebuild')")
+        # Cached pages must not survive the swap
+        conn.execute('INSERT INTO data_version (id, version) VALUES (1, 1) '
+                     'ON CONFLICT (id) DO UPDATE SET version = version + 1')
+        if main is not conn:
+            main.execute('COMMIT')
+        conn.execute('COMMIT')
+    except BaseException:
+        for handle in {id(conn): conn, id(main): main}.values():
+            if handle.in_transaction:
+                handle.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+        if main is not conn:
+            main.close()
+    hostel_engine(slug).dispose()
+    # Rebuilds the audit rollups and fills in anything an older archive lacks
+    upgrade_schema()
+    return {'header': header, 'rows': counts}
+
+@app.cli.command('export-hostel')
+@hostel_option
+@click.argument('archive')
+def export_hostel_command(archive):
+    started = time.perf_counter()
+    if archive == '-':
+        counts = export_hostel(sys.stdout.buffer)
+    else:
+        partial = archive + '.partial'
+        with open(partial, 'wb') as out:
+            counts = export_hostel(out)
+        os.replace(partial, archive)
+    summary = ', '.join(f'{rows} {table}' for table, rows in counts.items())
+    click.echo(f'Exported {summary} in {time.perf_counter() - started:.1f}s', err=True)
+
+@app.cli.command('import-hostel')
+@hostel_option
+@click.argument('archive')
+@click.option('--replace', is_flag=True, help='Overwrite the data already in the hostel database.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def import_hostel_command(archive, replace, yes):
+    if replace and not yes:
+        click.confirm(f'Replace the data in the {current_hostel()} database with {archive}?', abort=True)
+    started = time.perf_counter()
+    if archive == '-':
+        result = import_hostel(sys.stdin.buffer, replace)
+    else:
+        with open(archive, 'rb') as stream:
+            result = import_hostel(stream, replace)
+    summary = ', '.join(f'{rows} {table}' for table, rows in result['rows'].items())
+    click.echo(f"Imported {summary} from the {result['header']['hostel']} export of "
+               f"{result['header']['exported_at']} in {time.perf_counter() - started:.1f}s")
+
+# Read replicas for the read-only pages. In 'copy' mode the job dispatcher
+# refreshes a copy of each hostel database every REPLICA_REFRESH_SECONDS;
+# in 'wal' mode the primary switches to WAL and reads go through a
+# separate pool of read-only connections. A request only uses the replica
+# when it is at most REPLICA_MAX_STALENESS seconds old and newer than the
+# user's last write to that hostel. A copy's age counts from when it
+# started, so a database that takes longer than REPLICA_MAX_STALENESS to
+# copy can never serve reads: those stay on the primary, and the copy is
+# only retried every REPLICA_SLOW_RETRY_SECONDS instead of back to back.
+READ_REPLICA_ENDPOINTS = {'dashboard', 'beds', 'audit_logs', 'api_audit_logs'}
+
+class ReadReplica:
+    def __init__(self, slug):
+        self.slug = slug
+        self.lock = threading.Lock()
+        self.path = os.path.join(app.config['REPLICA_DIR'], f'{slug}.db')
+        self.replica_engine = None
+        self.loaded = None
+        self.copy_seconds = None
+
+    # Unix time the replica's data was read from the primary
+    def as_of(self):
+        if app.config['READ_REPLICA'] == 'wal':
+            return time.time()
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def engine(self):
+        if app.config['READ_REPLICA'] == 'wal':
+            source, loaded = hostel_engine(self.slug).url.database, 'wal'
+        else:
+            source, loaded = self.path, self.as_of()
+        if self.loaded != loaded:
+            with self.lock:
+                if self.loaded != loaded:
+                    if loaded == 'wal':
+                        with hostel_engine(self.slug).connect() as conn:
+                            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+                    # A refreshed copy is a new file; pooled connections
+                    # would keep reading the old one
+                    if self.replica_engine is not None:
+                        self.replica_engine.dispose()
+                    self.replica_engine = create_engine(f'sqlite:///file:{source}?mode=ro&uri=true')
+                    self.loaded = loaded
+        return self.replica_engine
+
+    def too_slow(self):
+        return self.copy_seconds is not None and self.copy_seconds >= app.config['REPLICA_MAX_STALENESS']
+
+    def refresh_if_due(self):
+        as_of = self.as_of()
+        interval = app.config['REPLICA_SLOW_RETRY_SECONDS' if self.too_slow() else 'REPLICA_REFRESH_SECONDS']
+        if as_of is not None and time.time() - as_of < interval:
+            return False
+        os.makedirs(app.config['REPLICA_DIR'], exist_ok=True)
+        partial = f'{self.path}.{os.getpid()}.partial'
+        result = copy_database(hostel_engine(self.slug).url.database, partial)
+        # Stamped with the time the copy started: it has no writes from later
+        os.utime(partial, (result['snapshot_at'], result['snapshot_at']))
+        os.replace(partial, self.path)
+        was_slow, self.copy_seconds = self.too_slow(), result['seconds']
+        if self.too_slow() and not was_slow:
+            app.logger.warning('Copying %s for its read replica took %.1fs, more than REPLICA_MAX_STALENESS (%ss); '
+                               'reads stay on the primary', self.slug, result['seconds'],
+                               app.config['REPLICA_MAX_STALENESS'])
+        return True
+
+read_replicas = PerHostel(ReadReplica)
+
+@app.before_request
+def route_reads():
+    g.read_replica = False
+    if not app.config['READ_REPLICA'] or request.method != 'GET' or request.endpoint not in READ_REPLICA_ENDPOINTS:
+        return
+    as_of = read_replicas.as_of()
+    if as_of is None or time.time() - as_of > app.config['REPLICA_MAX_STALENESS']:
+        return
+    if as_of <= session.get('wrote_at', {}).get(current_hostel(), 0):
+        return
+    g.read_replica = True
+
+@app.after_request
+def remember_writes(response):
+    if app.config['READ_REPLICA']:
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            session['wrote_at'] = dict(session.get('wrote_at', {}), **{current_hostel(): time.time()})
+        response.headers['X-Served-From'] = 'replica' if g.get('read_replica') else 'primary'
+    return response
+
+# Rate limiting and backpressure. Token buckets live in a small SQLite file
+# shared by every gunicorn worker; each check refills, tests and spends in
+# one upsert, so workers racing on a bucket are serialized by SQLite's
+# write lock. Expensive endpoints also take a lease from the same file,
+# capping how many run at once across all workers; past the cap they
+# answer 503 straight away instead of tying up more workers. Leases expire
+# in case a worker dies holding one.
+RATE_LIMIT_TAKE = """
+    INSERT INTO bucket (key, tokens, updated, granted) VALUES (:key, :burst - 1, :now, 1)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = MIN(:burst, tokens + (:now - updated) * :rate)
+                 - (MIN(:burst, tokens + (:now - updated) * :rate) >= 1),
+        granted = MIN(:burst, tokens + (:now - updated) * :rate) >= 1,
+        updated = :now
+    RETURNING tokens, granted"""
+
+class RateLimiter:
+    def __init__(self):
+        self.local = threading.local()
+        self.calls = 0
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            path = app.config['RATE_LIMIT_PATH']
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+            # Losing a few counters on a crash is harmless
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, granted INTEGER)')
+            conn.execute('CREATE TABLE IF NOT EXISTS lease '
+                         '(token TEXT PRIMARY KEY, name TEXT NOT NULL, expires REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_lease_name ON lease (name, expires)')
+            self.local.conn = conn
+        return conn
+
+    # Returns 0 when the request may go ahead, else the seconds until the
+    # bucket holds a token again
+    def take(self, key, rate, burst):
+        now = time.time()
+        conn = self._conn()
+        tokens, granted = conn.execute(RATE_LIMIT_TAKE, {'key': key, 'rate': rate, 'burst': burst, 'now': now}).fetchone()
+        self.calls += 1
+        if self.calls % 1000 == 0:
+            # Buckets idle long enough to have refilled are the same as no bucket
+            conn.execute('DELETE FROM bucket WHERE updated < ?', (now - 3600,))
+        if granted:
+            return 0
+        return max(math.ceil((1 - tokens) / rate), 1)
+
+    def acquire(self, name, limit, lease_seconds):
+        now = time.time()
+        token = os.urandom(8).hex()
+        conn = self._conn()
+        acquired = conn.execute(
+            'INSERT INTO lease (token, name, expires) SELECT ?, ?, ? '
+            'WHERE (SELECT COUNT(*) FROM lease WHERE name = ? AND expires > ?) < ?',
+            (token, name, now + lease_seconds, name, now, limit)).rowcount
+        if not acquired:
+            conn.execute('DELETE FROM lease WHERE expires <= ?', (now,))
+            return None
+        return token
+
+    def release(self, token):
+        self._conn().execute('DELETE FROM lease WHERE token = ?', (token,))
+
+rate_limiter = RateLimiter()
+
+def rate_limit_rule():
+    rules = app.config['RATE_LIMITS']
+    if request.endpoint == 'login':
+        return rules.get('login') if request.method == 'POST' else None
+    if request.endpoint in rules:
+        return rules[request.endpoint]
+    if request.path.startswith('/api/'):
+        return rules.get('api')
+    return None
+
+def limited_response(status, retry_after, message):
+    if request.endpoint == 'login':
+        flash(message)
+        response = make_response(render_template('login.html'), status)
+    elif request.path.startswith('/api/'):
+        response = make_response(jsonify({'error': message, 'retry_after': retry_after}), status)
+    else:
+        response = make_response(message, status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def limit_requests():
+    if not app.config['RATE_LIMIT_ENABLED'] or request.endpoint is None:
+        return None
+    rule = rate_limit_rule()
+    if rule is not None:
+        # Signed-in users are limited per account, everyone else per address
+        client = f'user:{current_user.id}' if current_user.is_authenticated else f'ip:{request.remote_addr}'
+        retry_after = rate_limiter.take(f'{request.endpoint}|{client}', *rule)
+        if retry_after:
+            return limited_response(429, retry_after, f'Too many requests, try again in {retry_after} seconds')
+    limit = app.config['CONCURRENCY_LIMITS'].get(request.endpoint)
+    if limit is not None:
+        g.lease = rate_limiter.acquire(request.endpoint, limit, app.config['CONCURRENCY_LEASE_SECONDS'])
+        if g.lease is None:
+            return limited_response(503, 2, 'This page is busy, try again in a moment')
+    return None
+
+@app.teardown_request
+def release_lease(error=None):
+    if g.get('lease'):
+        rate_limiter.release(g.lease)
+        g.lease = None
+
+# Transactional outbox. Mutating routes add an OutboxEvent in the same
+# transaction as the change itself, so an event exists exactly when the
+# change was committed. The webhook dispatcher thread drains it after the
+# response has gone out: each subscriber has a cursor (the last event id
+# it acknowledged) and receives events after it in batches. The cursor
+# only moves on a 2xx, so delivery is at least once; receivers dedupe on
+# the event id.
+EVENT_TYPES = ['student.checked_in', 'student.checked_out', 'room.added', 'room.updated']
+
+# AUTOINCREMENT so pruning the newest events can never hand their ids out
+# again behind a subscriber's cursor. SQLite has a single writer, so ids
+# also commit in order and a cursor never skips a late commit.
+class OutboxEvent(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+class WebhookSubscriber(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    url = db.Column(db.String(300), nullable=False)
+    event_types = db.Column(db.String(300), nullable=False, default='*')  # comma separated, or *
+    secret = db.Column(db.String(100))
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    cursor = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    leased_until = db.Column(db.DateTime)
+    last_error = db.Column(db.String(300))
+    last_delivered_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def wants(self, event_type):
+        return self.event_types == '*' or event_type in self.event_types.split(',')
+
+def emit_event(event_type, **data):
+    db.session.add(OutboxEvent(event_type=event_type, payload=json.dumps(data, default=str)))
+    db.session.info['outbox'] = True
+
+@event.listens_for(HostelSession, 'after_commit')
+def _wake_webhook_dispatcher(db_session):
+    if db_session.info.pop('outbox', False):
+        webhook_dispatcher.wakeup.set()
+
+@event.listens_for(HostelSession, 'after_rollback')
+def _forget_outbox(db_session):
+    db_session.info.pop('outbox', None)
+
+def event_envelope(outbox_event):
+    return {'id': outbox_event.id, 'type': outbox_event.event_type, 'hostel': current_hostel(),
+            'occurred_at': outbox_event.created_at.strftime('%Y-%m-%dT%H:%M:%S'),
+            'data': json.loads(outbox_event.payload)}
+
+def post_webhook(subscriber, events):
+    body = json.dumps({'hostel': current_hostel(), 'events': events}).encode()
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'KnK-Hostel-Webhooks',
+               'X-Hostel-Delivery': f'{subscriber.id}-{events[0]["id"]}-{events[-1]["id"]}'}
+    if subscriber.secret:
+        signature = hmac.new(subscriber.secret.encode(), body, hashlib.sha256).hexdigest()
+        headers['X-Hostel-Signature'] = f'sha256={signature}'
+    outgoing = urllib.request.Request(subscriber.url, data=body, headers=headers, method='POST')
+    with urllib.request.urlopen(outgoing, timeout=app.config['WEBHOOK_TIMEOUT']) as response:
+        return response.status
+
+def webhook_backoff(failures):
+    delay = min(app.config['WEBHOOK_BACKOFF_BASE'] * 2 ** (failures - 1), app.config['WEBHOOK_BACKOFF_MAX'])
+    return delay * random.uniform(0.5, 1)
+
+# Delivers everything a subscriber is owed, one batch at a time. The lease
+# keeps two dispatchers (say, two gunicorn workers) from sending the same
+# batch at once; a dispatcher that dies just lets the lease run out.
+def deliver_webhooks(subscriber_id):
+    config = app.config
+    now = datetime.now()
+    # Long enough for one batch; renewed before each one, so a long backlog
+    # cannot outlive it and let another worker deliver the same events
+    lease_for = timedelta(seconds=config['WEBHOOK_TIMEOUT'] * 2 + 30)
+    lease = now + lease_for
+    leased = db.session.execute(
+        update(WebhookSubscriber)
+        .where(WebhookSubscriber.id == subscriber_id,
+               (WebhookSubscriber.leased_until.is_(None)) | (WebhookSubscriber.leased_until < now))
+        .values(leased_until=lease)).rowcount
+    db.session.commit()
+    if not leased:
+        return 0
+
+    # The lease's expiry doubles as its token: another worker only gets in
+    # by replacing it
+    def renew(until):
+        held = db.session.execute(
+            update(WebhookSubscriber)
+            .where(WebhookSubscriber.id == subscriber_id, WebhookSubscriber.leased_until == lease)
+            .values(leased_until=until)).rowcount
+        db.session.commit()
+        return held
+
+    subscriber = db.session.get(WebhookSubscriber, subscriber_id)
+    delivered = 0
+    try:
+        while True:
+            renewed = datetime.now() + lease_for
+            if not renew(renewed):
+                lease = None
+                break
+            lease = renewed
+            batch = OutboxEvent.query.filter(OutboxEvent.id > subscriber.cursor) \
+                .order_by(OutboxEvent.id).limit(config['WEBHOOK_BATCH_SIZE']).all()
+            if not batch:
+                break
+            events = [event_envelope(outbox_event) for outbox_event in batch
+                      if subscriber.wants(outbox_event.event_type)]
+            if events:
+                try:
+                    status = post_webhook(subscriber, events)
+                except Exception as error:
+                    status, reason = None, str(error)
+                else:
+                    reason = f'HTTP {status}'
+                if status is None or not 200 <= status < 300:
+                    subscriber.failures += 1
+                    subscriber.last_error = reason[:300]
+                    subscriber.next_attempt_at = datetime.now() + timedelta(seconds=webhook_backoff(subscriber.failures))
+                    break
+                subscriber.last_delivered_at = datetime.now()
+                delivered += len(events)
+            subscriber.cursor = batch[-1].id
+            subscriber.failures = 0
+            subscriber.last_error = None
+            subscriber.next_attempt_at = None
+            db.session.commit()
+    finally:
+        if lease is not None:
+            renew(None)
+    return delivered
+
+# Delivered events older than WEBHOOK_RETENTION_DAYS are dropped; events a
+# subscriber still owes are kept however old they are
+def prune_outbox():
+    keep_from = db.session.query(func.min(WebhookSubscriber.cursor)).filter(WebhookSubscriber.active).scalar()
+    query = OutboxEvent.query.filter(
+        OutboxEvent.created_at < datetime.now() - timedelta(days=app.config['WEBHOOK_RETENTION_DAYS']))
+    if keep_from is not None:
+        query = query.filter(OutboxEvent.id <= keep_from)
+    pruned = query.delete(synchronize_session=False)
+    db.session.commit()
+    return pruned
+
+def webhook_status():
+    latest = db.session.query(func.max(OutboxEvent.id)).scalar() or 0
+    return [{
+        'name': subscriber.name,
+        'url': subscriber.url,
+        'event_types': subscriber.event_types,
+        'active': subscriber.active,
+        'cursor': subscriber.cursor,
+        'lag': max(latest - subscriber.cursor, 0),
+        'failures': subscriber.failures,
+        'last_error': subscriber.last_error,
+        'next_attempt_at': subscriber.next_attempt_at.strftime('%Y-%m-%d %H:%M:%S') if subscriber.next_attempt_at else None,
+        'last_delivered_at': subscriber.last_delivered_at.strftime('%Y-%m-%d %H:%M:%S') if subscriber.last_delivered_at else None,
+    } for subscriber in WebhookSubscriber.query.order_by(WebhookSubscriber.name)]
+
+# Its own thread rather than part of the job dispatcher: a slow or
+# unreachable subscriber should hold up neither jobs nor backups. Commits
+# that emitted events wake it straight away.
+class WebhookDispatcher:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.pruned = {}
+
+    def start(self, flask_app):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self._dispatch, args=(flask_app,), name='webhook-dispatcher', daemon=True).start()
+
+    def _dispatch(self, flask_app):
+        while True:
+            self.wakeup.clear()
+            wait = flask_app.config['WEBHOOK_POLL_SECONDS']
+            try:
+                with flask_app.app_context():
+                    slugs = hostel_slugs()
+                for slug in slugs:
+                    with flask_app.app_context():
+                        g.hostel = slug
+                        wait = min(wait, self._poll(slug))
+            except Exception:
+                flask_app.logger.exception('Webhook dispatcher failed')
+            self.wakeup.wait(max(wait, 0.05))
+
+    # Returns the seconds until this hostel's next retry is due
+    def _poll(self, slug):
+        due = db.session.scalars(
+            select(WebhookSubscriber.id).where(
+                WebhookSubscriber.active,
+                (WebhookSubscriber.next_attempt_at.is_(None)) | (WebhookSubscriber.next_attempt_at <= datetime.now()))
+        ).all()
+        for subscriber_id in due:
+            deliver_webhooks(subscriber_id)
+        if time.monotonic() - self.pruned.get(slug, -3600) >= 3600:
+            self.pruned[slug] = time.monotonic()
+            prune_outbox()
+        next_attempt = db.session.query(func.min(WebhookSubscriber.next_attempt_at)) \
+            .filter(WebhookSubscriber.active).scalar()
+        if next_attempt is None:
+            return app.config['WEBHOOK_POLL_SECONDS']
+        return (next_attempt - datetime.now()).total_seconds()
+
+webhook_dispatcher = WebhookDispatcher()
+
+@app.before_request
+def start_webhook_dispatcher():
+    if app.config['WEBHOOK_DISPATCHER_ENABLED']:
+        webhook_dispatcher.start(app)
+
+# A worker forked from a preloaded gunicorn master must not share SQLite
+# connections with it: drop the inherited ones without closing them under
+# the parent and let the worker open its own. Background threads are
+# restarted per pid by the before_request hooks above.
+def reset_connections_after_fork():
+    with app.app_context():
+        engines = [db.engine, *hostel_directory.engines.values(),
+                   *(replica.replica_engine for replica in read_replicas.instances.values())]
+    for engine in engines:
+        if engine is not None:
+            engine.dispose(close=False)
+    for cache in fragment_cache.instances.values():
+        cache.local = threading.local()
+    rate_limiter.local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_connections_after_fork)
+
+@app.cli.command('add-webhook')
+@click.argument('name')
+@click.argument('url')
+@click.option('--events', default='*', help='Comma separated event types (default: all).')
+@click.option('--secret', help='Shared secret for the X-Hostel-Signature header.')
+@click.option('--from-start', is_flag=True, help='Also deliver events already in the outbox.')
+@hostel_option
+def add_webhook_command(name, url, events, secret, from_start):
+    if WebhookSubscriber.query.filter_by(name=name).first() is not None:
+        raise click.BadParameter(f'webhook {name} already exists', param_hint='NAME')
+    unknown = set(events.split(',')) - set(EVENT_TYPES) - {'*'}
+    if unknown:
+        raise click.BadParameter(f"unknown event types {', '.join(sorted(unknown))}; "
+                                 f"use {', '.join(EVENT_TYPES)}", param_hint='--events')
+    cursor = 0 if from_start else db.session.query(func.max(OutboxEvent.id)).scalar() or 0
+    db.session.add(WebhookSubscriber(name=name, url=url, event_types=events, secret=secret, cursor=cursor))
+    db.session.commit()
+    click.echo(f'Added webhook {name} for {events} events, starting after event {cursor}')
+
+@app.cli.command('remove-webhook')
+@click.argument('name')
+@hostel_option
+def remove_webhook_command(name):
+    if WebhookSubscriber.query.filter_by(name=name).delete() == 0:
+        raise click.BadParameter(f'no webhook named {name}', param_hint='NAME')
+    db.session.commit()
+    click.echo(f'Removed webhook {name}')
+
+# A local stand-in for a subscriber: prints every batch it receives and
+# can be told to fail some of them to exercise the retries
+@app.cli.command('webhook-sink')
+@click.option('--port', default=8765, show_default=True)
+@click.option('--fail-rate', default=0.0, show_default=True, help='Fraction of batches to answer with a 503.')
+def webhook_sink_command(port, fail_rate):
+    class Sink(http.server.BaseHTTPRequestHandler):
+        seen = set()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if random.random() < fail_rate:
+                self.send_response(503)
+                self.end_headers()
+                click.echo(f"503 for {len(body['events'])} events")
+                return
+            for received in body['events']:
+                repeat = ' (repeat)' if (body['hostel'], received['id']) in Sink.seen else ''
+                Sink.seen.add((body['hostel'], received['id']))
+                click.echo(f"{body['hostel']} #{received['id']} {received['type']} "
+                           f"{json.dumps(received['data'])}{repeat}")
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    click.echo(f'Listening on http://127.0.0.1:{port}/')
+    http.server.ThreadingHTTPServer(('127.0.0.1', port), Sink).serve_forever()
+
+# Lookups that run on nearly every request, built once with bind
+# parameters. Reusing the statement object skips query construction and
+# hits SQLAlchemy's compiled cache on a precomputed key; the SQL string is
+# the same every time, so sqlite3's per-connection statement cache keeps
+# it prepared. Existence checks select a single column instead of loading
+# an instance.
+USER_BY_ID = select(User).where(User.id == bindparam('user_id'))
+USER_BY_USERNAME = select(User).where(User.username == bindparam('username'))
+ROOM_BY_ID = select(Room).where(Room.id == bindparam('room_id'))
+STUDENT_ID_TAKEN = select(Student.id).where(Student.student_id == bindparam('student_id')).limit(1)
+ROOM_NUMBER_TAKEN = select(Room.id).where(Room.room_number == bindparam('room_number')).limit(1)
+
+def fetch_one(statement, **params):
+    return db.session.scalars(statement, params).first()
+
+def row_exists(statement, **params):
+    return db.session.execute(statement, params).first() is not None
+
+# SQLite takes its write lock at a transaction's first write, so two
+# request threads or workers can read the same room, both take its first
+# free bed and one fails on commit. Anything that changes occupancy takes
+# the lock before reading instead; others wait on the busy timeout.
+def lock_for_write():
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite' and not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
 # User loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return fetch_one(USER_BY_ID, user_id=int(user_id))
 
 # Routes
 @app.route('/')
@@ -70,20 +3154,63 @@ def index():
 @app.route('/audit_logs')
 @login_required
 def audit_logs():
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).all()
-    return render_template('audit_logs.html', logs=logs)
+    logs = AuditRow.fetch(AuditRow.query().order_by(AuditLog.timestamp.desc()))
+    facets = audit_facets(date.today() - timedelta(days=29), date.today())
+    return render_template('audit_logs.html', logs=logs, facets=facets)
+
+@app.route('/api/audit_logs/facets')
+@login_required
+def api_audit_facets():
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    result = audit_facets(start, end)
+    result['facets'] = {facet: dict(counts) for facet, counts in result['facets'].items()}
+    result.update(start=start.isoformat() if start else None, end=end.isoformat() if end else None)
+    return jsonify(result)
+
+@app.route('/api/history')
+@login_required
+def api_history():
+    try:
+        at = parse_point_in_time(request.args.get('at', ''))
+    except ValueError:
+        return jsonify({'error': 'at must be YYYY-MM-DD or YYYY-MM-DDTHH:MM'}), 400
+    return jsonify(replay_state(at, room_number=request.args.get('room') or None))
 
 @app.route('/api/audit_logs')
 @login_required
 def api_audit_logs():
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).all()
+    query = AuditRow.query()
+    # room_number and student_id use the generated-column indexes
+    for field in ('room_number', 'student_id', 'action', 'entity_type'):
+        if request.args.get(field):
+            query = query.filter(getattr(AuditLog, field) == request.args[field])
+    for field in AUDIT_INTEGER_FIELDS:
+        value = request.args.get(field, type=int)
+        if value is not None:
+            query = query.filter(func.json_extract(AuditLog.data, f'$.{field}') == value)
+    try:
+        if request.args.get('since'):
+            query = query.filter(AuditLog.timestamp >= datetime.fromisoformat(request.args['since']))
+        if request.args.get('until'):
+            query = query.filter(AuditLog.timestamp <= parse_point_in_time(request.args['until']))
+    except ValueError:
+        return jsonify({'error': 'since and until must be YYYY-MM-DD or YYYY-MM-DDTHH:MM'}), 400
+    query = query.order_by(AuditLog.timestamp.desc())
+    if request.args.get('limit', type=int):
+        query = query.limit(request.args.get('limit', type=int))
+    logs = AuditRow.fetch(query)
     logs_data = [{
         'id': log.id,
         'action': log.action,
         'entity_type': log.entity_type,
         'entity_id': log.entity_id,
         'details': log.details,
-        'user': log.user.username if log.user else 'System',
+        'data': json.loads(log.data) if log.data else None,
+        'user': log.username,
         'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
     } for log in logs]
     return jsonify(logs_data)
@@ -93,13 +3220,12 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        user = User.query.filter_by(username=username).first()
+        user = fetch_one(USER_BY_USERNAME, username=username)
         if user and user.password == password:  # In production, use proper password hashing
             login_user(user)
             flash('Login successful')
             # Log the login action
-            with app.app_context():
-                AuditLog.log('login', 'user', user.id, f'User {username} logged in')
+            AuditLog.log('login', 'user', user.id, f'User {username} logged in')
             return redirect(url_for('dashboard'))
         flash('Invalid credentials')
     return render_template('login.html')
@@ -112,27 +3238,183 @@ def logout():
     logout_user()
     flash('You have been logged out')
     # Log the logout action
-    with app.app_context():
-        AuditLog.log('logout', 'user', user_id, f'User {username} logged out')
+    AuditLog.log('logout', 'user', user_id, f'User {username} logged out')
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    rooms = Room.query.all()
-    students = Student.query.all()
+    version = current_data_version()
     
-    # Calculate bed statistics
-    total_beds = sum(room.capacity for room in rooms)
-    occupied_beds = sum(room.occupied for room in rooms)
-    available_beds = total_beds - occupied_beds
+    # Bed statistics cover the whole hostel, not just the visible page
+    stats = cached_fragment('dashboard_stats', version,
+                            lambda: render_template('_dashboard_stats.html', **hostel_stats()), vary=False)
+    rooms = cached_fragment('dashboard_rooms', version,
+                            lambda: render_template('_dashboard_rooms.html', rooms=paginate_rooms(prefix='room_')))
+    students = cached_fragment('dashboard_students', version,
+                               lambda: render_template('_dashboard_students.html',
+                                                       students=paginate_students(prefix='student_')))
     
     return render_template('dashboard.html', 
+                           stats=stats, 
                            rooms=rooms, 
-                           students=students, 
-                           total_beds=total_beds,
-                           occupied_beds=occupied_beds,
-                           available_beds=available_beds)
+                           students=students)
+
+@app.route('/hostels')
+@login_required
+def hostels():
+    summaries, totals = hostel_summaries()
+    if current_user.hostel:
+        summaries = [hostel for hostel in summaries if hostel['slug'] == current_user.hostel]
+    return render_template('hostels.html', hostels=summaries, totals=totals)
+
+@app.route('/api/hostels')
+@login_required
+def api_hostels():
+    if current_user.hostel:
+        abort(403)
+    summaries, totals = hostel_summaries()
+    return jsonify({'hostels': summaries, 'totals': totals})
+
+@app.route('/api/cache/stats')
+@login_required
+def api_cache_stats():
+    return jsonify(fragment_cache.metrics())
+
+@app.route('/api/students/search')
+@login_required
+def api_search_students():
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify({'query': query, 'results': search_students(query, limit)})
+
+@app.route('/api/occupancy')
+@login_required
+def api_occupancy():
+    try:
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else date.today()
+        if 'start' in request.args:
+            start = date.fromisoformat(request.args['start'])
+        else:
+            start = end - timedelta(days=request.args.get('days', 30, type=int) - 1)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    if start > end:
+        return jsonify({'error': 'start must not be after end'}), 400
+    # Keep a single request bounded to roughly two years of days
+    start = max(start, end - timedelta(days=2 * 366))
+    room_id = request.args.get('room_id', type=int)
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'room_id': room_id,
+        'series': occupancy_series(start, end, room_id),
+    })
+
+@app.route('/api/occupancy/reconcile', methods=['POST'])
+@login_required
+def api_reconcile_occupancy():
+    payload = request.get_json(silent=True) or request.form
+    repair = str(payload.get('repair', '')).lower() in ('1', 'true', 'yes')
+    full = str(payload.get('full', '')).lower() in ('1', 'true', 'yes')
+    result = reconcile_occupancy(repair=repair, full=full)
+    if result['repaired']:
+        AuditLog.log('reconcile', 'room', None,
+                     f"Occupancy counters of {len(result['mismatches'])} rooms repaired")
+    return jsonify(result)
+
+@app.route('/api/backups')
+@login_required
+def api_backups():
+    return jsonify({
+        'interval_hours': app.config['BACKUP_INTERVAL_HOURS'],
+        'keep': app.config['BACKUP_KEEP'],
+        'backups': [{'name': backup['name'], 'size': backup['size'],
+                     'created_at': backup['created_at'].strftime('%Y-%m-%d %H:%M:%S')} for backup in list_backups()],
+    })
+
+@app.route('/api/webhooks')
+@login_required
+def api_webhooks():
+    return jsonify({
+        'event_types': EVENT_TYPES,
+        'outbox': db.session.query(func.count(OutboxEvent.id)).scalar(),
+        'subscribers': webhook_status(),
+    })
+
+@app.route('/api/analytics')
+@login_required
+def api_analytics():
+    months = min(max(request.args.get('months', 12, type=int), 1), 120)
+    return jsonify(compute_occupancy_analytics(db.session.connection(), months=months))
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@login_required
+def api_jobs():
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or request.form
+        kind = payload.get('kind')
+        params = payload.get('params') or {}
+        if isinstance(params, str):
+            try:
+                params = json.loads(params)
+            except ValueError:
+                params = None
+        if kind not in JOB_HANDLERS:
+            return jsonify({'error': f'Unknown job kind; expected one of {sorted(JOB_HANDLERS)}'}), 400
+        if not isinstance(params, dict):
+            return jsonify({'error': 'params must be a JSON object'}), 400
+
+        job = Job(kind=kind, params=json.dumps(params), user_id=current_user.id)
+        db.session.add(job)
+        db.session.commit()
+        job_runner.wakeup.set()
+        AuditLog.log('add', 'job', job.id, f'Job {job.id} ({kind}) submitted')
+        return jsonify(job_data(job)), 202, {'Location': url_for('api_job', job_id=job.id)}
+
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PER_PAGE)
+    return jsonify([job_data(job) for job in query.order_by(Job.id.desc()).limit(limit)])
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id):
+    return jsonify(job_data(db.get_or_404(Job, job_id)))
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def api_cancel_job(job_id):
+    job = db.get_or_404(Job, job_id)
+    # Queued jobs are cancelled outright; running ones stop at their next
+    # progress report
+    cancelled = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == 'queued')
+        .values(status='cancelled', cancel_requested=True, finished_at=datetime.now())).rowcount
+    if not cancelled:
+        cancelled = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'running').values(cancel_requested=True)).rowcount
+    db.session.commit()
+    if not cancelled:
+        return jsonify({'error': f'Job is already {job.status}'}), 409
+    db.session.refresh(job)
+    AuditLog.log('update', 'job', job.id, f'Job {job.id} ({job.kind}) cancelled')
+    return jsonify(job_data(job))
+
+@app.route('/api/jobs/<int:job_id>/result')
+@login_required
+def api_job_result(job_id):
+    job = db.get_or_404(Job, job_id)
+    if job.status != 'done' or job.result_path is None:
+        return jsonify({'error': 'Job has no result yet' if job.status in ('queued', 'running')
+                        else 'Job has no result'}), 409
+    # Results written before they were kept per hostel may belong to another
+    # hostel's job with the same id
+    if os.path.dirname(job.result_path) != job_results_dir() or not os.path.exists(job.result_path):
+        return jsonify({'error': 'Result file is no longer available'}), 410
+    return send_file(job.result_path, as_attachment=True, download_name=job.result_name)
+
 @app.route('/add_student', methods=['GET', 'POST'])
 @login_required
 def add_student():
@@ -140,52 +3422,254 @@ def add_student():
         name = request.form.get('name')
         student_id = request.form.get('student_id')
         room_id = request.form.get('room_id')
+        lock_for_write()
 
         # 🔹 Check if student_id already exists
-        existing_student = Student.query.filter_by(student_id=student_id).first()
-        if existing_student:
+        if row_exists(STUDENT_ID_TAKEN, student_id=student_id):
             flash('This Student ID is already registered!', 'danger')
             return redirect(url_for('add_student'))
 
-        room = Room.query.get(room_id)
-        if room and room.occupied < room.capacity:
+        room = fetch_one(ROOM_BY_ID, room_id=room_id)
+        # A student with a reservation for this room needs a bed for the
+        # booked nights; a walk-in, or a student checking into another room,
+        # has no check-out date, so needs a bed that no other reservation
+        # claims on any night from today on
+        reservation = active_reservation(student_id)
+        if reservation is not None and (room is None or reservation.room_id != room.id):
+            reservation = None
+        stay_end = reservation.end_date if reservation is not None else date.max
+        held = reserved_beds(date.today(), stay_end, exclude_student_id=student_id)
+        if room and room.occupied + held.get(room.id, 0) < room.capacity:
+            if reservation is not None:
+                reservation.status = 'checked_in'
             student = Student(
                 name=name,
                 student_id=student_id,
                 room_id=room_id,
-                check_in_date=datetime.now()
+                check_in_date=datetime.now(),
+                bed_number=room.take_bed()
             )
-            room.occupied += 1
             db.session.add(student)
-            db.session.commit()
+            db.session.flush()
+            emit_student_event('student.checked_in', student, room,
+                               reservation_id=reservation.id if reservation is not None else None)
+            record_occupancy(room, occupied_delta=1)
+            version = bump_data_version()
 
             # Log the student addition
             AuditLog.log(
                 'add',
                 'student',
                 student.id,
-                f'Student {name} (ID: {student_id}) added to room {room.room_number}'
+                f'Student {name} (ID: {student_id}) added to room {room.room_number}',
+                data=student_audit_data(student, room),
+                commit=False
             )
+            db.session.commit()
+            free_bed_index.update(room, version)
 
             flash('Student added successfully', 'success')
             return redirect(url_for('dashboard'))
 
-        flash('Room is full or invalid', 'danger')
+        if room and room.occupied < room.capacity:
+            flash('The remaining beds in this room are reserved', 'danger')
+        else:
+            flash('Room is full or invalid', 'danger')
 
     # Only show rooms with free space
-    rooms = Room.query.filter(Room.capacity > Room.occupied).all()
+    rooms = free_bed_index.search(min_free=1)
     return render_template('add_student.html', rooms=rooms)
 
+@app.route('/api/rooms/available')
+@login_required
+def api_available_rooms():
+    beds = max(request.args.get('beds', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    rooms = free_bed_index.search(
+        min_free=beds,
+        floor=request.args.get('floor', type=int),
+        near=request.args.get('near', type=int),
+        limit=limit)
+    return jsonify([room._asdict() for room in rooms])
+
+
+@app.route('/api/rooms/<int:room_id>/beds')
+@login_required
+def api_room_beds(room_id):
+    room = db.get_or_404(Room, room_id)
+    students = {student.bed_number: student for student in room.students if student.bed_number}
+    result = {
+        'room_number': room.room_number,
+        'capacity': room.capacity,
+        'occupied': room.occupied,
+        'first_free_bed': room.first_free_bed(),
+        'beds': [{'bed': bed, 'taken': taken,
+                  'student': {'name': students[bed].name, 'student_id': students[bed].student_id}
+                  if bed in students else None}
+                 for bed, taken in enumerate(room.bed_map(), 1)],
+    }
+    # ?block=1-4 counts the free beds in a range of beds
+    block = re.match(r'(\d+)-(\d+)$', request.args.get('block', ''))
+    if block:
+        first, last = int(block.group(1)), min(int(block.group(2)), room.capacity)
+        if not 1 <= first <= last:
+            return jsonify({'error': 'block must be a range of bed numbers like 1-4'}), 400
+        result['block'] = {'first': first, 'last': last, 'free': room.free_beds_in(first, last)}
+    return jsonify(result)
+
+@app.route('/api/residents/history')
+@login_required
+def api_resident_history():
+    room_id = None
+    if request.args.get('room'):
+        room_id = db.session.query(Room.id).filter_by(room_number=request.args['room']).scalar()
+        if room_id is None:
+            return jsonify({'error': 'unknown room'}), 404
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = parse_point_in_time(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD or YYYY-MM-DDTHH:MM'}), 400
+    residents = past_residents(room_id, start, end, limit=min(request.args.get('limit', 500, type=int), 5000))
+    return jsonify([{
+        'name': resident.name,
+        'student_id': resident.student_id,
+        'room_number': resident.room_number,
+        'bed_number': resident.bed_number,
+        'check_in_date': resident.check_in_date.strftime('%Y-%m-%d %H:%M:%S') if resident.check_in_date else None,
+        'check_out_date': resident.check_out_date.strftime('%Y-%m-%d %H:%M:%S'),
+    } for resident in residents])
+
+@app.route('/api/availability')
+@login_required
+def api_availability():
+    try:
+        start = date.fromisoformat(request.args.get('start', ''))
+        end = date.fromisoformat(request.args.get('end', ''))
+    except ValueError:
+        return jsonify({'error': 'start and end must be dates in YYYY-MM-DD format'}), 400
+    if start >= end:
+        return jsonify({'error': 'end must be after start'}), 400
+    beds = max(request.args.get('beds', 1, type=int), 1)
+    rooms = available_rooms(start, end, beds)
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'beds': beds,
+        'rooms': [room._asdict() for room in rooms],
+    })
+
+@app.route('/reservations', methods=['GET', 'POST'])
+@login_required
+def reservations():
+    if request.method == 'POST':
+        name = request.form.get('name')
+        student_id = request.form.get('student_id')
+        room_id = request.form.get('room_id', type=int)
+        try:
+            start = date.fromisoformat(request.form.get('start_date', ''))
+            end = date.fromisoformat(request.form.get('end_date', ''))
+        except ValueError:
+            flash('Please enter valid dates')
+            return redirect(url_for('reservations'))
+
+        # Two bookings for a room's last free bed must not both pass the check
+        lock_for_write()
+        if start >= end or start < date.today():
+            flash('Check-out must be after check-in, and check-in cannot be in the past')
+        elif room_id not in {room.id for room in available_rooms(start, end)}:
+            flash('That room has no free bed for every night of the stay')
+        else:
+            room = fetch_one(ROOM_BY_ID, room_id=room_id)
+            reservation = Reservation(name=name, student_id=student_id, room_id=room_id,
+                                      start_date=start, end_date=end)
+            db.session.add(reservation)
+            db.session.commit()
+
+            AuditLog.log('add', 'reservation', reservation.id,
+                         f'Reservation for {name} (ID: {student_id}) in room {room.room_number} '
+                         f'from {start} to {end}')
+
+            flash('Reservation created successfully')
+            return redirect(url_for('reservations'))
+
+    upcoming = Reservation.query.filter(Reservation.status == 'reserved',
+                                        Reservation.end_date > date.today()) \
+        .order_by(Reservation.start_date, Reservation.id).all()
+    rooms = Room.query.order_by(Room.room_number).all()
+    return render_template('reservations.html', reservations=upcoming, rooms=rooms, today=date.today())
+
+@app.route('/reservations/<int:reservation_id>/cancel', methods=['POST'])
+@login_required
+def cancel_reservation(reservation_id):
+    reservation = Reservation.query.get_or_404(reservation_id)
+    if reservation.status == 'reserved':
+        reservation.status = 'cancelled'
+        db.session.commit()
+
+        AuditLog.log('cancel', 'reservation', reservation.id,
+                     f'Reservation for {reservation.name} (ID: {reservation.student_id}) '
+                     f'in room {reservation.room.room_number} cancelled')
+
+        flash('Reservation cancelled')
+    return redirect(url_for('reservations'))
+
+@app.route('/waitlist', methods=['GET', 'POST'])
+@login_required
+def waitlist():
+    if request.method == 'POST':
+        name = request.form.get('name')
+        student_id = request.form.get('student_id')
+        room_id = request.form.get('room_id', type=int)
+
+        if row_exists(STUDENT_ID_TAKEN, student_id=student_id):
+            flash('This Student ID is already registered!')
+        elif WaitlistEntry.query.filter_by(student_id=student_id, status='waiting').first():
+            flash('This Student ID is already on the waitlist')
+        else:
+            entry = WaitlistEntry(name=name, student_id=student_id, room_id=room_id,
+                                  priority=request.form.get('priority', 0, type=int))
+            db.session.add(entry)
+            db.session.commit()
+
+            AuditLog.log('add', 'waitlist', entry.id,
+                         f'Student {name} (ID: {student_id}) added to the waitlist')
+
+            flash('Student added to the waitlist')
+        return redirect(url_for('waitlist'))
+
+    waiting = WaitlistEntry.query.filter_by(status='waiting') \
+        .order_by(WaitlistEntry.priority.desc(), WaitlistEntry.id).limit(200).all()
+    total_waiting = WaitlistEntry.query.filter_by(status='waiting').count()
+    rooms = Room.query.order_by(Room.room_number).all()
+    return render_template('waitlist.html', entries=waiting, total_waiting=total_waiting, rooms=rooms)
+
+@app.route('/waitlist/<int:entry_id>/cancel', methods=['POST'])
+@login_required
+def cancel_waitlist_entry(entry_id):
+    entry = WaitlistEntry.query.get_or_404(entry_id)
+    if entry.status == 'waiting':
+        entry.status = 'cancelled'
+        db.session.commit()
+
+        AuditLog.log('remove', 'waitlist', entry.id,
+                     f'Student {entry.name} (ID: {entry.student_id}) removed from the waitlist')
+
+        flash('Waitlist entry cancelled')
+    return redirect(url_for('waitlist'))
 
 @app.route('/add_room', methods=['GET', 'POST'])
 @login_required
 def add_room():
     if request.method == 'POST':
+        lock_for_write()
         room_number = request.form.get('room_number')
         capacity = request.form.get('capacity')
         
-        if Room.query.filter_by(room_number=room_number).first():
+        if row_exists(ROOM_NUMBER_TAKEN, room_number=room_number):
             flash('Room number already exists')
+        elif int(capacity) > MAX_BEDS:
+            flash(f'A room can have at most {MAX_BEDS} beds')
         else:
             room = Room(
                 room_number=room_number,
@@ -193,11 +3677,20 @@ def add_room():
                 occupied=0
             )
             db.session.add(room)
-            db.session.commit()
+            db.session.flush()
+            emit_event('room.added', id=room.id, room_number=room.room_number, capacity=room.capacity)
+            assigned = assign_waitlist(room)
+            record_occupancy(room, occupied_delta=len(assigned), capacity_delta=room.capacity)
+            version = bump_data_version()
             
             # Log the room addition
             AuditLog.log('add', 'room', room.id, 
-                        f'Room {room_number} with capacity {capacity} added')
+                        f'Room {room_number} with capacity {capacity} added',
+                        data={'room_id': room.id, 'room_number': room.room_number, 'capacity': room.capacity},
+                        commit=False)
+            log_waitlist_assignments(assigned, room)
+            db.session.commit()
+            free_bed_index.update(room, version)
             
             flash('Room added successfully')
             return redirect(url_for('beds'))
@@ -206,22 +3699,23 @@ def add_room():
 @app.route('/beds')
 @login_required
 def beds():
-    rooms = Room.query.all()
+    version = current_data_version()
     
-    # Calculate bed statistics
-    total_beds = sum(room.capacity for room in rooms)
-    occupied_beds = sum(room.occupied for room in rooms)
-    available_beds = total_beds - occupied_beds
+    # Bed statistics cover the whole hostel, not just the visible page
+    stats = cached_fragment('beds_stats', version,
+                            lambda: render_template('_beds_stats.html', **hostel_stats()), vary=False)
+    rooms = cached_fragment('beds_rooms', version,
+                            lambda: render_template('_beds_rooms.html', rooms=paginate_rooms()))
     
     return render_template('beds.html', 
-                           rooms=rooms, 
-                           total_beds=total_beds,
-                           occupied_beds=occupied_beds,
-                           available_beds=available_beds)
+                           stats=stats, 
+                           rooms=rooms)
 
 @app.route('/edit_room/<int:room_id>', methods=['GET', 'POST'])
 @login_required
 def edit_room(room_id):
+    if request.method == 'POST':
+        lock_for_write()
     room = Room.query.get_or_404(room_id)
     
     if request.method == 'POST':
@@ -232,13 +3726,28 @@ def edit_room(room_id):
         if new_capacity < room.occupied:
             flash('New capacity cannot be less than current occupancy')
             return redirect(url_for('edit_room', room_id=room_id))
+        if new_capacity > MAX_BEDS:
+            flash(f'A room can have at most {MAX_BEDS} beds')
+            return redirect(url_for('edit_room', room_id=room_id))
         
         room.capacity = new_capacity
-        db.session.commit()
+        moved = compact_beds(room)
+        emit_event('room.updated', id=room.id, room_number=room.room_number,
+                   old_capacity=old_capacity, capacity=new_capacity)
+        assigned = assign_waitlist(room) if new_capacity > old_capacity else []
+        record_occupancy(room, occupied_delta=len(assigned), capacity_delta=new_capacity - old_capacity)
+        version = bump_data_version()
         
         # Log the room update
         AuditLog.log('update', 'room', room.id, 
-                    f'Room {room.room_number} capacity changed from {old_capacity} to {new_capacity}')
+                    f'Room {room.room_number} capacity changed from {old_capacity} to {new_capacity}',
+                    data={'room_id': room.id, 'room_number': room.room_number, 'old_capacity': old_capacity,
+                          'new_capacity': new_capacity,
+                          'beds': {student.student_id: student.bed_number for student in moved}},
+                    commit=False)
+        log_waitlist_assignments(assigned, room)
+        db.session.commit()
+        free_bed_index.update(room, version)
         
         flash('Room capacity updated successfully')
         return redirect(url_for('beds'))
@@ -248,28 +3757,101 @@ def edit_room(room_id):
 @app.route('/remove_student/<int:student_id>', methods=['POST'])
 @login_required
 def remove_student(student_id):
+    lock_for_write()
     student = Student.query.get_or_404(student_id)
     student_name = student.name
     student_id_num = student.student_id
     room = Room.query.get(student.room_id)
     room_number = room.room_number if room else 'Unknown'
     
+    assigned = []
+    # release_bed never takes a drifted counter below zero; mark the room
+    # so the next incremental reconciliation looks at it
+    freed = 0
     if room:
-        room.occupied -= 1
+        freed = room.release_bed(student.bed_number)
+        room.updated_at = datetime.now()
+    emit_student_event('student.checked_out', student, room)
+    archive_student(student, room, datetime.now())
     db.session.delete(student)
-    db.session.commit()
+    if room:
+        db.session.flush()
+        assigned = assign_waitlist(room)
+        record_occupancy(room, occupied_delta=len(assigned) - freed)
+    version = bump_data_version()
     
     # Log the student removal
     AuditLog.log('remove', 'student', student_id, 
-                f'Student {student_name} (ID: {student_id_num}) removed from room {room_number}')
+                f'Student {student_name} (ID: {student_id_num}) removed from room {room_number}',
+                data={'id': student_id, 'student_id': student_id_num, 'name': student_name,
+                      'room_id': room.id if room else None, 'room_number': room_number},
+                commit=False)
+    if room:
+        log_waitlist_assignments(assigned, room)
+    db.session.commit()
+    if room:
+        free_bed_index.update(room, version)
     
     flash('Student removed successfully')
     return redirect(url_for('dashboard'))
 
+# Bring an existing database up to the current models: create missing
+# tables, add missing columns and indexes, and fill derived columns
+def upgrade_schema():
+    # Upgrades the current hostel's database; the directory tables only
+    # live in the main one
+    engine = hostel_engine()
+    tables = [table for table in db.metadata.sorted_tables
+              if engine is db.engine or table.name not in DIRECTORY_TABLES]
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    # SQLite can add generated columns as long as they are virtual
+                    if column.computed is not None:
+                        column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}'))
+                        continue
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    if column.server_default is not None:
+                        column_type += f' DEFAULT {column.server_default.arg}'
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    db.metadata.create_all(engine, tables=tables)
+    # Expression indexes cannot be reflected, so compare by name
+    with engine.begin() as conn:
+        indexes = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        for table in tables:
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+        create_student_search(conn)
+
+    for room in Room.query.filter(Room.floor.is_(None)).all():
+        room.floor = room_floor(room.room_number)
+    # Databases upgraded before bed_mask had a server default
+    db.session.execute(update(Room).where(Room.bed_mask.is_(None)).values(bed_mask=0))
+    db.session.commit()
+
+    if AuditRollup.query.first() is None and AuditLog.query.first() is not None:
+        rebuild_audit_rollups()
+
+    migrate_audit_data()
+
+    if ResidentHistory.query.first() is None and \
+            AuditLog.query.filter_by(action='remove', entity_type='student').first() is not None:
+        backfill_resident_history()
+
+    assign_missing_beds()
+
 # Initialize the database and add sample data
 def initialize_db():
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
         
         # Check if admin user exists
         admin_user = User.query.filter_by(username='admin').first()
@@ -290,23 +3872,203 @@ def initialize_db():
             db.session.commit()
             print('Sample rooms added successfully')
 
+        for slug in hostel_slugs()[1:]:
+            g.hostel = slug
+            upgrade_schema()
+            db.session.remove()
+
+@app.cli.command('init-db')
+def init_db_command():
+    initialize_db()
+
+@app.cli.command('add-hostel')
+@click.argument('slug')
+@click.argument('name')
+@click.option('--database', help='Database file in the instance folder (default: hostels/<slug>.db).')
+def add_hostel_command(slug, name, database):
+    if not re.match(r'[a-z0-9-]+$', slug) or slug == app.config['DEFAULT_HOSTEL']:
+        raise click.BadParameter('use lowercase letters, digits and dashes, and not the default hostel name',
+                                 param_hint='SLUG')
+    if Hostel.query.filter_by(slug=slug).first() is not None:
+        raise click.BadParameter(f'hostel {slug} already exists', param_hint='SLUG')
+    database = database or os.path.join('hostels', f'{slug}.db')
+    os.makedirs(os.path.dirname(os.path.join(app.instance_path, database)), exist_ok=True)
+    db.session.add(Hostel(slug=slug, name=name, database=database))
+    db.session.commit()
+    hostel_directory.refresh()
+    g.hostel = slug
+    upgrade_schema()
+    click.echo(f'Added hostel {name} at /h/{slug}/ with database {database}')
+
 # Create HTML templates directory if it doesn't exist
 def create_templates():
     if not os.path.exists('templates'):
         os.makedirs('templates')
         
-    # Beds Management template
-    with open('templates/beds.html', 'w') as f:
-        f.write('''{% extends "base.html" %}
-{% block content %}
-<div class="row mb-4">
-    <div class="col-md-12">
-        <h2 class="text-center mb-4 animate__animated animate__fadeIn"><i class="fas fa-bed me-2"></i> Beds Management</h2>
-    </div>
+    # Shared macros for paged tables
+    with open('templates/_macros.html', 'w') as f:
+        f.write('''{% macro sort_link(label, key, prefix='', default_sort='') %}
+{% set current = request.args.get(prefix ~ 'sort', default_sort) %}
+{% set order = request.args.get(prefix ~ 'order', 'asc') %}
+<a class="text-white text-decoration-none" href="{{ url_with(**{prefix ~ 'sort': key, prefix ~ 'order': 'desc' if current == key and order == 'asc' else 'asc', prefix ~ 'page': 1}) }}">
+    {{ label }}{% if current == key %} <i class="fas fa-sort-{{ 'up' if order == 'asc' else 'down' }}"></i>{% endif %}
+</a>
+{% endmacro %}
+
+{% macro pagination(page, prefix='') %}
+<div class="d-flex justify-content-between align-items-center mt-3">
+    <small class="text-muted">{{ page.total }} total</small>
+    {% if page.pages > 1 %}
+    <ul class="pagination pagination-sm mb-0">
+        <li class="page-item {{ 'disabled' if not page.has_prev }}">
+            <a class="page-link" href="{{ url_with(**{prefix ~ 'page': page.prev_num or 1}) }}">&laquo;</a>
+        </li>
+        {% for number in page.iter_pages() %}
+            {% if number %}
+                <li class="page-item {{ 'active' if number == page.page }}">
+                    <a class="page-link" href="{{ url_with(**{prefix ~ 'page': number}) }}">{{ number }}</a>
+                </li>
+            {% else %}
+                <li class="page-item disabled"><span class="page-link">&hellip;</span></li>
+            {% endif %}
+        {% endfor %}
+        <li class="page-item {{ 'disabled' if not page.has_next }}">
+            <a class="page-link" href="{{ url_with(**{prefix ~ 'page': page.next_num or page.pages}) }}">&raquo;</a>
+        </li>
+    </ul>
+    {% endif %}
 </div>
+{% endmacro %}
 
-<!-- Stats Cards -->
-<div class="row mb-4">
+{% macro room_filters() %}
+<form method="GET" class="row g-2 mb-3">
+    <div class="col-auto">
+        <select class="form-select" name="status">
+            <option value="">All statuses</option>
+            {% for value, label in [('full', 'Full'), ('partial', 'Partial'), ('empty', 'Empty')] %}
+                <option value="{{ value }}" {{ 'selected' if request.args.get('status') == value }}>{{ label }}</option>
+            {% endfor %}
+        </select>
+    </div>
+    <div class="col-auto">
+        <input type="number" class="form-control" name="floor" min="0" placeholder="Floor" value="{{ request.args.get('floor', '') }}">
+    </div>
+    <div class="col-auto">
+        <button type="submit" class="btn btn-primary"><i class="fas fa-filter me-1"></i> Filter</button>
+    </div>
+</form>
+{% endmacro %}''')
+
+    # Cached fragments of the dashboard and beds pages
+    with open('templates/_dashboard_stats.html', 'w') as f:
+        f.write('''<div class="row mb-4">
+    <div class="col-md-3">
+        <div class="card stat-card animate__animated animate__fadeInUp">
+            <div class="card-body">
+                <i class="fas fa-door-open icon-stat"></i>
+                <div class="stat-value">{{ total_rooms }}</div>
+                <div class="stat-label">Total Rooms</div>
+            </div>
+        </div>
+    </div>
+    <div class="col-md-3">
+        <div class="card stat-card animate__animated animate__fadeInUp" style="animation-delay: 0.1s;">
+            <div class="card-body">
+                <i class="fas fa-users icon-stat"></i>
+                <div class="stat-value">{{ total_students }}</div>
+                <div class="stat-label">Total Students</div>
+            </div>
+        </div>
+    </div>
+    <div class="col-md-3">
+        <div class="card stat-card animate__animated animate__fadeInUp" style="animation-delay: 0.2s;">
+            <div class="card-body">
+                <i class="fas fa-bed icon-stat"></i>
+                <div class="stat-value">{{ occupied_beds }}</div>
+                <div class="stat-label">Beds Occupied</div>
+            </div>
+        </div>
+    </div>
+    <div class="col-md-3">
+        <div class="card stat-card animate__animated animate__fadeInUp" style="animation-delay: 0.3s;">
+            <div class="card-body">
+                <i class="fas fa-bed icon-stat"></i>
+                <div class="stat-value">{{ available_beds }}</div>
+                <div class="stat-label">Beds Available</div>
+            </div>
+        </div>
+    </div>
+</div>''')
+    with open('templates/_dashboard_rooms.html', 'w') as f:
+        f.write('''{% from "_macros.html" import sort_link, pagination with context %}
+<div class="table-responsive">
+    <table class="table table-striped">
+        <thead>
+            <tr>
+                <th>{{ sort_link('Room Number', 'room_number', 'room_', 'room_number') }}</th>
+                <th>Capacity</th>
+                <th>Occupied</th>
+                <th>{{ sort_link('Available', 'free_beds', 'room_', 'room_number') }}</th>
+                <th>Status</th>
+            </tr>
+        </thead>
+        <tbody>
+            {% for room in rooms.items %}
+            <tr>
+                <td><i class="fas fa-door-closed me-1"></i> {{ room.room_number }}</td>
+                <td><i class="fas fa-bed me-1"></i> {{ room.capacity }}</td>
+                <td><i class="fas fa-user me-1"></i> {{ room.occupied }}</td>
+                <td><i class="fas fa-check-circle me-1"></i> {{ room.capacity - room.occupied }}</td>
+                <td>
+                    {% if room.capacity == room.occupied %}
+                        <span class="badge bg-danger">Full</span>
+                    {% elif room.occupied == 0 %}
+                        <span class="badge bg-success">Empty</span>
+                    {% else %}
+                        <span class="badge bg-warning">Partial</span>
+                    {% endif %}
+                </td>
+            </tr>
+            {% endfor %}
+        </tbody>
+    </table>
+</div>
+{{ pagination(rooms, 'room_') }}''')
+    with open('templates/_dashboard_students.html', 'w') as f:
+        f.write('''{% from "_macros.html" import sort_link, pagination with context %}
+<div class="table-responsive">
+    <table class="table table-striped">
+        <thead>
+            <tr>
+                <th>{{ sort_link('Name', 'name', 'student_', 'check_in_date') }}</th>
+                <th>Student ID</th>
+                <th>{{ sort_link('Room', 'room_number', 'student_', 'check_in_date') }}</th>
+                <th>{{ sort_link('Check-in Date', 'check_in_date', 'student_', 'check_in_date') }}</th>
+                <th>Action</th>
+            </tr>
+        </thead>
+        <tbody>
+            {% for student in students.items %}
+            <tr>
+                <td><i class="fas fa-user-graduate me-1"></i> {{ student.name }}</td>
+                <td><i class="fas fa-id-card me-1"></i> {{ student.student_id }}</td>
+                <td><i class="fas fa-door-open me-1"></i> {{ student.room_number }}{% if student.bed_number %} <small class="text-muted">bed {{ student.bed_number }}</small>{% endif %}</td>
+                <td><i class="fas fa-calendar-alt me-1"></i> {{ student.check_in_date.strftime('%Y-%m-%d') }}</td>
+                <td>
+                    <form method="POST" action="{{ url_for('remove_student', student_id=student.id) }}" onsubmit="return confirm('Are you sure you want to remove this student?');">
+                        <button type="submit" class="btn btn-sm btn-danger">
+                            <i class="fas fa-user-minus"></i>
+                        </button>
+                    </form>
+                </td>
+            </tr>
+            {% endfor %}
+        </tbody>
+    </table>
+</div>
+{{ pagination(students, 'student_') }}''')
+    with open('templates/_beds_stats.html', 'w') as f:
+        f.write('''<div class="row mb-4">
     <div class="col-md-4">
         <div class="card stat-card animate__animated animate__fadeInUp">
             <div class="card-body">
@@ -334,8 +4096,69 @@ def create_templates():
             </div>
         </div>
     </div>
+</div>''')
+    with open('templates/_beds_rooms.html', 'w') as f:
+        f.write('''{% from "_macros.html" import sort_link, pagination with context %}
+<div class="table-responsive">
+    <table class="table table-striped">
+        <thead>
+            <tr>
+                <th>{{ sort_link('Room Number', 'room_number', default_sort='room_number') }}</th>
+                <th>Total Beds</th>
+                <th>Occupied Beds</th>
+                <th>{{ sort_link('Available Beds', 'free_beds', default_sort='room_number') }}</th>
+                <th>Bed Map</th>
+                <th>Status</th>
+                <th>Actions</th>
+            </tr>
+        </thead>
+        <tbody>
+            {% for room in rooms.items %}
+            <tr>
+                <td><i class="fas fa-door-closed me-1"></i> {{ room.room_number }}</td>
+                <td><i class="fas fa-bed me-1"></i> {{ room.capacity }}</td>
+                <td><i class="fas fa-user me-1"></i> {{ room.occupied }}</td>
+                <td><i class="fas fa-check-circle me-1"></i> {{ room.capacity - room.occupied }}</td>
+                <td class="text-nowrap">
+                    {% for taken in room.bed_map() %}
+                        <i class="fas fa-bed {{ 'text-danger' if taken else 'text-success' }}" title="Bed {{ loop.index }}: {{ 'taken' if taken else 'free' }}"></i>
+                    {% endfor %}
+                </td>
+                <td>
+                    {% if room.capacity == room.occupied %}
+                        <span class="badge bg-danger">Full</span>
+                    {% elif room.occupied == 0 %}
+                        <span class="badge bg-success">Empty</span>
+                    {% else %}
+                        <span class="badge bg-warning">Partial</span>
+                    {% endif %}
+                </td>
+                <td>
+                    <a href="{{ url_for('edit_room', room_id=room.id) }}" class="btn btn-sm btn-primary">
+                        <i class="fas fa-edit"></i> Edit Capacity
+                    </a>
+                </td>
+            </tr>
+            {% endfor %}
+        </tbody>
+    </table>
+</div>
+{{ pagination(rooms) }}''')
+
+    # Beds Management template
+    with open('templates/beds.html', 'w') as f:
+        f.write('''{% extends "base.html" %}
+{% from "_macros.html" import room_filters with context %}
+{% block content %}
+<div class="row mb-4">
+    <div class="col-md-12">
+        <h2 class="text-center mb-4 animate__animated animate__fadeIn"><i class="fas fa-bed me-2"></i> Beds Management</h2>
+    </div>
 </div>
 
+<!-- Stats Cards -->
+{{ stats }}
+
 <div class="card mb-4 animate__animated animate__fadeInUp">
     <div class="card-header d-flex justify-content-between align-items-center">
         <h3><i class="fas fa-door-open me-2"></i>Rooms and Beds</h3>
@@ -344,44 +4167,8 @@ def create_templates():
         </a>
     </div>
     <div class="card-body">
-        <div class="table-responsive">
-            <table class="table table-striped">
-                <thead>
-                    <tr>
-                        <th>Room Number</th>
-                        <th>Total Beds</th>
-                        <th>Occupied Beds</th>
-                        <th>Available Beds</th>
-                        <th>Status</th>
-                        <th>Actions</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {% for room in rooms %}
-                    <tr>
-                        <td><i class="fas fa-door-closed me-1"></i> {{ room.room_number }}</td>
-                        <td><i class="fas fa-bed me-1"></i> {{ room.capacity }}</td>
-                        <td><i class="fas fa-user me-1"></i> {{ room.occupied }}</td>
-                        <td><i class="fas fa-check-circle me-1"></i> {{ room.capacity - room.occupied }}</td>
-                        <td>
-                            {% if room.capacity == room.occupied %}
-                                <span class="badge bg-danger">Full</span>
-                            {% elif room.occupied == 0 %}
-                                <span class="badge bg-success">Empty</span>
-                            {% else %}
-                                <span class="badge bg-warning">Partial</span>
-                            {% endif %}
-                        </td>
-                        <td>
-                            <a href="{{ url_for('edit_room', room_id=room.id) }}" class="btn btn-sm btn-primary">
-                                <i class="fas fa-edit"></i> Edit Capacity
-                            </a>
-                        </td>
-                    </tr>
-                    {% endfor %}
-                </tbody>
-            </table>
-        </div>
+        {{ room_filters() }}
+        {{ rooms }}
     </div>
 </div>
 {% endblock %}''')
@@ -440,6 +4227,28 @@ def create_templates():
     </div>
 </div>
 
+<div class="row mb-4">
+    {% for facet, title, icon in [('action', 'By Action', 'fa-tasks'), ('entity_type', 'By Entity Type', 'fa-tag'), ('user', 'By User', 'fa-user')] %}
+    <div class="col-md-4">
+        <div class="card h-100 animate__animated animate__fadeInUp">
+            <div class="card-header">
+                <h5 class="mb-0"><i class="fas {{ icon }} me-2"></i>{{ title }} <small>(last 30 days)</small></h5>
+            </div>
+            <ul class="list-group list-group-flush">
+                {% for key, count in facets.facets[facet] %}
+                    <li class="list-group-item d-flex justify-content-between">
+                        <span>{{ key|capitalize if facet == 'entity_type' else key }}</span>
+                        <span class="badge bg-primary rounded-pill">{{ count }}</span>
+                    </li>
+                {% else %}
+                    <li class="list-group-item text-muted">No activity</li>
+                {% endfor %}
+            </ul>
+        </div>
+    </div>
+    {% endfor %}
+</div>
+
 <div class="card animate__animated animate__fadeInUp">
     <div class="card-header">
         <h3><i class="fas fa-list me-2"></i>System Activity Logs</h3>
@@ -476,7 +4285,7 @@ def create_templates():
                         </td>
                         <td>{{ log.entity_type|capitalize }}</td>
                         <td>{{ log.details }}</td>
-                        <td>{{ log.user.username if log.user else 'System' }}</td>
+                        <td>{{ log.username }}</td>
                         <td>{{ log.timestamp.strftime('%Y-%m-%d %H:%M:%S') }}</td>
                     </tr>
                     {% endfor %}
@@ -743,6 +4552,7 @@ def create_templates():
         <div class="container">
             <a class="navbar-brand animate__animated animate__fadeIn" href="{{ url_for('index') }}">
                 <i class="fas fa-hotel me-2"></i> KnK HOSTEL Management
+                {% if hostel_slug != config.DEFAULT_HOSTEL %}<small class="ms-2">{{ hostel_name }}</small>{% endif %}
             </a>
             <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navbarNav">
                 <span class="navbar-toggler-icon"></span>
@@ -770,11 +4580,28 @@ def create_templates():
                                 <i class="fas fa-door-open me-1"></i> Add Room
                             </a>
                         </li>
+                        <li class="nav-item">
+                            <a class="nav-link" href="{{ url_for('reservations') }}">
+                                <i class="fas fa-calendar-check me-1"></i> Reservations
+                            </a>
+                        </li>
+                        <li class="nav-item">
+                            <a class="nav-link" href="{{ url_for('waitlist') }}">
+                                <i class="fas fa-hourglass-half me-1"></i> Waitlist
+                            </a>
+                        </li>
                         <li class="nav-item">
                             <a class="nav-link" href="{{ url_for('audit_logs') }}">
                                 <i class="fas fa-history me-1"></i> Audit Logs
                             </a>
                         </li>
+                        {% if not current_user.hostel %}
+                        <li class="nav-item">
+                            <a class="nav-link" href="{{ url_for('hostels') }}">
+                                <i class="fas fa-building me-1"></i> Hostels
+                            </a>
+                        </li>
+                        {% endif %}
                         <li class="nav-item">
                             <a class="nav-link" href="{{ url_for('logout') }}">
                                 <i class="fas fa-sign-out-alt me-1"></i> Logout
@@ -1022,42 +4849,265 @@ def create_templates():
                             <li class="list-group-item"><i class="fas fa-check-circle text-success me-2"></i> Comprehensive student management</li>
                         </ul>
                     </div>
-                    <div class="col-md-6">
-                        <ul class="list-group list-group-flush">
-                            <li class="list-group-item"><i class="fas fa-check-circle text-success me-2"></i> Detailed audit logging for all activities</li>
-                            <li class="list-group-item"><i class="fas fa-check-circle text-success me-2"></i> User-friendly interface for administrators</li>
-                            <li class="list-group-item"><i class="fas fa-check-circle text-success me-2"></i> Secure authentication system</li>
-                        </ul>
+                    <div class="col-md-6">
+                        <ul class="list-group list-group-flush">
+                            <li class="list-group-item"><i class="fas fa-check-circle text-success me-2"></i> Detailed audit logging for all activities</li>
+                            <li class="list-group-item"><i class="fas fa-check-circle text-success me-2"></i> User-friendly interface for administrators</li>
+                            <li class="list-group-item"><i class="fas fa-check-circle text-success me-2"></i> Secure authentication system</li>
+                        </ul>
+                    </div>
+                </div>
+            </div>
+        </div>
+    </div>
+</div>
+{% endblock %}''')
+    
+    # Login template
+    with open('templates/login.html', 'w') as f:
+        f.write('''{% extends "base.html" %}
+{% block content %}
+<div class="row justify-content-center">
+    <div class="col-md-6">
+        <div class="card">
+            <div class="card-header">
+                <h3 class="text-center">Login</h3>
+            </div>
+            <div class="card-body">
+                <form method="POST">
+                    <div class="mb-3">
+                        <label for="username" class="form-label">Username</label>
+                        <input type="text" class="form-control" id="username" name="username" required>
+                    </div>
+                    <div class="mb-3">
+                        <label for="password" class="form-label">Password</label>
+                        <input type="password" class="form-control" id="password" name="password" required>
+                    </div>
+                    <div class="text-center">
+                        <button type="submit" class="btn btn-primary">Login</button>
+                    </div>
+                </form>
+            </div>
+        </div>
+    </div>
+</div>
+{% endblock %}''')
+    
+    # Dashboard template
+    with open('templates/dashboard.html', 'w') as f:
+        f.write('''{% extends "base.html" %}
+{% from "_macros.html" import room_filters with context %}
+{% block content %}
+<div class="row mb-4">
+    <div class="col-md-12">
+        <h2 class="text-center mb-4 animate__animated animate__fadeIn"><i class="fas fa-tachometer-alt me-2"></i> Hostel Dashboard</h2>
+    </div>
+</div>
+
+<!-- Stats Cards -->
+{{ stats }}
+
+<div class="card mb-4 animate__animated animate__fadeInUp">
+    <div class="card-header d-flex justify-content-between align-items-center">
+        <h3><i class="fas fa-chart-line me-2"></i>Occupancy Trend</h3>
+        <select class="form-select w-auto" id="occupancyRange">
+            <option value="30">Last 30 days</option>
+            <option value="90" selected>Last 90 days</option>
+            <option value="365">Last year</option>
+            <option value="730">Last 2 years</option>
+        </select>
+    </div>
+    <div class="card-body">
+        <canvas id="occupancyChart" height="90"></canvas>
+    </div>
+</div>
+
+<div class="row">
+    <div class="col-md-6">
+        <div class="card mb-4 animate__animated animate__fadeInLeft">
+            <div class="card-header">
+                <h3><i class="fas fa-door-open me-2"></i>Rooms Status</h3>
+            </div>
+            <div class="card-body">
+                {{ room_filters() }}
+                {{ rooms }}
+                <div class="mt-3">
+                    <a href="{{ url_for('add_room') }}" class="btn btn-primary">
+                        <i class="fas fa-plus-circle me-1"></i> Add New Room
+                    </a>
+                </div>
+            </div>
+        </div>
+    </div>
+    <div class="col-md-6">
+        <div class="card mb-4 animate__animated animate__fadeInRight">
+            <div class="card-header">
+                <h3><i class="fas fa-users me-2"></i>Students List</h3>
+            </div>
+            <div class="card-body">
+                <div class="mb-3 position-relative">
+                    <input type="search" class="form-control" id="studentSearch" placeholder="Search by name or student ID" autocomplete="off">
+                    <div class="list-group position-absolute w-100 shadow" id="studentSearchResults" style="z-index: 10;"></div>
+                </div>
+                {{ students }}
+                <div class="mt-3">
+                    <a href="{{ url_for('add_student') }}" class="btn btn-primary">
+                        <i class="fas fa-user-plus me-1"></i> Add New Student
+                    </a>
+                </div>
+            </div>
+        </div>
+    </div>
+</div>
+
+<script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
+<script>
+    document.addEventListener('DOMContentLoaded', function() {
+        let occupancyChart = null;
+
+        function loadOccupancy(days) {
+            fetch('{{ url_for('api_occupancy') }}?days=' + days)
+                .then(response => response.json())
+                .then(data => {
+                    const labels = data.series.map(point => point.date);
+                    const datasets = [
+                        {label: 'Occupied', data: data.series.map(point => point.occupied), borderColor: '#3498db', fill: false, pointRadius: 0},
+                        {label: 'Capacity', data: data.series.map(point => point.capacity), borderColor: '#2c3e50', borderDash: [5, 5], fill: false, pointRadius: 0}
+                    ];
+                    if (occupancyChart) {
+                        occupancyChart.data.labels = labels;
+                        occupancyChart.data.datasets = datasets;
+                        occupancyChart.update();
+                    } else {
+                        occupancyChart = new Chart(document.getElementById('occupancyChart'), {
+                            type: 'line',
+                            data: {labels: labels, datasets: datasets},
+                            options: {scales: {y: {beginAtZero: true}}}
+                        });
+                    }
+                });
+        }
+
+        const range = document.getElementById('occupancyRange');
+        range.addEventListener('change', () => loadOccupancy(range.value));
+        loadOccupancy(range.value);
+
+        // Student typeahead: wait for a pause in typing and abort the
+        // previous request so only the latest query's results are shown
+        const searchInput = document.getElementById('studentSearch');
+        const searchResults = document.getElementById('studentSearchResults');
+        let searchTimer = null;
+        let searchController = null;
+
+        searchInput.addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            if (searchController) {
+                searchController.abort();
+            }
+            const query = searchInput.value.trim();
+            if (!query) {
+                searchResults.innerHTML = '';
+                return;
+            }
+            searchTimer = setTimeout(function() {
+                searchController = new AbortController();
+                fetch('{{ url_for('api_search_students') }}?q=' + encodeURIComponent(query), {signal: searchController.signal})
+                    .then(response => response.json())
+                    .then(data => {
+                        searchResults.innerHTML = '';
+                        data.results.forEach(student => {
+                            const item = document.createElement('div');
+                            item.className = 'list-group-item';
+                            item.textContent = student.name + ' (' + student.student_id + ') - Room ' + (student.room_number || 'Unknown');
+                            searchResults.appendChild(item);
+                        });
+                        if (data.results.length === 0) {
+                            const item = document.createElement('div');
+                            item.className = 'list-group-item text-muted';
+                            item.textContent = 'No matching students';
+                            searchResults.appendChild(item);
+                        }
+                    })
+                    .catch(error => {
+                        if (error.name !== 'AbortError') {
+                            throw error;
+                        }
+                    });
+            }, 250);
+        });
+    });
+</script>
+{% endblock %}''')
+    
+    # Add Student template
+    with open('templates/add_student.html', 'w') as f:
+        f.write('''{% extends "base.html" %}
+{% block content %}
+<div class="row justify-content-center">
+    <div class="col-md-6">
+        <div class="card">
+            <div class="card-header">
+                <h3 class="text-center">Add New Student</h3>
+            </div>
+            <div class="card-body">
+                <form method="POST">
+                    <div class="mb-3">
+                        <label for="name" class="form-label">Full Name</label>
+                        <input type="text" class="form-control" id="name" name="name" required>
+                    </div>
+                    <div class="mb-3">
+                        <label for="student_id" class="form-label">Student ID</label>
+                        <input type="text" class="form-control" id="student_id" name="student_id" required>
                     </div>
-                </div>
+                    <div class="mb-3">
+                        <label for="room_id" class="form-label">Room</label>
+                        <select class="form-control" id="room_id" name="room_id" required>
+                            <option value="">Select a room</option>
+                            {% for room in rooms %}
+                                <option value="{{ room.id }}">Room {{ room.room_number }} ({{ room.free_beds }} available)</option>
+                            {% endfor %}
+                        </select>
+                    </div>
+                    <div class="text-center">
+                        <button type="submit" class="btn btn-primary">Add Student</button>
+                        <a href="{{ url_for('dashboard') }}" class="btn btn-secondary">Cancel</a>
+                    </div>
+                </form>
+                {% if not rooms %}
+                    <div class="alert alert-warning mt-3 mb-0">
+                        <i class="fas fa-exclamation-triangle me-2"></i> Every room is full.
+                        <a href="{{ url_for('waitlist') }}">Add the student to the waitlist</a> and they will be assigned as soon as a bed frees up.
+                    </div>
+                {% endif %}
             </div>
         </div>
     </div>
 </div>
 {% endblock %}''')
     
-    # Login template
-    with open('templates/login.html', 'w') as f:
+    # Add Room template
+    with open('templates/add_room.html', 'w') as f:
         f.write('''{% extends "base.html" %}
 {% block content %}
 <div class="row justify-content-center">
     <div class="col-md-6">
         <div class="card">
             <div class="card-header">
-                <h3 class="text-center">Login</h3>
+                <h3 class="text-center">Add New Room</h3>
             </div>
             <div class="card-body">
                 <form method="POST">
                     <div class="mb-3">
-                        <label for="username" class="form-label">Username</label>
-                        <input type="text" class="form-control" id="username" name="username" required>
+                        <label for="room_number" class="form-label">Room Number</label>
+                        <input type="text" class="form-control" id="room_number" name="room_number" required>
                     </div>
                     <div class="mb-3">
-                        <label for="password" class="form-label">Password</label>
-                        <input type="password" class="form-control" id="password" name="password" required>
+                        <label for="capacity" class="form-label">Capacity</label>
+                        <input type="number" class="form-control" id="capacity" name="capacity" min="1" max="10" required>
                     </div>
                     <div class="text-center">
-                        <button type="submit" class="btn btn-primary">Login</button>
+                        <button type="submit" class="btn btn-primary">Add Room</button>
+                        <a href="{{ url_for('dashboard') }}" class="btn btn-secondary">Cancel</a>
                     </div>
                 </form>
             </div>
@@ -1065,160 +5115,188 @@ def create_templates():
     </div>
 </div>
 {% endblock %}''')
-    
-    # Dashboard template
-    with open('templates/dashboard.html', 'w') as f:
+
+    # Waitlist template
+    with open('templates/waitlist.html', 'w') as f:
         f.write('''{% extends "base.html" %}
 {% block content %}
 <div class="row mb-4">
     <div class="col-md-12">
-        <h2 class="text-center mb-4 animate__animated animate__fadeIn"><i class="fas fa-tachometer-alt me-2"></i> Hostel Dashboard</h2>
-    </div>
-</div>
-
-<!-- Stats Cards -->
-<div class="row mb-4">
-    <div class="col-md-3">
-        <div class="card stat-card animate__animated animate__fadeInUp">
-            <div class="card-body">
-                <i class="fas fa-door-open icon-stat"></i>
-                <div class="stat-value">{{ rooms|length }}</div>
-                <div class="stat-label">Total Rooms</div>
-            </div>
-        </div>
-    </div>
-    <div class="col-md-3">
-        <div class="card stat-card animate__animated animate__fadeInUp" style="animation-delay: 0.1s;">
-            <div class="card-body">
-                <i class="fas fa-users icon-stat"></i>
-                <div class="stat-value">{{ students|length }}</div>
-                <div class="stat-label">Total Students</div>
-            </div>
-        </div>
-    </div>
-    <div class="col-md-3">
-        <div class="card stat-card animate__animated animate__fadeInUp" style="animation-delay: 0.2s;">
-            <div class="card-body">
-                <i class="fas fa-bed icon-stat"></i>
-                <div class="stat-value">{{ occupied_beds }}</div>
-                <div class="stat-label">Beds Occupied</div>
-            </div>
-        </div>
-    </div>
-    <div class="col-md-3">
-        <div class="card stat-card animate__animated animate__fadeInUp" style="animation-delay: 0.3s;">
-            <div class="card-body">
-                <i class="fas fa-bed icon-stat"></i>
-                <div class="stat-value">{{ available_beds }}</div>
-                <div class="stat-label">Beds Available</div>
-            </div>
-        </div>
+        <h2 class="text-center mb-4 animate__animated animate__fadeIn"><i class="fas fa-hourglass-half me-2"></i> Waitlist</h2>
     </div>
 </div>
 
 <div class="row">
-    <div class="col-md-6">
+    <div class="col-md-4">
         <div class="card mb-4 animate__animated animate__fadeInLeft">
             <div class="card-header">
-                <h3><i class="fas fa-door-open me-2"></i>Rooms Status</h3>
+                <h3><i class="fas fa-user-clock me-2"></i>Join Waitlist</h3>
             </div>
             <div class="card-body">
-                <div class="table-responsive">
-                    <table class="table table-striped">
-                        <thead>
-                            <tr>
-                                <th>Room Number</th>
-                                <th>Capacity</th>
-                                <th>Occupied</th>
-                                <th>Available</th>
-                                <th>Status</th>
-                            </tr>
-                        </thead>
-                        <tbody>
+                <form method="POST">
+                    <div class="mb-3">
+                        <label for="name" class="form-label">Full Name</label>
+                        <input type="text" class="form-control" id="name" name="name" required>
+                    </div>
+                    <div class="mb-3">
+                        <label for="student_id" class="form-label">Student ID</label>
+                        <input type="text" class="form-control" id="student_id" name="student_id" required>
+                    </div>
+                    <div class="mb-3">
+                        <label for="room_id" class="form-label">Preferred Room</label>
+                        <select class="form-control" id="room_id" name="room_id">
+                            <option value="">Any room</option>
                             {% for room in rooms %}
-                            <tr>
-                                <td><i class="fas fa-door-closed me-1"></i> {{ room.room_number }}</td>
-                                <td><i class="fas fa-bed me-1"></i> {{ room.capacity }}</td>
-                                <td><i class="fas fa-user me-1"></i> {{ room.occupied }}</td>
-                                <td><i class="fas fa-check-circle me-1"></i> {{ room.capacity - room.occupied }}</td>
-                                <td>
-                                    {% if room.capacity == room.occupied %}
-                                        <span class="badge bg-danger">Full</span>
-                                    {% elif room.occupied == 0 %}
-                                        <span class="badge bg-success">Empty</span>
-                                    {% else %}
-                                        <span class="badge bg-warning">Partial</span>
-                                    {% endif %}
-                                </td>
-                            </tr>
+                                <option value="{{ room.id }}">Room {{ room.room_number }}</option>
                             {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                <div class="mt-3">
-                    <a href="{{ url_for('add_room') }}" class="btn btn-primary">
-                        <i class="fas fa-plus-circle me-1"></i> Add New Room
-                    </a>
-                </div>
+                        </select>
+                    </div>
+                    <div class="mb-3">
+                        <label for="priority" class="form-label">Priority</label>
+                        <input type="number" class="form-control" id="priority" name="priority" value="0">
+                        <small class="text-muted">Higher priorities are assigned first; equal priorities in order of arrival.</small>
+                    </div>
+                    <div class="text-center">
+                        <button type="submit" class="btn btn-primary">
+                            <i class="fas fa-plus-circle me-1"></i> Add to Waitlist
+                        </button>
+                    </div>
+                </form>
             </div>
         </div>
     </div>
-    <div class="col-md-6">
+    <div class="col-md-8">
         <div class="card mb-4 animate__animated animate__fadeInRight">
             <div class="card-header">
-                <h3><i class="fas fa-users me-2"></i>Students List</h3>
+                <h3><i class="fas fa-list-ol me-2"></i>Waiting Students ({{ total_waiting }})</h3>
             </div>
             <div class="card-body">
                 <div class="table-responsive">
                     <table class="table table-striped">
                         <thead>
                             <tr>
+                                <th>#</th>
                                 <th>Name</th>
                                 <th>Student ID</th>
-                                <th>Room</th>
-                                <th>Check-in Date</th>
+                                <th>Preferred Room</th>
+                                <th>Priority</th>
+                                <th>Waiting Since</th>
                                 <th>Action</th>
                             </tr>
                         </thead>
                         <tbody>
-                            {% for student in students %}
+                            {% for entry in entries %}
                             <tr>
-                                <td><i class="fas fa-user-graduate me-1"></i> {{ student.name }}</td>
-                                <td><i class="fas fa-id-card me-1"></i> {{ student.student_id }}</td>
-                                <td><i class="fas fa-door-open me-1"></i> {{ student.room.room_number }}</td>
-                                <td><i class="fas fa-calendar-alt me-1"></i> {{ student.check_in_date.strftime('%Y-%m-%d') }}</td>
+                                <td>{{ loop.index }}</td>
+                                <td><i class="fas fa-user-graduate me-1"></i> {{ entry.name }}</td>
+                                <td><i class="fas fa-id-card me-1"></i> {{ entry.student_id }}</td>
+                                <td><i class="fas fa-door-open me-1"></i> {{ entry.room.room_number if entry.room else 'Any' }}</td>
+                                <td>{{ entry.priority }}</td>
+                                <td><i class="fas fa-calendar-alt me-1"></i> {{ entry.created_at.strftime('%Y-%m-%d %H:%M') }}</td>
                                 <td>
-                                    <form method="POST" action="{{ url_for('remove_student', student_id=student.id) }}" onsubmit="return confirm('Are you sure you want to remove this student?');">
+                                    <form method="POST" action="{{ url_for('cancel_waitlist_entry', entry_id=entry.id) }}" onsubmit="return confirm('Are you sure you want to remove this student from the waitlist?');">
                                         <button type="submit" class="btn btn-sm btn-danger">
-                                            <i class="fas fa-user-minus"></i>
+                                            <i class="fas fa-times"></i>
                                         </button>
                                     </form>
                                 </td>
                             </tr>
+                            {% else %}
+                            <tr>
+                                <td colspan="7" class="text-center text-muted">Nobody is waiting for a bed</td>
+                            </tr>
                             {% endfor %}
                         </tbody>
                     </table>
                 </div>
-                <div class="mt-3">
-                    <a href="{{ url_for('add_student') }}" class="btn btn-primary">
-                        <i class="fas fa-user-plus me-1"></i> Add New Student
-                    </a>
-                </div>
             </div>
         </div>
     </div>
 </div>
 {% endblock %}''')
-    
-    # Add Student template
-    with open('templates/add_student.html', 'w') as f:
+
+    # Reservations template
+    with open('templates/hostels.html', 'w') as f:
         f.write('''{% extends "base.html" %}
 {% block content %}
-<div class="row justify-content-center">
-    <div class="col-md-6">
-        <div class="card">
+<div class="row mb-4">
+    <div class="col-md-12">
+        <h2 class="text-center mb-4 animate__animated animate__fadeIn"><i class="fas fa-building me-2"></i> Hostels</h2>
+    </div>
+</div>
+
+<div class="card animate__animated animate__fadeInUp">
+    <div class="card-header">
+        <h3><i class="fas fa-list me-2"></i>All Hostels</h3>
+    </div>
+    <div class="card-body">
+        <div class="table-responsive">
+            <table class="table table-striped">
+                <thead>
+                    <tr>
+                        <th>Hostel</th>
+                        <th>Rooms</th>
+                        <th>Students</th>
+                        <th>Total Beds</th>
+                        <th>Occupied Beds</th>
+                        <th>Available Beds</th>
+                        <th>Actions</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for hostel in hostels %}
+                    <tr>
+                        <td><i class="fas fa-hotel me-1"></i> {{ hostel.name }} <small class="text-muted">/h/{{ hostel.slug }}</small></td>
+                        {% if hostel.error %}
+                            <td colspan="5"><span class="badge bg-danger">Unavailable</span> {{ hostel.error }}</td>
+                        {% else %}
+                            <td>{{ hostel.total_rooms }}</td>
+                            <td>{{ hostel.total_students }}</td>
+                            <td>{{ hostel.total_beds }}</td>
+                            <td>{{ hostel.occupied_beds }}</td>
+                            <td>{{ hostel.available_beds }}</td>
+                        {% endif %}
+                        <td>
+                            <a href="{{ hostel_url(hostel.slug, 'dashboard') }}" class="btn btn-sm btn-primary">
+                                <i class="fas fa-tachometer-alt"></i> Dashboard
+                            </a>
+                        </td>
+                    </tr>
+                    {% endfor %}
+                </tbody>
+                {% if hostels|length > 1 %}
+                <tfoot>
+                    <tr class="fw-bold">
+                        <td>All hostels</td>
+                        <td>{{ totals.total_rooms }}</td>
+                        <td>{{ totals.total_students }}</td>
+                        <td>{{ totals.total_beds }}</td>
+                        <td>{{ totals.occupied_beds }}</td>
+                        <td>{{ totals.available_beds }}</td>
+                        <td></td>
+                    </tr>
+                </tfoot>
+                {% endif %}
+            </table>
+        </div>
+    </div>
+</div>
+{% endblock %}''')
+
+    with open('templates/reservations.html', 'w') as f:
+        f.write('''{% extends "base.html" %}
+{% block content %}
+<div class="row mb-4">
+    <div class="col-md-12">
+        <h2 class="text-center mb-4 animate__animated animate__fadeIn"><i class="fas fa-calendar-check me-2"></i> Reservations</h2>
+    </div>
+</div>
+
+<div class="row">
+    <div class="col-md-4">
+        <div class="card mb-4 animate__animated animate__fadeInLeft">
             <div class="card-header">
-                <h3 class="text-center">Add New Student</h3>
+                <h3><i class="fas fa-calendar-plus me-2"></i>New Reservation</h3>
             </div>
             <div class="card-body">
                 <form method="POST">
@@ -1235,48 +5313,69 @@ def create_templates():
                         <select class="form-control" id="room_id" name="room_id" required>
                             <option value="">Select a room</option>
                             {% for room in rooms %}
-                                {% if room.occupied < room.capacity %}
-                                    <option value="{{ room.id }}">Room {{ room.room_number }} ({{ room.capacity - room.occupied }} available)</option>
-                                {% endif %}
+                                <option value="{{ room.id }}">Room {{ room.room_number }} ({{ room.capacity }} beds)</option>
                             {% endfor %}
                         </select>
                     </div>
+                    <div class="mb-3">
+                        <label for="start_date" class="form-label">Check-in Date</label>
+                        <input type="date" class="form-control" id="start_date" name="start_date" min="{{ today }}" required>
+                    </div>
+                    <div class="mb-3">
+                        <label for="end_date" class="form-label">Check-out Date</label>
+                        <input type="date" class="form-control" id="end_date" name="end_date" min="{{ today }}" required>
+                    </div>
                     <div class="text-center">
-                        <button type="submit" class="btn btn-primary">Add Student</button>
-                        <a href="{{ url_for('dashboard') }}" class="btn btn-secondary">Cancel</a>
+                        <button type="submit" class="btn btn-primary">
+                            <i class="fas fa-save me-1"></i> Reserve
+                        </button>
                     </div>
                 </form>
             </div>
         </div>
     </div>
-</div>
-{% endblock %}''')
-    
-    # Add Room template
-    with open('templates/add_room.html', 'w') as f:
-        f.write('''{% extends "base.html" %}
-{% block content %}
-<div class="row justify-content-center">
-    <div class="col-md-6">
-        <div class="card">
+    <div class="col-md-8">
+        <div class="card mb-4 animate__animated animate__fadeInRight">
             <div class="card-header">
-                <h3 class="text-center">Add New Room</h3>
+                <h3><i class="fas fa-list me-2"></i>Upcoming Reservations</h3>
             </div>
             <div class="card-body">
-                <form method="POST">
-                    <div class="mb-3">
-                        <label for="room_number" class="form-label">Room Number</label>
-                        <input type="text" class="form-control" id="room_number" name="room_number" required>
-                    </div>
-                    <div class="mb-3">
-                        <label for="capacity" class="form-label">Capacity</label>
-                        <input type="number" class="form-control" id="capacity" name="capacity" min="1" max="10" required>
-                    </div>
-                    <div class="text-center">
-                        <button type="submit" class="btn btn-primary">Add Room</button>
-                        <a href="{{ url_for('dashboard') }}" class="btn btn-secondary">Cancel</a>
-                    </div>
-                </form>
+                <div class="table-responsive">
+                    <table class="table table-striped">
+                        <thead>
+                            <tr>
+                                <th>Name</th>
+                                <th>Student ID</th>
+                                <th>Room</th>
+                                <th>Check-in</th>
+                                <th>Check-out</th>
+                                <th>Action</th>
+                            </tr>
+                        </thead>
+                        <tbody>
+                            {% for reservation in reservations %}
+                            <tr>
+                                <td><i class="fas fa-user-graduate me-1"></i> {{ reservation.name }}</td>
+                                <td><i class="fas fa-id-card me-1"></i> {{ reservation.student_id }}</td>
+                                <td><i class="fas fa-door-open me-1"></i> {{ reservation.room.room_number }}</td>
+                                <td><i class="fas fa-calendar-alt me-1"></i> {{ reservation.start_date.strftime('%Y-%m-%d') }}</td>
+                                <td><i class="fas fa-calendar-alt me-1"></i> {{ reservation.end_date.strftime('%Y-%m-%d') }}</td>
+                                <td>
+                                    <form method="POST" action="{{ url_for('cancel_reservation', reservation_id=reservation.id) }}" onsubmit="return confirm('Are you sure you want to cancel this reservation?');">
+                                        <button type="submit" class="btn btn-sm btn-danger">
+                                            <i class="fas fa-times"></i>
+                                        </button>
+                                    </form>
+                                </td>
+                            </tr>
+                            {% else %}
+                            <tr>
+                                <td colspan="6" class="text-center text-muted">No upcoming reservations</td>
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                </div>
             </div>
         </div>
     </div>
@@ -0,0 +1,82 @@
+"""Benchmark the vectorized occupancy analytics on a synthetic hostel.
+
+Usage: python benchmarks/bench_analytics.py [--rooms N] [--students N] [--events N]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from app import db, compute_occupancy_analytics
+
+
+def build_database(path, rooms, students, events):
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(42)
+    start = datetime.now() - timedelta(days=730)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO room (id, room_number, capacity, occupied, bed_mask) VALUES (?, ?, ?, ?, 0)',
+        ((i, str(100 + i), 12, 0) for i in range(1, rooms + 1)))
+    conn.executemany(
+        'INSERT INTO student (id, name, student_id, room_id, check_in_date) VALUES (?, ?, ?, ?, ?)',
+        ((i, f'Student {i}', f'S{i:07d}', rng.randint(1, rooms),
+          str(start + timedelta(seconds=rng.randint(0, 730 * 86400)))) for i in range(1, students + 1)))
+    conn.execute('UPDATE room SET occupied = (SELECT COUNT(*) FROM student WHERE student.room_id = room.id)')
+
+    def audit_rows():
+        for i in range(events // 2):
+            check_in = start + timedelta(seconds=rng.randint(0, 700 * 86400))
+            check_out = check_in + timedelta(days=rng.randint(1, 300))
+            yield ('add', 'student', i, 'synthetic', str(check_in))
+            yield ('remove', 'student', i, 'synthetic', str(check_out))
+    conn.executemany(
+        'INSERT INTO audit_log (action, entity_type, entity_id, details, timestamp) VALUES (?, ?, ?, ?, ?)',
+        audit_rows())
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--events', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        began = time.perf_counter()
+        build_database(path, args.rooms, args.students, args.events)
+        print(f'Built {args.rooms} rooms, {args.students} students, {args.events} audit rows '
+              f'in {time.perf_counter() - began:.1f}s')
+
+        engine = create_engine(f'sqlite:///{path}')
+        timings = []
+        for _ in range(args.repeat):
+            with engine.connect() as conn:
+                began = time.perf_counter()
+                report = compute_occupancy_analytics(conn)
+                timings.append(time.perf_counter() - began)
+        engine.dispose()
+
+        print(f'compute_occupancy_analytics: best {min(timings):.2f}s, '
+              f'mean {sum(timings) / len(timings):.2f}s over {args.repeat} runs')
+        print(f"completed stays: {report['length_of_stay']['completed_stays']}, "
+              f"peak load: {report['peak_load']['occupied']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark online backups: throughput and the pause seen by concurrent writers.
+
+The backup is timed alone, then again while a writer thread commits small
+updates to the same file; writer latency is reported before and during it.
+
+Usage: python benchmarks/bench_backup.py [--students N] [--write-interval SECONDS]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_database(path, rooms, students):
+    from sqlalchemy import create_engine
+    from app import db, create_student_search
+
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        create_student_search(conn)
+    engine.dispose()
+
+    rng = random.Random(5)
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO room (id, room_number, capacity, occupied, bed_mask) VALUES (?, ?, 12, 0, 0)',
+                     ((i, str(100 + i)) for i in range(1, rooms + 1)))
+    conn.executemany(
+        'INSERT INTO student (name, student_id, room_id, check_in_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+        ((f'Student {i}', f'S{i:07d}', rng.randint(1, rooms)) for i in range(students)))
+    conn.commit()
+    conn.close()
+
+
+def write_latencies(path, rooms, interval, stop, timings):
+    rng = random.Random(9)
+    conn = sqlite3.connect(path, timeout=30)
+    while not stop.is_set():
+        began = time.perf_counter()
+        conn.execute('UPDATE room SET occupied = occupied WHERE id = ?', (rng.randint(1, rooms),))
+        conn.commit()
+        timings.append((began, time.perf_counter() - began))
+        time.sleep(interval)
+    conn.close()
+
+
+def summarize(label, timings):
+    timings = sorted(timings)
+    if not timings:
+        print(f'{label}: no writes')
+        return
+    print(f'{label}: {len(timings)} writes, p50 {timings[len(timings) // 2] * 1000:.2f}ms, '
+          f'p99 {timings[int(len(timings) * 0.99)] * 1000:.2f}ms, max {timings[-1] * 1000:.2f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--students', type=int, default=300000)
+    parser.add_argument('--write-interval', type=float, default=0.02)
+    parser.add_argument('--baseline', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'main.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+        os.environ['BACKUP_DIR'] = os.path.join(tmp, 'backups')
+        build_database(path, args.rooms, args.students)
+        from app import app, backup_database
+
+        with app.app_context():
+            result = backup_database()
+        print(f"backup alone: {result['bytes'] / 1048576:.1f} MB in {result['seconds']}s "
+              f"({result['mb_per_second']} MB/s), {result['batches']} batches, "
+              f"longest pause {result['max_pause_ms']}ms, {result['compressed_bytes'] / 1048576:.1f} MB gzipped")
+
+        stop = threading.Event()
+        timings = []
+        writer = threading.Thread(target=write_latencies, args=(path, args.rooms, args.write_interval, stop, timings))
+        writer.start()
+        time.sleep(args.baseline)
+        with app.app_context():
+            started = time.perf_counter()
+            result = backup_database()
+            finished = time.perf_counter()
+        stop.set()
+        writer.join()
+
+        print(f"backup with a writer every {args.write_interval * 1000:.0f}ms: {result['seconds']}s "
+              f"({result['mb_per_second']} MB/s), {result['batches']} batches over {result['attempts']} attempts, "
+              f"longest pause {result['max_pause_ms']}ms")
+        summarize('writes before backup', [t for at, t in timings if at < started])
+        summarize('writes during backup', [t for at, t in timings if started <= at < finished])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Benchmark hostel export and import archives on a large synthetic hostel.
+
+Builds a hostel with N students and M audit entries, exports it to an
+archive and imports the archive into an empty database. Each step runs in
+a fresh process, so its peak RSS shows whether memory stays bounded as the
+tables grow.
+
+Usage: python benchmarks/bench_export.py [--students N] [--audit-rows N]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_database(path, students, audit_rows):
+    from sqlalchemy import create_engine
+    from app import db, create_student_search
+
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        create_student_search(conn)
+    engine.dispose()
+
+    rooms = students // 4 + 1
+    rng = random.Random(17)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user (id, username, password, role, hostel) VALUES (1, 'admin', 'x', 'admin', NULL)")
+    conn.executemany(
+        'INSERT INTO room (id, room_number, capacity, occupied, bed_mask, floor) VALUES (?, ?, 4, 0, 0, ?)',
+        ((i, str(1000 + i), (1000 + i) // 100) for i in range(1, rooms + 1)))
+    conn.executemany(
+        'INSERT INTO student (name, student_id, room_id, bed_number, check_in_date) '
+        'VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)',
+        ((f'Student {i}', f'S{i:07d}', i // 4 + 1, i % 4 + 1) for i in range(students)))
+    conn.execute('UPDATE room SET occupied = (SELECT COUNT(*) FROM student WHERE student.room_id = room.id), '
+                 'bed_mask = (SELECT COALESCE(SUM(1 << (bed_number - 1)), 0) FROM student '
+                 'WHERE student.room_id = room.id)')
+
+    # Past stays: a check-in and a check-out entry each, plus the archived stay
+    def stays():
+        for i in range(audit_rows // 2):
+            room = rng.randint(1, rooms)
+            stamp = f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} 10:00:00'
+            data = {'id': students + i, 'student_id': f'P{i:07d}', 'name': f'Past {i}', 'room_id': room,
+                    'room_number': str(1000 + room), 'bed_number': i % 4 + 1, 'check_in_date': stamp}
+            yield data, stamp
+
+    audit, history = [], []
+    for data, stamp in stays():
+        details = f"Student {data['name']} (ID: {data['student_id']}) "
+        audit.append(('add', 'student', data['id'], details + f"added to room {data['room_number']}",
+                      json.dumps(data), 1, stamp))
+        audit.append(('remove', 'student', data['id'], details + f"removed from room {data['room_number']}",
+                      json.dumps(data), 1, stamp))
+        history.append((data['id'], data['name'], data['student_id'], data['room_id'], data['room_number'],
+                        data['bed_number'], stamp, stamp))
+        if len(audit) >= 100000:
+            flush_history(conn, audit, history)
+    flush_history(conn, audit, history)
+    conn.commit()
+    conn.close()
+
+
+def flush_history(conn, audit, history):
+    conn.executemany('INSERT INTO audit_log (action, entity_type, entity_id, details, data, user_id, timestamp) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)', audit)
+    conn.executemany('INSERT INTO resident_history (student_pk, name, student_id, room_id, room_number, '
+                     'bed_number, check_in_date, check_out_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', history)
+    audit.clear()
+    history.clear()
+
+
+def run_child(step, archive):
+    from app import app, export_hostel, import_hostel
+
+    began = time.perf_counter()
+    with app.app_context():
+        if step == 'export':
+            with open(archive, 'wb') as out:
+                rows = export_hostel(out)
+        else:
+            with open(archive, 'rb') as stream:
+                rows = import_hostel(stream)['rows']
+    print(json.dumps({'seconds': time.perf_counter() - began, 'rows': sum(rows.values()),
+                      'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--audit-rows', type=int, default=2000000)
+    parser.add_argument('--child', choices=['export', 'import'], help=argparse.SUPPRESS)
+    parser.add_argument('--archive', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.archive)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.db')
+        archive = os.path.join(tmp, 'hostel.jsonl.gz')
+        os.environ['DATABASE_URL'] = f'sqlite:///{source}'
+        build_database(source, args.students, args.audit_rows)
+        print(f'{args.students} students, {args.audit_rows} audit entries, '
+              f'{os.path.getsize(source) / 1048576:.0f} MB database')
+        for step, path in (('export', source), ('import', os.path.join(tmp, 'target.db'))):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', step, '--archive', archive],
+                                    env=dict(os.environ, DATABASE_URL=f'sqlite:///{path}'),
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{step:>7}: {result['rows']} rows in {result['seconds']:.1f}s "
+                  f"({result['rows'] / result['seconds']:,.0f} rows/s), peak RSS {result['max_rss_mb']:.0f}MB")
+        print(f'archive: {os.path.getsize(archive) / 1048576:.0f} MB')
+
+
+if __name__ == '__main__':
+    main()
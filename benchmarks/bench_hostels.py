@@ -0,0 +1,97 @@
+"""Benchmark per-hostel request latency as the number of hostels grows.
+
+Each hostel gets its own SQLite database with the same synthetic rooms and
+students. Dashboard requests are spread over all hostels with the fragment
+cache disabled, so every request queries its hostel's database.
+
+Usage: python benchmarks/bench_hostels.py [--hostels 1,10,50,100] [--requests N]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fill_hostel(path, rooms, students):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO room (id, room_number, capacity, occupied, bed_mask, floor) VALUES (?, ?, ?, 0, 0, ?)',
+        ((i, str(100 + i), 4, (100 + i) // 100) for i in range(1, rooms + 1)))
+    conn.executemany(
+        'INSERT INTO student (name, student_id, room_id, check_in_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+        ((f'Student {i}', f'S{i:07d}', i % rooms + 1) for i in range(students)))
+    conn.execute('UPDATE room SET occupied = (SELECT COUNT(*) FROM student WHERE student.room_id = room.id)')
+    conn.commit()
+    conn.close()
+
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hostels', default='1,10,50,100')
+    parser.add_argument('--rooms', type=int, default=500)
+    parser.add_argument('--students', type=int, default=1500)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'main.db')}"
+        from flask import g
+        from app import app, db, upgrade_schema, hostel_directory, Hostel, User
+
+        app.config['JOB_RUNNER_ENABLED'] = False
+        app.config['FRAGMENT_CACHE_SIZE'] = 0
+        with app.app_context():
+            upgrade_schema()
+            db.session.add(User(username='admin', password='admin123', role='admin'))
+            db.session.commit()
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        rng = random.Random(3)
+        slugs = []
+        for count in sorted(int(n) for n in args.hostels.split(',')):
+            while len(slugs) < count:
+                slug = f'hostel-{len(slugs) + 1}'
+                path = os.path.join(tmp, f'{slug}.db')
+                with app.app_context():
+                    db.session.add(Hostel(slug=slug, name=slug.title(), database=path))
+                    db.session.commit()
+                    hostel_directory.refresh()
+                    g.hostel = slug
+                    upgrade_schema()
+                fill_hostel(path, args.rooms, args.students)
+                slugs.append(slug)
+            hostel_directory.refresh()
+
+            # Open every shard's engine before timing
+            for slug in slugs:
+                client.get(f'/h/{slug}/dashboard')
+
+            timings = []
+            for _ in range(args.requests):
+                url = f'/h/{rng.choice(slugs)}/dashboard?room_page={rng.randint(1, args.rooms // 25)}'
+                began = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - began)
+                assert response.status_code == 200, response.status_code
+            timings.sort()
+
+            began = time.perf_counter()
+            client.get('/api/hostels')
+            fanout = time.perf_counter() - began
+
+            print(f'{count:4d} hostels: dashboard p50 {percentile(timings, 0.5):.2f}ms, '
+                  f'p99 {percentile(timings, 0.99):.2f}ms; summary of all hostels {fanout * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Benchmark list views loading full ORM instances against column projections.
+
+Builds a hostel with N students and M audit entries, then loads what the
+dashboard, beds and audit log pages display, once the way the views used to
+(ORM objects) and once through the projection rows they use now. Each mode
+runs in a fresh process so peak RSS is comparable to a single worker;
+peak allocations per request are measured with tracemalloc.
+
+Usage: python benchmarks/bench_projections.py [--students N] [--audit-rows N]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ACTIONS = [('add', 'student'), ('remove', 'student'), ('update', 'room'), ('login', 'user')]
+
+
+def build_database(path, students, audit_rows):
+    from sqlalchemy import create_engine
+    from app import db, create_student_search
+
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        create_student_search(conn)
+    engine.dispose()
+
+    rooms = students // 4 + 1
+    rng = random.Random(13)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user (id, username, password, role, hostel) VALUES (1, 'admin', 'x', 'admin', NULL)")
+    conn.executemany(
+        'INSERT INTO room (id, room_number, capacity, occupied, bed_mask, floor) VALUES (?, ?, 4, 0, 0, ?)',
+        ((i, str(1000 + i), (1000 + i) // 100) for i in range(1, rooms + 1)))
+    conn.executemany(
+        'INSERT INTO student (name, student_id, room_id, bed_number, check_in_date) '
+        'VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)',
+        ((f'Student {i}', f'S{i:07d}', i // 4 + 1, i % 4 + 1) for i in range(students)))
+    conn.execute('UPDATE room SET occupied = (SELECT COUNT(*) FROM student WHERE student.room_id = room.id), '
+                 'bed_mask = (SELECT COALESCE(SUM(1 << (bed_number - 1)), 0) FROM student '
+                 'WHERE student.room_id = room.id)')
+
+    def audit_entries():
+        for i in range(audit_rows):
+            action, entity_type = rng.choice(ACTIONS)
+            room_number = str(1000 + rng.randint(1, rooms))
+            data = json.dumps({'room_number': room_number, 'student_id': f'S{i % students:07d}'})
+            yield (action, entity_type, i, f'{action} {entity_type} in room {room_number}', data,
+                   rng.choice((1, None)), f'2024-01-01 00:00:{i % 60:02d}')
+
+    conn.executemany('INSERT INTO audit_log (action, entity_type, entity_id, details, data, user_id, timestamp) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)', audit_entries())
+    conn.commit()
+    conn.close()
+
+
+# The views before projections: full instances, with the student's room
+# eagerly joined and the audit user loaded through the relationship
+def orm_loaders(app_module):
+    from app import db, Room, Student, AuditLog
+
+    def rooms():
+        return app_module._page(Room.query.order_by(Room.room_number, Room.id), 'room_').items
+
+    def students():
+        query = Student.query.join(Room, Student.room_id == Room.id, isouter=True) \
+            .options(db.contains_eager(Student.room)).order_by(Student.check_in_date, Student.id)
+        return [(student.name, student.room.room_number) for student in app_module._page(query, 'student_').items]
+
+    def audit():
+        return [(log.details, log.user.username if log.user else 'System')
+                for log in AuditLog.query.order_by(AuditLog.timestamp.desc()).all()]
+
+    return {'rooms': rooms, 'students': students, 'audit': audit}
+
+
+def projection_loaders(app_module):
+    from app import AuditLog, AuditRow
+
+    return {
+        'rooms': lambda: app_module.paginate_rooms('room_').items,
+        'students': lambda: app_module.paginate_students('student_').items,
+        'audit': lambda: AuditRow.fetch(AuditRow.query().order_by(AuditLog.timestamp.desc())),
+    }
+
+
+def run_child(mode, repeat):
+    import app as app_module
+    from app import app, db
+
+    loaders = (orm_loaders if mode == 'orm' else projection_loaders)(app_module)
+    results = {}
+    for view, load in loaders.items():
+        timings = []
+        for _ in range(repeat if view != 'audit' else 3):
+            with app.test_request_context('/dashboard'):
+                began = time.perf_counter()
+                load()
+                timings.append(time.perf_counter() - began)
+                db.session.remove()
+        timings.sort()
+        # Allocations in a separate run; tracing slows everything down
+        with app.test_request_context('/dashboard'):
+            tracemalloc.start()
+            rows = load()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del rows
+            db.session.remove()
+        results[view] = {'ms': timings[len(timings) // 2] * 1000, 'peak_kb': peak / 1024}
+    results['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--audit-rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--child', choices=['orm', 'projection'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'main.db')
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}')
+        os.environ.update(env)
+        build_database(path, args.students, args.audit_rows)
+        print(f'{args.students} students, {args.audit_rows} audit entries')
+        for mode in ('orm', 'projection'):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode,
+                                     '--repeat', str(args.repeat)],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            views = ', '.join(f"{view} {result[view]['ms']:.1f}ms/{result[view]['peak_kb']:.0f}KB"
+                              for view in ('rooms', 'students', 'audit'))
+            print(f"{mode:>10}: {views}; worker peak RSS {result['max_rss_mb']:.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
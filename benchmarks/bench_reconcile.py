@@ -0,0 +1,74 @@
+"""Benchmark occupancy reconciliation on a synthetic hostel with drifted counters.
+
+Usage: python benchmarks/bench_reconcile.py [--rooms N] [--students N] [--drift FRACTION]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_database(path, rooms, students, drift):
+    from sqlalchemy import create_engine
+    from app import db
+
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(11)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO room (id, room_number, capacity, occupied, bed_mask, updated_at) VALUES (?, ?, ?, 0, 0, ?)',
+        ((i, str(100 + i), 12, '2020-01-01 00:00:00') for i in range(1, rooms + 1)))
+    conn.executemany(
+        'INSERT INTO student (name, student_id, room_id, check_in_date) VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+        ((f'Student {i}', f'S{i:07d}', rng.randint(1, rooms)) for i in range(students)))
+    conn.execute('UPDATE room SET occupied = (SELECT COUNT(*) FROM student WHERE student.room_id = room.id)')
+    drifted = rng.sample(range(1, rooms + 1), int(rooms * drift))
+    conn.executemany('UPDATE room SET occupied = occupied + 1 WHERE id = ?', ((room_id,) for room_id in drifted))
+    conn.commit()
+    conn.close()
+    return len(drifted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--drift', type=float, default=0.05)
+    parser.add_argument('--touched', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'main.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+        drifted = build_database(path, args.rooms, args.students, args.drift)
+        from app import app, db, reconcile_occupancy
+
+        with app.app_context():
+            for label, options in (('full check', {'full': True}),
+                                   ('full check and repair', {'full': True, 'repair': True})):
+                began = time.perf_counter()
+                result = reconcile_occupancy(**options)
+                print(f"{label}: {result['rooms_checked']} rooms, {len(result['mismatches'])} mismatched "
+                      f"({drifted} drifted) in {time.perf_counter() - began:.2f}s")
+
+            conn = db.session.connection()
+            conn.exec_driver_sql(
+                "UPDATE room SET occupied = occupied + 1, updated_at = datetime('now', 'localtime', '+1 minute') "
+                f"WHERE id <= {args.touched}")
+            db.session.commit()
+            began = time.perf_counter()
+            result = reconcile_occupancy()
+            print(f"incremental check: {result['rooms_checked']} touched rooms, {len(result['mismatches'])} "
+                  f"mismatched in {time.perf_counter() - began:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
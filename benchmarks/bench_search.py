@@ -0,0 +1,61 @@
+"""Benchmark the student typeahead search on a synthetic hostel.
+
+Usage: python benchmarks/bench_search.py [--students N]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from app import db, create_student_search, search_students
+
+FIRST_NAMES = ['Aisha', 'Ben', 'Chen', 'Diego', 'Elena', 'Farah', 'Goran', 'Hana', 'Ivan', 'Jana',
+               'Kofi', 'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sven', 'Tariq']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            create_student_search(conn)
+            conn.exec_driver_sql('INSERT INTO room (id, room_number, capacity, occupied, bed_mask) '
+                                 'VALUES (1, ?, ?, 0, 0)', ('101', args.students))
+            surnames = [''.join(rng.choices(string.ascii_lowercase, k=7)).capitalize() for _ in range(5000)]
+            conn.exec_driver_sql(
+                'INSERT INTO student (name, student_id, room_id, check_in_date) VALUES (?, ?, 1, CURRENT_TIMESTAMP)',
+                [(f'{rng.choice(FIRST_NAMES)} {rng.choice(surnames)}', f'S{i:07d}') for i in range(args.students)])
+
+        queries = [rng.choice(surnames)[:rng.randint(1, 5)] for _ in range(args.queries // 2)]
+        queries += [f'S{rng.randint(0, args.students - 1):07d}'[:rng.randint(3, 8)] for _ in range(args.queries // 2)]
+
+        timings = []
+        with engine.connect() as conn:
+            for query in queries:
+                began = time.perf_counter()
+                search_students(query, conn=conn)
+                timings.append(time.perf_counter() - began)
+        engine.dispose()
+
+    timings.sort()
+    print(f'{len(timings)} searches over {args.students} students: '
+          f'p50 {timings[len(timings) // 2] * 1000:.2f}ms, '
+          f'p99 {timings[int(len(timings) * 0.99)] * 1000:.2f}ms, '
+          f'max {timings[-1] * 1000:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Benchmark gunicorn worker models: throughput and tail latency per configuration.
+
+Each configuration in the matrix serves a fresh copy of a synthetic hostel
+through gunicorn.conf.py, while client threads on keep-alive connections
+replay two workloads for a fixed time:
+
+  read   dashboard, beds and available-room lookups, with one check-in in 20
+  rush   check-ins only, spread over every room
+
+Configurations are CLASS[:WORKERS[xTHREADS]]; omitted counts come from
+gunicorn.conf.py. gevent is skipped when it is not installed. The clients
+run on the same machine as the server, so compare rows rather than reading
+the numbers as capacity.
+
+Usage: python benchmarks/bench_workers.py [--config gthread:3x8 ...] [--clients N] [--seconds N]
+"""
+import argparse
+import http.client
+import importlib.util
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+READS = ['/dashboard', '/beds', '/api/rooms/available?beds=2']
+
+
+def build_database(path, rooms, students):
+    from sqlalchemy import create_engine
+    from app import db, create_student_search
+
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        create_student_search(conn)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user (id, username, password, role, hostel) VALUES (1, 'admin', 'admin123', 'admin', NULL)")
+    conn.executemany(
+        'INSERT INTO room (id, room_number, capacity, occupied, bed_mask, floor) VALUES (?, ?, 8, 0, 0, ?)',
+        ((i, str(1000 + i), (1000 + i) // 100) for i in range(1, rooms + 1)))
+    conn.executemany(
+        'INSERT INTO student (name, student_id, room_id, bed_number, check_in_date) '
+        'VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)',
+        ((f'Student {i}', f'S{i:07d}', i + 1) for i in range(min(students, rooms))))
+    conn.execute('UPDATE room SET occupied = (SELECT COUNT(*) FROM student WHERE student.room_id = room.id), '
+                 'bed_mask = (SELECT COUNT(*) FROM student WHERE student.room_id = room.id)')
+    conn.commit()
+    conn.close()
+
+
+def parse_config(spec):
+    worker_class, _, counts = spec.partition(':')
+    workers, _, threads = counts.partition('x')
+    return worker_class, workers or None, threads or None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(spec, path, port, tmp):
+    worker_class, workers, threads = parse_config(spec)
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_BIND=f'127.0.0.1:{port}', RATE_LIMIT_ENABLED='0',
+               RATE_LIMIT_PATH=os.path.join(tmp, 'ratelimit.db'), BACKUP_DIR=os.path.join(tmp, 'backups'))
+    if workers:
+        env['WEB_CONCURRENCY'] = workers
+    if threads:
+        env['GUNICORN_THREADS'] = threads
+    log = open(os.path.join(tmp, 'gunicorn.log'), 'a')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                               '--log-level', 'warning', 'app:app'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    log.close()
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/login')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    with open(os.path.join(tmp, 'gunicorn.log')) as log:
+        raise RuntimeError(f'gunicorn did not start: {log.read()}')
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        body = urlencode({'username': 'admin', 'password': 'admin123'})
+        response = self.request('POST', '/login', body)
+        # Later responses only add flash messages; keep the login cookie
+        self.cookie = response.getheader('Set-Cookie').split(';')[0]
+
+    def request(self, method, url, body=None):
+        headers = {'Cookie': self.cookie} if getattr(self, 'cookie', None) else {}
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.conn.request(method, url, body, headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.conn.request(method, url, body, headers)
+            response = self.conn.getresponse()
+        response.read()
+        return response
+
+
+def run_client(port, workload, rooms, number, stop, results):
+    client = Client(port)
+    rng = random.Random(number)
+    timings, errors, sequence = [], 0, 0
+    while not stop.is_set():
+        began = time.perf_counter()
+        if workload == 'rush' or rng.random() < 0.05:
+            sequence += 1
+            body = urlencode({'name': f'Rush {number}-{sequence}', 'student_id': f'R{number:03d}{sequence:06d}',
+                              'room_id': rng.randint(1, rooms)})
+            response = client.request('POST', '/add_student', body)
+        else:
+            response = client.request('GET', rng.choice(READS))
+        timings.append(time.perf_counter() - began)
+        errors += response.status >= 400
+    results.append((timings, errors))
+
+
+def run_workload(port, workload, rooms, clients, seconds):
+    stop = threading.Event()
+    results = []
+    threads = [threading.Thread(target=run_client, args=(port, workload, rooms, i, stop, results))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    timings = sorted(t for client_timings, _ in results for t in client_timings)
+    errors = sum(client_errors for _, client_errors in results)
+    return len(timings) / seconds, timings[len(timings) // 2], timings[int(len(timings) * 0.99)], errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', action='append', help='Worker configuration, repeatable (default: a matrix)')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rooms', type=int, default=2000)
+    parser.add_argument('--students', type=int, default=1000)
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    configs = args.config or ['sync', 'gthread', f'gthread:{cpus + 1}x8', 'gevent']
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{template}'
+        build_database(template, args.rooms, args.students)
+        print(f'{cpus} CPUs, {args.clients} clients, {args.seconds:.0f}s per run')
+        print(f"{'config':>16} {'workload':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for spec in configs:
+            if spec.startswith('gevent') and importlib.util.find_spec('gevent') is None:
+                print(f'{spec:>16}: skipped, gevent is not installed')
+                continue
+            for workload in ('read', 'rush'):
+                path = os.path.join(tmp, 'main.db')
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                shutil.copy(template, path)
+                port = free_port()
+                server = start_server(spec, path, port, tmp)
+                try:
+                    rate, p50, p99, errors = run_workload(port, workload, args.rooms, args.clients, args.seconds)
+                finally:
+                    server.terminate()
+                    server.wait()
+                print(f'{spec:>16} {workload:>8} {rate:8.1f} {p50 * 1000:8.1f} {p99 * 1000:8.1f} {errors:7d}')
+
+
+if __name__ == '__main__':
+    main()
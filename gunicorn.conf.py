@@ -0,0 +1,52 @@
+# Gunicorn settings. Pick the worker model with GUNICORN_WORKER_CLASS:
+#
+#   gthread (default)  a few processes with a thread pool each. SQLite calls
+#                      release the GIL, so threads overlap on I/O and the
+#                      per-process caches are shared by more requests.
+#   sync               one request per process; the most isolated, and the
+#                      most memory per concurrent request.
+#   gevent             one process per CPU with greenlets. SQLite does not
+#                      yield to the event loop, so this only pays off when
+#                      requests wait on the network (webhooks, slow
+#                      clients); needs `pip install gevent`.
+#
+# WEB_CONCURRENCY, GUNICORN_THREADS and GUNICORN_WORKER_CONNECTIONS
+# override the worker, thread and greenlet counts derived below.
+import multiprocessing
+import os
+
+cpus = multiprocessing.cpu_count()
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'sync':
+    default_workers, default_threads = 2 * cpus + 1, 1
+elif worker_class == 'gevent':
+    default_workers, default_threads = cpus, 1
+else:
+    default_workers, default_threads = cpus + 1, 4
+
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+threads = int(os.environ.get('GUNICORN_THREADS', default_threads))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# One pooled connection per request thread, plus room for the job runner,
+# the webhook dispatcher and the cross-hostel summary threads. Greenlets
+# hold a connection only while a view runs, so gevent needs few.
+concurrent = threads if worker_class != 'gevent' else min(worker_connections, 16)
+os.environ.setdefault('DB_POOL_SIZE', str(concurrent + 4))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(concurrent))
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so a slow leak cannot grow without bound
+max_requests = 2000
+max_requests_jitter = 200
+
+# Preloading imports the app once in the master and forks workers from it.
+# gevent has to patch threading before the app creates its locks, so it
+# imports the app in each worker instead. Forked workers drop the database
+# connections they inherit (see reset_connections_after_fork in app.py).
+preload_app = worker_class != 'gevent'
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app reads these on import, so they are set before it is loaded
+DATA_DIR = tempfile.mkdtemp(prefix='hostel-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DATA_DIR, 'main.db')}"
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+os.environ['RATE_LIMIT_PATH'] = os.path.join(DATA_DIR, 'ratelimit.db')
+os.environ['BACKUP_DIR'] = os.path.join(DATA_DIR, 'backups')
+
+import app as hostel  # noqa: E402
+
+
+def reset_database():
+    with hostel.app.app_context():
+        hostel.db.engine.dispose()
+    for engine in hostel.hostel_directory.engines.values():
+        engine.dispose()
+    hostel.hostel_directory.engines.clear()
+    hostel.hostel_directory.refresh()
+    for name in os.listdir(DATA_DIR):
+        if not name.startswith('ratelimit.db') and '.db' in name:
+            os.remove(os.path.join(DATA_DIR, name))
+    # Per-process caches are keyed on the data version, which restarts
+    # with the database
+    hostel.fragment_cache.instances.clear()
+    hostel.free_bed_index.instances.clear()
+    for replica in hostel.read_replicas.instances.values():
+        if replica.replica_engine is not None:
+            replica.replica_engine.dispose()
+    hostel.read_replicas.instances.clear()
+    hostel.initialize_db()
+
+
+@pytest.fixture
+def app():
+    hostel.app.config.update(TESTING=True, JOB_RUNNER_ENABLED=False, WEBHOOK_DISPATCHER_ENABLED=False)
+    reset_database()
+    yield hostel.app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    assert response.status_code == 302
+    return client
+
+
+# A second hostel with its database in the test directory
+@pytest.fixture
+def east(app):
+    path = os.path.join(DATA_DIR, 'east.db')
+    result = app.test_cli_runner().invoke(args=['add-hostel', 'east', 'East Wing', '--database', path])
+    assert result.exit_code == 0, result.output
+    return 'east'
@@ -0,0 +1,110 @@
+import re
+import sqlite3
+
+from app import Room, Student, current_data_version
+
+
+def student_pk(app, student_id):
+    with app.app_context():
+        return Student.query.filter_by(student_id=student_id).one().id
+
+
+def room_pk(app, room_number):
+    with app.app_context():
+        return Room.query.filter_by(room_number=room_number).one().id
+
+
+def stat_values(html):
+    return [int(value) for value in re.findall(rb'<div class="stat-value">(\d+)</div>', html)]
+
+
+def taken_beds(html):
+    return html.count(b': taken"')
+
+
+def test_repeated_reads_are_served_from_the_cache(client):
+    client.get('/dashboard')
+    misses = client.get('/api/cache/stats').get_json()['misses']
+
+    assert client.get('/dashboard').status_code == 200
+
+    stats = client.get('/api/cache/stats').get_json()
+    assert stats['misses'] == misses
+    assert stats['hits'] >= 3
+
+
+def test_add_student_is_not_served_stale(client, app):
+    dashboard, beds = client.get('/dashboard').data, client.get('/beds').data
+    assert b'Ada Lovelace' not in dashboard
+    with app.app_context():
+        version = current_data_version()
+
+    client.post('/add_student', data={'name': 'Ada Lovelace', 'student_id': 'S100', 'room_id': room_pk(app, '101')})
+
+    with app.app_context():
+        assert current_data_version() > version
+    assert b'Ada Lovelace' in client.get('/dashboard').data
+    after = client.get('/beds').data
+    assert taken_beds(after) == taken_beds(beds) + 1
+    assert stat_values(after)[1] == stat_values(beds)[1] + 1
+
+
+def test_remove_student_is_not_served_stale(client, app):
+    client.post('/add_student', data={'name': 'Grace Hopper', 'student_id': 'S200', 'room_id': room_pk(app, '102')})
+    assert b'Grace Hopper' in client.get('/dashboard').data
+    beds = client.get('/beds').data
+
+    client.post(f'/remove_student/{student_pk(app, "S200")}')
+
+    assert b'Grace Hopper' not in client.get('/dashboard').data
+    after = client.get('/beds').data
+    assert taken_beds(after) == taken_beds(beds) - 1
+    assert stat_values(after)[1] == stat_values(beds)[1] - 1
+
+
+def test_add_room_is_not_served_stale(client):
+    dashboard, beds = client.get('/dashboard').data, client.get('/beds').data
+    assert b'777' not in dashboard and b'777' not in beds
+
+    client.post('/add_room', data={'room_number': '777', 'capacity': 3})
+
+    assert b'777' in client.get('/dashboard').data
+    after = client.get('/beds').data
+    assert b'777' in after
+    assert stat_values(after)[0] == stat_values(beds)[0] + 3
+
+
+def test_edit_room_is_not_served_stale(client, app):
+    room_id = room_pk(app, '103')
+    dashboard, beds = client.get('/dashboard').data, client.get('/beds').data
+
+    client.post(f'/edit_room/{room_id}', data={'capacity': 9})
+
+    # Room 103 grows from 3 beds to 9
+    assert stat_values(client.get('/beds').data)[0] == stat_values(beds)[0] + 6
+    assert stat_values(client.get('/dashboard').data)[3] == stat_values(dashboard)[3] + 6
+
+
+def test_unused_query_arguments_share_one_entry(client, app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'FRAGMENT_CACHE_PATH', str(tmp_path / 'fragments.db'))
+    client.get('/dashboard')
+    misses = client.get('/api/cache/stats').get_json()['misses']
+
+    for number in range(20):
+        assert client.get(f'/dashboard?junk={number}').status_code == 200
+
+    stats = client.get('/api/cache/stats').get_json()
+    assert stats['misses'] == misses
+    assert b'junk' not in client.get('/dashboard?junk=1&room_page=1').data
+
+
+def test_shared_store_is_bounded(client, app, tmp_path, monkeypatch):
+    path = tmp_path / 'fragments.db'
+    monkeypatch.setitem(app.config, 'FRAGMENT_CACHE_PATH', str(path))
+    monkeypatch.setitem(app.config, 'FRAGMENT_CACHE_SIZE', 8)
+
+    for number in range(1, 21):
+        client.get(f'/dashboard?room_page={number}')
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM fragment').fetchone()[0] == 8
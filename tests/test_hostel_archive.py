@@ -0,0 +1,69 @@
+import gzip
+import json
+import os
+
+from app import HostelOccupancyDaily, Room, Student
+
+from conftest import DATA_DIR
+
+
+def export(app):
+    path = os.path.join(DATA_DIR, 'hostel.jsonl.gz')
+    result = app.test_cli_runner().invoke(args=['export-hostel', path])
+    assert result.exit_code == 0, result.output
+    return path
+
+
+# Rewrites one column of an archive the way an older release wrote it:
+# left out entirely, or present with NULL in every row
+def rewrite(path, table, column, drop=False):
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        lines = [json.loads(line) for line in archive]
+    current = index = None
+    for line in lines:
+        if isinstance(line, dict):
+            current = line.get('table')
+            if current == table:
+                index = line['columns'].index(column)
+                if drop:
+                    del line['columns'][index]
+        elif current == table:
+            if drop:
+                del line[index]
+            else:
+                line[index] = None
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        for line in lines:
+            archive.write(json.dumps(line) + '\n')
+
+
+def import_archive(app, path):
+    result = app.test_cli_runner().invoke(args=['import-hostel', path, '--replace', '--yes'])
+    assert result.exit_code == 0, result.output
+
+
+def test_import_fills_null_bed_masks(client, app):
+    client.post('/add_student', data={'name': 'Ada Lovelace', 'student_id': 'S100', 'room_id': 1})
+    path = export(app)
+
+    rewrite(path, 'room', 'bed_mask')
+    import_archive(app, path)
+
+    with app.app_context():
+        assert Room.query.count() > 0
+        assert Room.query.filter(Room.bed_mask.is_(None)).count() == 0
+        assert Student.query.filter_by(student_id='S100').one().room_id == 1
+
+
+def test_import_fills_missing_columns(client, app):
+    client.post('/add_student', data={'name': 'Ada Lovelace', 'student_id': 'S100', 'room_id': 1})
+    path = export(app)
+
+    rewrite(path, 'room', 'bed_mask', drop=True)
+    rewrite(path, 'hostel_occupancy_daily', 'peak', drop=True)
+    import_archive(app, path)
+
+    with app.app_context():
+        assert Room.query.filter(Room.bed_mask.is_(None)).count() == 0
+        days = HostelOccupancyDaily.query.all()
+        assert days and all(day.peak == 0 for day in days)
@@ -0,0 +1,18 @@
+from flask import g
+
+from app import AuditLog
+
+
+def audit_actions(app, slug):
+    with app.app_context():
+        g.hostel = slug
+        return [entry.action for entry in AuditLog.query.order_by(AuditLog.id)]
+
+
+def test_login_and_logout_are_audited_in_the_hostel_database(app, east):
+    client = app.test_client()
+    assert client.post('/h/east/login', data={'username': 'admin', 'password': 'admin123'}).status_code == 302
+    assert client.get('/h/east/logout').status_code == 302
+
+    assert audit_actions(app, 'east') == ['login', 'logout']
+    assert 'login' not in audit_actions(app, 'main')
@@ -0,0 +1,29 @@
+from flask import g
+
+from app import claim_job, run_job
+
+
+def run_queued_job(app, slug):
+    with app.app_context():
+        g.hostel = slug
+        run_job(claim_job('test', 1), 'test')
+
+
+def test_job_results_are_kept_per_hostel(client, app, east, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_RESULTS_DIR', str(tmp_path))
+    client.post('/add_student', data={'name': 'Main Resident', 'student_id': 'S100', 'room_id': 1})
+    client.post('/h/east/add_room', data={'room_number': '101', 'capacity': 2})
+    client.post('/h/east/add_student', data={'name': 'East Resident', 'student_id': 'S200', 'room_id': 1})
+
+    for prefix, slug in (('', 'main'), ('/h/east', 'east')):
+        response = client.post(f'{prefix}/api/jobs', json={'kind': 'audit_export'})
+        assert response.status_code == 202
+        assert response.get_json()['id'] == 1
+        run_queued_job(app, slug)
+
+    main = client.get('/api/jobs/1/result')
+    east = client.get('/h/east/api/jobs/1/result')
+
+    assert main.status_code == 200 and east.status_code == 200
+    assert b'Main Resident' in main.data and b'East Resident' not in main.data
+    assert b'East Resident' in east.data and b'Main Resident' not in east.data
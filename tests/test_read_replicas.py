@@ -0,0 +1,34 @@
+import pytest
+
+from app import read_replicas
+
+
+@pytest.fixture
+def copy_replica(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'READ_REPLICA', 'copy')
+    monkeypatch.setitem(app.config, 'REPLICA_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'REPLICA_REFRESH_SECONDS', 0)
+    return app
+
+
+def refresh(app):
+    with app.app_context():
+        return read_replicas.refresh_if_due()
+
+
+def test_fresh_copy_serves_reads(copy_replica, client):
+    assert refresh(copy_replica)
+    assert client.get('/dashboard').headers['X-Served-From'] == 'replica'
+
+
+def test_copy_slower_than_the_staleness_bound_keeps_reads_on_the_primary(copy_replica, client, monkeypatch):
+    # Every copy takes longer than this
+    monkeypatch.setitem(copy_replica.config, 'REPLICA_MAX_STALENESS', 0.000001)
+
+    assert refresh(copy_replica)
+    assert client.get('/dashboard').headers['X-Served-From'] == 'primary'
+    # No back to back copies once the bound is known to be out of reach
+    assert not refresh(copy_replica)
+
+    monkeypatch.setitem(copy_replica.config, 'REPLICA_SLOW_RETRY_SECONDS', 0)
+    assert refresh(copy_replica)
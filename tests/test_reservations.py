@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+
+from app import Reservation, Room, Student
+
+
+def room_pk(app, room_number):
+    with app.app_context():
+        return Room.query.filter_by(room_number=room_number).one().id
+
+
+def reserve(client, app, student_id, room_number, start, end):
+    client.post('/reservations', data={'name': f'Guest {student_id}', 'student_id': student_id,
+                                       'room_id': room_pk(app, room_number),
+                                       'start_date': start.isoformat(), 'end_date': end.isoformat()})
+
+
+def test_check_in_to_the_reserved_room_consumes_the_reservation(client, app):
+    today = date.today()
+    reserve(client, app, 'S1', '101', today, today + timedelta(days=2))
+
+    client.post('/add_student', data={'name': 'Guest S1', 'student_id': 'S1', 'room_id': room_pk(app, '101')})
+
+    with app.app_context():
+        assert Reservation.query.filter_by(student_id='S1').one().status == 'checked_in'
+
+
+def test_check_in_to_another_room_is_a_walk_in(client, app):
+    today = date.today()
+    reserve(client, app, 'S1', '101', today, today + timedelta(days=2))
+    reserve(client, app, 'S2', '103', today, today + timedelta(days=2))
+    # Both beds of room 102 are booked from next week
+    for student_id in ('S3', 'S4'):
+        reserve(client, app, student_id, '102', today + timedelta(days=7), today + timedelta(days=9))
+
+    client.post('/add_student', data={'name': 'Guest S1', 'student_id': 'S1', 'room_id': room_pk(app, '201')})
+    # A walk-in has no end date, so room 102 has no bed for it
+    client.post('/add_student', data={'name': 'Guest S2', 'student_id': 'S2', 'room_id': room_pk(app, '102')})
+
+    with app.app_context():
+        assert Reservation.query.filter_by(student_id='S1').one().status == 'reserved'
+        assert Student.query.filter_by(student_id='S1').one().room.room_number == '201'
+        assert Reservation.query.filter_by(student_id='S2').one().status == 'reserved'
+        assert Student.query.filter_by(student_id='S2').first() is None
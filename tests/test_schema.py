@@ -0,0 +1,19 @@
+from sqlalchemy import text
+
+from app import db, upgrade_schema, reconcile_occupancy, Room
+
+
+def test_upgrade_adds_bed_mask_with_a_default(app):
+    # A database from before beds were numbered
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE room DROP COLUMN bed_mask'))
+        db.engine.dispose()
+
+        upgrade_schema()
+
+        assert [room.bed_mask for room in Room.query] == [0, 0, 0, 0]
+        with db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO room (room_number, capacity, occupied) VALUES ('999', 2, 0)"))
+        assert Room.query.filter_by(room_number='999').one().bed_mask == 0
+        assert reconcile_occupancy(full=True)['mismatches'] == []
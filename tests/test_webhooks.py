@@ -0,0 +1,80 @@
+import http.server
+import json
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app import db, deliver_webhooks, WebhookSubscriber
+
+
+@pytest.fixture
+def sink():
+    sink = SimpleNamespace(batches=[], on_batch=None)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            sink.batches.append([event['id'] for event in body['events']])
+            if sink.on_batch:
+                sink.on_batch()
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sink.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    yield sink
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def subscriber(app, client, sink, monkeypatch):
+    monkeypatch.setitem(app.config, 'WEBHOOK_BATCH_SIZE', 1)
+    for number in ('501', '502', '503'):
+        client.post('/add_room', data={'room_number': number, 'capacity': 2})
+    result = app.test_cli_runner().invoke(args=['add-webhook', 'rooms', sink.url, '--events', 'room.added',
+                                                '--from-start'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        yield WebhookSubscriber.query.filter_by(name='rooms').one().id, db.engine.url.database
+
+
+def leased_until(path, subscriber_id):
+    with sqlite3.connect(path) as conn:
+        return conn.execute('SELECT leased_until FROM webhook_subscriber WHERE id = ?', (subscriber_id,)).fetchone()[0]
+
+
+def test_lease_is_renewed_for_every_batch(app, sink, subscriber):
+    subscriber_id, path = subscriber
+    leases = []
+    sink.on_batch = lambda: leases.append(leased_until(path, subscriber_id))
+
+    with app.app_context():
+        assert deliver_webhooks(subscriber_id) == 3
+
+    assert sink.batches == [[1], [2], [3]]
+    assert len(set(leases)) == 3 and leases == sorted(leases)
+    assert leased_until(path, subscriber_id) is None
+
+
+def test_delivery_stops_once_another_worker_holds_the_lease(app, sink, subscriber):
+    subscriber_id, path = subscriber
+    taken = '2999-01-01 00:00:00.000000'
+
+    def steal():
+        with sqlite3.connect(path) as conn:
+            conn.execute('UPDATE webhook_subscriber SET leased_until = ? WHERE id = ?', (taken, subscriber_id))
+    sink.on_batch = steal
+
+    with app.app_context():
+        assert deliver_webhooks(subscriber_id) == 1
+
+    assert sink.batches == [[1]]
+    # The other worker's lease is left alone
+    assert leased_until(path, subscriber_id) == taken
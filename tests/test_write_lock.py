@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import Room, db
+
+
+@pytest.fixture
+def statements(app):
+    with app.app_context():
+        engine = db.engine
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def locked_before_reading_rooms(statements):
+    assert 'BEGIN IMMEDIATE' in statements
+    first_room_read = next(i for i, statement in enumerate(statements) if 'FROM room' in statement)
+    return statements.index('BEGIN IMMEDIATE') < first_room_read
+
+
+def test_add_room_takes_the_write_lock_first(client, statements):
+    client.post('/add_room', data={'room_number': '777', 'capacity': 3})
+
+    assert locked_before_reading_rooms(statements)
+
+
+def test_edit_room_takes_the_write_lock_first(client, app, statements):
+    with app.app_context():
+        room_id = Room.query.filter_by(room_number='103').one().id
+    statements.clear()
+
+    client.post(f'/edit_room/{room_id}', data={'capacity': 5})
+
+    assert locked_before_reading_rooms(statements)
+
+
+def test_reconcile_repair_takes_the_write_lock_first(client, statements):
+    client.post('/api/occupancy/reconcile', json={'repair': True, 'full': True})
+
+    assert locked_before_reading_rooms(statements)
+
+
+def test_reservation_takes_the_write_lock_first(client, statements):
+    today = date.today()
+    client.post('/reservations', data={'name': 'Ada Lovelace', 'student_id': 'S100', 'room_id': 1,
+                                       'start_date': today.isoformat(),
+                                       'end_date': (today + timedelta(days=2)).isoformat()})
+
+    assert locked_before_reading_rooms(statements)